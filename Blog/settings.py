@@ -1,8 +1,11 @@
 import os
+import tempfile
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 import mongoengine
 
+from blogapp.instrumentation import CommandTimer
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -19,8 +22,11 @@ ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='127.0.0.1,localhost').split(','
 MONGODB_URI = config('MONGODB_URI', default='mongodb://localhost:27017/blog_db')
 MONGODB_DB_NAME = config('MONGODB_DB_NAME', default='blog_db')
 
-# Connect to MongoDB using MongoEngine
-mongoengine.connect(MONGODB_DB_NAME, host=MONGODB_URI)
+# Connect to MongoDB using MongoEngine; CommandTimer records every command for
+# per-request Server-Timing, logs and the slow-command log (blogapp/instrumentation.py)
+mongoengine.connect(MONGODB_DB_NAME, host=MONGODB_URI, event_listeners=[CommandTimer()])
+MONGO_SLOW_COMMAND_MS = config('MONGO_SLOW_COMMAND_MS', default=100.0, cast=float)
+SERVER_TIMING = config('SERVER_TIMING', default=DEBUG, cast=bool)
 
 # Django still needs a database backend for sessions, admin, and auth
 DATABASES = {
@@ -45,6 +51,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'blogapp.profiling.ProfilingMiddleware',
+    'blogapp.metrics.MetricsMiddleware',
+    'blogapp.instrumentation.MongoTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', 
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -52,6 +61,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'blogapp.identity.IdentityMapMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -138,10 +148,108 @@ else:
 # Pagination settings
 POSTS_PER_PAGE = 9
 
+# Caching: pages and fragments are keyed by tag versions (see blogapp/caching.py).
+# The file backend is shared by all workers on a host; set CACHE_BACKEND to a
+# shared service (e.g. django.core.cache.backends.redis.RedisCache) for multi-host setups.
+# Single-flight fragment builds need an atomic lock shared by every worker. Redis or
+# memcached provide one through add(); the default file cache is only atomic on one
+# host, where TieredCache takes O_EXCL lock files instead. Use Redis or memcached
+# when workers run on several hosts.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'animeverse-cache')),
+    }
+}
+PAGE_CACHE_TIMEOUT = config('PAGE_CACHE_TIMEOUT', default=300, cast=int)
+FRAGMENT_CACHE_TIMEOUT = config('FRAGMENT_CACHE_TIMEOUT', default=600, cast=int)
+FRAGMENT_CACHE_STALE = config('FRAGMENT_CACHE_STALE', default=120, cast=int)  # serve-stale window
+CACHE_TTL_JITTER = config('CACHE_TTL_JITTER', default=0.1, cast=float)
+CACHE_LOCK_TIMEOUT = config('CACHE_LOCK_TIMEOUT', default=10, cast=int)
+LOCAL_CACHE_MAX_ENTRIES = config('LOCAL_CACHE_MAX_ENTRIES', default=512, cast=int)
+
+# Edge caching of detail pages for anonymous readers (views counted by a beacon,
+# comment form and messages loaded per reader)
+DETAIL_EDGE_CACHE = config('DETAIL_EDGE_CACHE', default=False, cast=bool)
+DETAIL_EDGE_MAX_AGE = config('DETAIL_EDGE_MAX_AGE', default=300, cast=int)
+DETAIL_BROWSER_MAX_AGE = config('DETAIL_BROWSER_MAX_AGE', default=60, cast=int)
+VIEW_BEACON_WINDOW = config('VIEW_BEACON_WINDOW', default=1800, cast=int)  # seconds between counted beacons per address and post
+
+# Conditional GET: bump ETAG_VERSION on deploys that change templates
+ETAG_VERSION = config('ETAG_VERSION', default='1')
+STATIC_MAX_AGE = config('STATIC_MAX_AGE', default=3600, cast=int)
+
+# Search: 'text' uses the weighted text index, 'substring' forces the icontains fallback
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='text')
+
+# Related posts (blogapp/related.py): ids stored per post, weights of each similarity signal
+RELATED_POSTS_STORED = config('RELATED_POSTS_STORED', default=8, cast=int)
+RELATED_DIMENSIONS = config('RELATED_DIMENSIONS', default=256, cast=int)
+RELATED_WEIGHTS = {'text': 1.0, 'tags': 1.0, 'category': 0.3, 'studio': 0.5}
+RELATED_MIN_SCORE = config('RELATED_MIN_SCORE', default=0.2, cast=float)
+# Saves queue the post; `manage.py rebuild_related_posts --pending` rescores the queue
+RELATED_UPDATE_ON_SAVE = config('RELATED_UPDATE_ON_SAVE', default=True, cast=bool)
+
+# Trending ranking (manage.py compute_trending, run periodically): hourly view buckets
+# within the window, halved every TRENDING_HALF_LIFE_HOURS, boosted by rating
+TRENDING_WINDOW_HOURS = config('TRENDING_WINDOW_HOURS', default=72, cast=int)
+TRENDING_HALF_LIFE_HOURS = config('TRENDING_HALF_LIFE_HOURS', default=12.0, cast=float)
+TRENDING_RATING_BOOST = config('TRENDING_RATING_BOOST', default=0.5, cast=float)
+TRENDING_SIZE = config('TRENDING_SIZE', default=50, cast=int)
+
+# View counting: 'buffered' batches $inc writes per worker, 'sync' writes one $inc per hit
+VIEW_COUNTER_MODE = config('VIEW_COUNTER_MODE', default='buffered')
+VIEW_COUNTER_FLUSH_INTERVAL = config('VIEW_COUNTER_FLUSH_INTERVAL', default=5.0, cast=float)
+
 # Image upload settings
+# 'async' uploads on a per-worker thread pool after the post is saved, 'sync' inside the request.
+# IMAGE_UPLOADER is any class with upload(image, folder) -> url; blogapp.uploads.LocalUploader
+# stores files under MEDIA_ROOT and is also the fallback when the uploader fails.
+IMAGE_UPLOAD_MODE = config('IMAGE_UPLOAD_MODE', default='async')
+IMAGE_UPLOAD_WORKERS = config('IMAGE_UPLOAD_WORKERS', default=4, cast=int)
+IMAGE_UPLOADER = config('IMAGE_UPLOADER', default='blogapp.uploads.CloudinaryUploader')
+# An async upload that fails on both the uploader and the fallback is retried with exponential
+# backoff (IMAGE_UPLOAD_RETRY_DELAY, then twice that, ...) up to IMAGE_UPLOAD_ATTEMPTS in total;
+# after that the reason is stored in Post.upload_errors and the placeholder stays.
+IMAGE_UPLOAD_ATTEMPTS = config('IMAGE_UPLOAD_ATTEMPTS', default=3, cast=int)
+IMAGE_UPLOAD_RETRY_DELAY = config('IMAGE_UPLOAD_RETRY_DELAY', default=30.0, cast=float)
+IMAGE_PLACEHOLDER = STATIC_URL + 'images/placeholder.svg'
+# Responsive derivatives of featured images (WebP + JPEG per width, see blogapp/images.py)
+IMAGE_VARIANT_WIDTHS = config('IMAGE_VARIANT_WIDTHS', default='320,640,960,1280', cast=Csv(int))
+IMAGE_VARIANT_QUALITY = config('IMAGE_VARIANT_QUALITY', default=80, cast=int)
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 
+# Prometheus metrics at /metrics, summed over every worker through per-process files
+METRICS_DIR = config('METRICS_DIR', default=os.path.join(tempfile.gettempdir(), 'animeverse-metrics'))
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5.0, cast=float)
+# Scrapes need "Authorization: Bearer <token>" or an allowed address; with neither set /metrics is closed
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='', cast=Csv())
+
+# Opt-in cProfile of live requests (blogapp/profiling.py); browse the files under admin "Request Profiles"
+PROFILE_SAMPLE_RATE = config('PROFILE_SAMPLE_RATE', default=0.0, cast=float)  # share of all requests, 0 = admin-requested only
+PROFILE_DIR = config('PROFILE_DIR', default=os.path.join(tempfile.gettempdir(), 'animeverse-profiles'))
+PROFILE_MAX_FILES = config('PROFILE_MAX_FILES', default=200, cast=int)
+PROFILE_TOKEN_MAX_AGE = config('PROFILE_TOKEN_MAX_AGE', default=3600, cast=int)
+PROFILE_COOKIE = 'blog_profile'
+
+# One structured (JSON) line per request from blogapp.instrumentation, plus slow Mongo commands
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'blogapp.instrumentation': {
+            'handlers': ['console'],
+            'level': config('REQUEST_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Security settings for production
 SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
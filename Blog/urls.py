@@ -16,15 +16,16 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path , include
-from django.views.static import serve
+from django.conf.urls.static import static
 
 from django.conf import settings
+from blogapp.conditional import serve_static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path(
         'static/<path:path>',
-        serve,
+        serve_static,
         {
             'document_root': settings.STATICFILES_DIRS[0]
             if getattr(settings, 'STATICFILES_DIRS', None)
@@ -1,9 +1,15 @@
 from django import forms
 from django.contrib import admin, messages
+from django.http import FileResponse, Http404
 from django.shortcuts import redirect, render
 from django.urls import path
 from django.utils.text import slugify
 
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from . import identity, profiling
+from .listings import fetch_cards, prefetch_taxonomy
 from .models import Category, Post
 
 
@@ -37,7 +43,7 @@ class PostAdminForm(forms.Form):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields["category"].choices = [("", "---------")] + [
-            (str(c.id), c.name) for c in Category.objects.order_by("name")
+            (str(c.id), c.name) for c in identity.all_documents(Category)
         ]
 
 
@@ -49,8 +55,8 @@ def _get_category(category_id):
     if not category_id:
         return None
     try:
-        return Category.objects(id=category_id).first()
-    except:
+        return identity.get(Category, ObjectId(category_id))
+    except (InvalidId, TypeError):
         return None
 
 
@@ -72,7 +78,7 @@ def admin_dashboard(request):
         "published_count": Post.objects(status="published").count(),
         "draft_count": Post.objects(status="draft").count(),
         "category_count": Category.objects.count(),
-        "recent_posts": Post.objects.order_by("-created_at")[:10],
+        "recent_posts": prefetch_taxonomy(fetch_cards(Post.objects.order_by("-created_at")[:10]), tags=False),
     }
     return render(request, "admin/blogapp/dashboard.html", context)
 
@@ -178,7 +184,7 @@ def post_manager(request):
     context = {
         **admin.site.each_context(request),
         "form": form,
-        "posts": Post.objects.order_by("-created_at")[:50],
+        "posts": prefetch_taxonomy(fetch_cards(Post.objects.order_by("-created_at")[:50]), tags=False),
     }
     return render(request, "admin/blogapp/post_manager.html", context)
 
@@ -197,6 +203,52 @@ def delete_post(request, post_id):
     return redirect("admin:blogapp_post_manager")
 
 
+# =========================
+# 🔹 REQUEST PROFILES
+# =========================
+
+def profile_list(request):
+    if not _check_admin(request):
+        return redirect("admin:index")
+
+    cookie = profiling.cookie_name()
+    if request.method == "POST":
+        response = redirect("admin:blogapp_profiles")
+        if request.POST.get("action") == "start":
+            response.set_cookie(
+                cookie, profiling.make_token(request.user),
+                max_age=profiling.token_max_age(),
+                httponly=True, secure=request.is_secure(), samesite="Lax",
+            )
+            messages.success(request, "Your requests in this browser will be profiled")
+        else:
+            response.delete_cookie(cookie)
+            messages.success(request, "Profiling stopped")
+        return response
+
+    context = {
+        **admin.site.each_context(request),
+        "profiles": profiling.list_profiles(),
+        "profiling_on": profiling.token_valid(request.COOKIES.get(cookie)),
+        "header": profiling.HEADER,
+        "token": profiling.make_token(request.user),
+        "token_max_age": profiling.token_max_age(),
+        "sample_rate": profiling.sample_rate(),
+        "directory": profiling.profile_dir(),
+    }
+    return render(request, "admin/blogapp/profiles.html", context)
+
+
+def profile_download(request, name):
+    if not _check_admin(request):
+        return redirect("admin:index")
+
+    path = profiling.profile_path(name)
+    if path is None:
+        raise Http404("Profile not found")
+    return FileResponse(open(path, "rb"), as_attachment=True, filename=name)
+
+
 # =========================
 # 🔹 CUSTOM ADMIN URLS
 # =========================
@@ -215,6 +267,8 @@ def get_urls():
         path("blogapp/categories/<str:category_id>/delete/", admin.site.admin_view(delete_category), name="blogapp_delete_category"),
         path("blogapp/posts/", admin.site.admin_view(post_manager), name="blogapp_post_manager"),
         path("blogapp/posts/<str:post_id>/delete/", admin.site.admin_view(delete_post), name="blogapp_delete_post"),
+        path("blogapp/profiles/", admin.site.admin_view(profile_list), name="blogapp_profiles"),
+        path("blogapp/profiles/<str:name>/", admin.site.admin_view(profile_download), name="blogapp_profile_download"),
     ]
 
     return custom_urls + urls
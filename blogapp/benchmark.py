@@ -0,0 +1,286 @@
+"""Latency benchmark of the public views at several corpus sizes.
+
+``run_benchmark`` points mongoengine at a throwaway database (mongomock in
+memory, or a database on a local ``mongod``), seeds it with the synthetic
+corpus (``blogapp.corpus``) of each requested size and drives every view
+through the Django test client, the full middleware stack included. Each
+view is measured twice: ``cold`` clears the page and fragment caches before
+every request, ``warm`` lets them fill as they would in production. Views
+are counted synchronously during the run, so no buffered hit outlives the
+throwaway database.
+
+Per view it reports p50/p95/p99 latency, Mongo commands per request (from
+the ``MongoTimingMiddleware`` stats) and the peak Python heap allocated
+while serving a request (tracemalloc, measured in a separate pass so its
+overhead stays out of the latencies).
+"""
+import logging
+import os
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import wraps
+
+import django
+import mongoengine
+import numpy as np
+from django.conf import settings
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from . import instrumentation
+
+VIEWS = ('index', 'detail', 'archive', 'search', 'category_posts', 'tag_posts')
+MODES = ('cold', 'warm')
+CORPUS_END = datetime(2025, 1, 1)  # fixed, so every run benchmarks the same documents
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}}
+
+# mongomock does not emit pymongo command events, so its collection methods are counted directly
+MONGOMOCK_COMMANDS = {
+    'find': 'find', 'find_one': 'find', 'aggregate': 'aggregate', 'count_documents': 'aggregate',
+    'estimated_document_count': 'count', 'distinct': 'distinct', 'insert_one': 'insert',
+    'insert_many': 'insert', 'update_one': 'update', 'update_many': 'update', 'replace_one': 'update',
+    'find_one_and_update': 'findAndModify', 'delete_one': 'delete', 'delete_many': 'delete',
+    'bulk_write': 'bulkWrite',
+}
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 2) if values else None
+
+
+@contextmanager
+def _count_mongomock_commands():
+    from mongomock.collection import Collection
+
+    depth = {'value': 0}  # find_one calls find, count_documents calls aggregate...
+
+    def counted(method, command):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stats = instrumentation.current()
+            if stats is None or depth['value']:
+                return method(self, *args, **kwargs)
+            depth['value'] += 1
+            started = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                depth['value'] -= 1
+                stats.add(command, self.name, (time.perf_counter() - started) * 1000)
+        return wrapper
+
+    originals = {name: getattr(Collection, name) for name in MONGOMOCK_COMMANDS if hasattr(Collection, name)}
+    for name, method in originals.items():
+        setattr(Collection, name, counted(method, MONGOMOCK_COMMANDS[name]))
+    try:
+        yield
+    finally:
+        for name, method in originals.items():
+            setattr(Collection, name, method)
+
+
+@contextmanager
+def benchmark_database(backend, database, host=None):
+    """Connect the default alias to a throwaway database, restoring the configured one afterwards"""
+    from .viewcounter import view_counter
+
+    if database == settings.MONGODB_DB_NAME:
+        raise ValueError(f'refusing to benchmark against the configured database {database!r}')
+    if backend == 'mongomock':
+        try:
+            import mongomock
+        except ImportError:
+            raise ValueError('the mongomock backend needs the mongomock package (pip install -r requirements-dev.txt)')
+
+    # Hits buffered so far belong to the configured database; the benchmark's own hits are
+    # written as they happen, so none are left to be flushed into it after the switch back
+    view_counter.flush()
+    mode, view_counter.mode = view_counter.mode, 'sync'
+    mongoengine.disconnect()
+    if backend == 'mongomock':
+        mongoengine.connect(database, host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        counting = _count_mongomock_commands()
+    else:
+        mongoengine.connect(database, host=host or 'mongodb://localhost:27017',
+                            event_listeners=[instrumentation.CommandTimer()])
+        counting = nullcontext()
+    connection = mongoengine.get_connection()
+    connection.drop_database(database)
+    try:
+        with counting:
+            yield
+    finally:
+        view_counter.flush()
+        view_counter.mode = mode
+        connection.drop_database(database)
+        mongoengine.disconnect()
+        mongoengine.connect(settings.MONGODB_DB_NAME, host=settings.MONGODB_URI,
+                            event_listeners=[instrumentation.CommandTimer()])
+
+
+def seed_corpus(posts, seed=0):
+    """Fill the connected database with the synthetic corpus and its derived data"""
+    from .corpus import Corpus, generate
+    from .related import rebuild_related
+    from .trending import compute_trending
+
+    # In this process: worker processes would connect to the configured database, not this one
+    generate(Corpus(posts, seed=seed, end=CORPUS_END), workers=1)
+    rebuild_related()
+    compute_trending()
+
+
+def _targets(view, rng, count):
+    """count URLs for a view, spread over the seeded posts and taxonomy"""
+    from .models import Category, Post, Tag
+
+    if view == 'index':
+        return ['/'] * count
+    if view == 'archive':
+        return ['/archive/'] * count
+    if view == 'detail':
+        slugs = [row['slug'] for row in Post._get_collection().find({'status': 'published'}, {'slug': 1}, limit=500)]
+        return [f'/{rng.choice(slugs)}/' for _ in range(count)]
+    if view == 'search':
+        titles = [row['title'] for row in Post._get_collection().find({}, {'title': 1}, limit=200)]
+        words = sorted({word.lower() for title in titles for word in title.split() if len(word) > 3})
+        return [f'/search/?q={rng.choice(words)}' for _ in range(count)]
+    # Taxonomy pages are requested in proportion to their size, like real traffic
+    document_cls, prefix = (Category, 'category') if view == 'category_posts' else (Tag, 'tag')
+    rows = list(document_cls._get_collection().find({'published_count': {'$gt': 0}}, {'slug': 1, 'published_count': 1}))
+    slugs = rng.choices([row['slug'] for row in rows], [row['published_count'] for row in rows], k=count)
+    return [f'/{prefix}/{slug}/' for slug in slugs]
+
+
+def _clear_caches():
+    from django.core.cache import cache
+    from .caching import tiered_cache
+
+    cache.clear()
+    tiered_cache().local.clear()
+
+
+def _measure(client, urls, cold):
+    latencies, queries, mongo_ms = [], [], []
+    for url in urls:
+        if cold:
+            _clear_caches()
+        started = time.perf_counter()
+        response = client.get(url)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {url} returned {response.status_code}')
+        stats = getattr(response.wsgi_request, 'mongo_stats', None)
+        queries.append(stats.commands if stats else 0)
+        mongo_ms.append(stats.duration_ms if stats else 0.0)
+    return latencies, queries, mongo_ms
+
+
+def _peak_memory(client, urls, cold):
+    """Largest heap growth (bytes) while serving one of urls"""
+    peak = 0
+    tracemalloc.start()
+    try:
+        for url in urls:
+            if cold:
+                _clear_caches()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            client.get(url)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def benchmark_view(client, view, mode, requests, warmup=3, memory_requests=5, seed=0):
+    """One result row: latency percentiles, commands per request and peak memory"""
+    rng = random.Random(f'{seed}-{view}')
+    cold = mode == 'cold'
+    _clear_caches()
+    _measure(client, _targets(view, rng, warmup), cold)
+    latencies, queries, mongo_ms = _measure(client, _targets(view, rng, requests), cold)
+    return {
+        'view': view,
+        'mode': mode,
+        'requests': requests,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': round(float(np.mean(latencies)), 2),
+            'max': round(max(latencies), 2),
+        },
+        'mongo_commands': {'mean': round(float(np.mean(queries)), 2), 'max': max(queries)},
+        'mongo_ms': {'mean': round(float(np.mean(mongo_ms)), 2), 'p95': percentile(mongo_ms, 95)},
+        'peak_memory_kb': round(_peak_memory(client, _targets(view, rng, memory_requests), cold) / 1024, 1),
+    }
+
+
+def _revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes, views=VIEWS, modes=MODES, requests=50, warmup=3, memory_requests=5, seed=0,
+                  backend='mongomock', database='blog_benchmark', host=None, progress=None):
+    """Benchmark every view at every corpus size; returns a JSON-serialisable report"""
+    report = {
+        'meta': {
+            'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'revision': _revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'backend': backend,
+            'seed': seed,
+            'requests': requests,
+            'pid': os.getpid(),
+        },
+        'results': [],
+    }
+    overrides = {'CACHES': BENCHMARK_CACHES, 'DEBUG': False, 'DETAIL_EDGE_CACHE': False}
+    if backend == 'mongomock':
+        overrides['SEARCH_BACKEND'] = 'substring'  # mongomock has no $text
+    request_log = logging.getLogger('blogapp.instrumentation')
+    log_level = request_log.level
+    request_log.setLevel(logging.WARNING)  # keep the per-request lines out of the report
+    setup_test_environment()
+    try:
+        with override_settings(**overrides), benchmark_database(backend, database, host):
+            for size in sizes:
+                mongoengine.get_connection().drop_database(database)
+                started = time.perf_counter()
+                seed_corpus(size, seed)
+                if progress:
+                    progress(f'seeded {size} posts in {time.perf_counter() - started:.1f}s')
+                client = Client()
+                for view in views:
+                    for mode in modes:
+                        row = {'posts': size, **benchmark_view(
+                            client, view, mode, requests, warmup, memory_requests, seed,
+                        )}
+                        report['results'].append(row)
+                        if progress:
+                            progress(format_row(row))
+    finally:
+        teardown_test_environment()
+        request_log.setLevel(log_level)
+    return report
+
+
+def format_row(row):
+    latency = row['latency_ms']
+    return (
+        f"{row['posts']:>8} {row['view']:<15} {row['mode']:<5} "
+        f"p50 {latency['p50']:>8.2f}ms  p95 {latency['p95']:>8.2f}ms  p99 {latency['p99']:>8.2f}ms  "
+        f"{row['mongo_commands']['mean']:>5.1f} cmds  {row['peak_memory_kb']:>9.1f} KB"
+    )
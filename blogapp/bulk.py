@@ -0,0 +1,332 @@
+"""
+Bulk JSONL import and export for categories, tags, posts and comments.
+
+Each line is one JSON object with a "kind" field. References are written by
+name (category, tags) and by slug (a comment's post) so files stay readable
+and portable between databases; ids are kept when present so re-importing the
+same file skips what is already stored instead of duplicating it. Records
+without an id get one derived from their line number and content, so a
+resumed import skips the ones a failed chunk had already written.
+"""
+import hashlib
+import json
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from bson import ObjectId
+from django.utils.text import slugify
+from mongoengine import DateTimeField
+from mongoengine.errors import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .caching import invalidate, POSTS, TAXONOMY, COMMENTS
+from .models import Category, Tag, Post, Comment, allocate_slugs, _apply_count_deltas
+
+KINDS = {'category': Category, 'tag': Tag, 'post': Post, 'comment': Comment}
+DUPLICATE_KEY = 11000
+DERIVED_FIELDS = {'published_count'}  # Recomputed from the imported posts
+SLUG_ATTEMPTS = 3  # Allocations of a post slug before a concurrent writer wins
+
+
+class RecordError(ValueError):
+    """A JSONL record that cannot be imported, with its line number"""
+
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def _encode(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _names(value):
+    """A category name or a list of tag names as a list"""
+    if not value:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def record_id(line, record):
+    """Deterministic ObjectId for a record stored without one"""
+    digest = hashlib.sha256(f'{line}|{json.dumps(record, sort_keys=True)}'.encode()).digest()
+    return str(ObjectId(digest[:12]))
+
+
+def dumps(record):
+    """One JSONL line for a record"""
+    return json.dumps(record, ensure_ascii=False, default=_encode) + '\n'
+
+
+def _insert(collection, documents):
+    """insert_many that skips documents already stored.
+
+    Returns the indexes written and the indexes rejected by another unique
+    index (a slug or name taken by a different document), which the caller
+    must resolve rather than count as already imported.
+    """
+    if not documents:
+        return [], []
+    try:
+        collection.insert_many(documents, ordered=False)
+        return list(range(len(documents))), []
+    except BulkWriteError as error:
+        errors = error.details.get('writeErrors', [])
+        if any(item.get('code') != DUPLICATE_KEY for item in errors):
+            raise
+        # keyPattern names the violated index; servers (and mongomock) that omit it are
+        # answered by checking which of the rejected ids are actually stored
+        unknown = [documents[item['index']]['_id'] for item in errors if 'keyPattern' not in item]
+        stored = {
+            row['_id'] for row in collection.find({'_id': {'$in': unknown}}, {'_id': 1})
+        } if unknown else set()
+        rejected, conflicts = set(), []
+        for item in errors:
+            rejected.add(item['index'])
+            if 'keyPattern' in item:
+                present = set(item['keyPattern']) == {'_id'}
+            else:
+                present = documents[item['index']]['_id'] in stored
+            if not present:
+                conflicts.append(item['index'])
+        return [index for index in range(len(documents)) if index not in rejected], sorted(conflicts)
+
+
+class Importer:
+    """Buffers records of one kind and writes them in chunks with bulk operations"""
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.kind = None
+        self.pending = []
+        self.created = Counter()
+        self.skipped = Counter()
+        self._ids = {Category: {}, Tag: {}}
+
+    def add(self, line, record):
+        """Queue a record; returns True when a chunk was written"""
+        kind = record.get('kind')
+        if kind not in KINDS:
+            raise RecordError(line, f'unknown kind {kind!r}')
+        flushed = False
+        if self.pending and (kind != self.kind or len(self.pending) >= self.chunk_size):
+            self.flush()
+            flushed = True
+        self.kind = kind
+        if not record.get('id'):
+            record = {**record, 'id': record_id(line, record)}
+        self.pending.append((line, record))
+        return flushed
+
+    def flush(self):
+        if not self.pending:
+            return
+        handler = {'post': self._write_posts, 'comment': self._write_comments}.get(self.kind, self._write_taxonomy)
+        written = handler(self.pending)
+        self.created[self.kind] += written
+        self.skipped[self.kind] += len(self.pending) - written
+        self.pending = []
+
+    def finish(self):
+        self.flush()
+        invalidate(POSTS, TAXONOMY, COMMENTS)
+
+    def _document(self, line, document_cls, record):
+        """Validate a record against its model and return the raw document"""
+        fields = {}
+        for name, value in record.items():
+            if name == 'kind' or name in DERIVED_FIELDS:
+                continue
+            if name == 'id':
+                value = ObjectId(value)
+            elif isinstance(document_cls._fields.get(name), DateTimeField) and isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            fields[name] = value
+        try:
+            document = document_cls(**fields)
+            document.validate()
+        except (ValidationError, ValueError, TypeError, KeyError) as error:
+            raise RecordError(line, error)
+        return document.to_mongo().to_dict()
+
+    def _write_taxonomy(self, pending):
+        document_cls = KINDS[self.kind]
+        documents = []
+        for line, record in pending:
+            record.setdefault('slug', slugify(record.get('name') or ''))
+            documents.append(self._document(line, document_cls, record))
+        collection = document_cls._get_collection()
+        written, conflicts = _insert(collection, documents)
+        for index in written:
+            self._ids[document_cls][documents[index]['name']] = documents[index]['_id']
+        if conflicts:
+            # Stored under another id, e.g. imported from a different database: reuse it by name
+            names = [documents[index]['name'] for index in conflicts]
+            for row in collection.find({'name': {'$in': names}}, {'name': 1}):
+                self._ids[document_cls][row['name']] = row['_id']
+            for index in conflicts:
+                if documents[index]['name'] not in self._ids[document_cls]:
+                    slug = documents[index]['slug']
+                    raise RecordError(pending[index][0], f'{self.kind} slug {slug!r} is taken by another {self.kind}')
+        return len(written)
+
+    def _taxonomy_ids(self, document_cls, names):
+        """Resolve names to ids with one $in query, creating the ones not stored yet"""
+        known = self._ids[document_cls]
+        missing = [name for name in dict.fromkeys(names) if name not in known]
+        if missing:
+            collection = document_cls._get_collection()
+            for row in collection.find({'name': {'$in': missing}}, {'name': 1}):
+                known[row['name']] = row['_id']
+            new = [document_cls(name=name, slug=slugify(name)).to_mongo().to_dict()
+                   for name in missing if name not in known]
+            written = set(_insert(collection, new)[0])
+            for index, document in enumerate(new):
+                if index in written:
+                    known[document['name']] = document['_id']
+            raced = [d['name'] for index, d in enumerate(new) if index not in written]
+            if raced:
+                for row in collection.find({'name': {'$in': raced}}, {'name': 1}):
+                    known[row['name']] = row['_id']
+        return known
+
+    def _write_posts(self, pending):
+        categories = self._taxonomy_ids(Category, [r['category'] for _, r in pending if r.get('category')])
+        tags = self._taxonomy_ids(Tag, [name for _, r in pending for name in r.get('tags') or []])
+        bases = {
+            index: slugify(record.get('title') or '') or 'post'
+            for index, (_, record) in enumerate(pending) if not record.get('slug')
+        }
+
+        documents = []
+        for line, record in pending:
+            record = dict(record)
+            for name, ids in (('category', categories), ('tags', tags)):
+                missing = [value for value in _names(record.get(name)) if value not in ids]
+                if missing:
+                    raise RecordError(line, f'{name} {missing[0]!r} collides with the slug of a stored one')
+            if record.get('category'):
+                record['category'] = categories[record['category']]
+            record['tags'] = [tags[name] for name in record.get('tags') or []]
+            record.setdefault('slug', 'post')  # allocated below
+            documents.append(self._document(line, Post, record))
+
+        written, retry, error = [], list(bases), None
+        for attempt in range(SLUG_ATTEMPTS):
+            for index, slug in zip(retry, allocate_slugs([bases[index] for index in retry])):
+                documents[index]['slug'] = slug
+            batch = list(range(len(documents))) if attempt == 0 else retry
+            stored, conflicts = _insert(Post._get_collection(), [documents[index] for index in batch])
+            written += [batch[position] for position in stored]
+            # An allocated slug taken since allocate_slugs ran is allocated again;
+            # a slug given in the file belongs to a different post and is reported
+            retry = [batch[position] for position in conflicts]
+            given = [index for index in retry if index not in bases]
+            if given:
+                error = RecordError(pending[given[0]][0], f'slug {documents[given[0]]["slug"]!r} is taken by another post')
+            if not retry or error:
+                break
+        else:
+            error = RecordError(pending[retry[0]][0], f'no free slug for {bases[retry[0]]!r}, rerun the import')
+
+        category_deltas, tag_deltas = Counter(), Counter()
+        for index in written:
+            document = documents[index]
+            if document.get('status') == 'published':
+                category_deltas[document.get('category')] += 1
+                tag_deltas.update(set(document.get('tags') or []))
+        _apply_count_deltas(Category, category_deltas)
+        _apply_count_deltas(Tag, tag_deltas)
+        if error:  # after the counts, which a rerun would not repeat for the posts written here
+            raise error
+        return len(written)
+
+    def _write_comments(self, pending):
+        slugs = {r['post'] for _, r in pending if r.get('post') and not ObjectId.is_valid(r['post'])}
+        post_ids = {
+            row['slug']: row['_id']
+            for row in Post._get_collection().find({'slug': {'$in': list(slugs)}}, {'slug': 1})
+        } if slugs else {}
+
+        documents = []
+        for line, record in pending:
+            record = dict(record)
+            post = record.get('post')
+            if post in post_ids:
+                record['post'] = post_ids[post]
+            elif post and ObjectId.is_valid(post):
+                record['post'] = ObjectId(post)
+            else:
+                raise RecordError(line, f'unknown post {post!r}')
+            documents.append(self._document(line, Comment, record))
+
+        written, conflicts = _insert(Comment._get_collection(), documents)
+        if conflicts:
+            raise RecordError(pending[conflicts[0]][0], 'comment collides with a stored one on a unique index')
+        latest = {}
+        for index in written:
+            document = documents[index]
+            post, created_at = document['post'], document.get('created_at')
+            if created_at and (post not in latest or created_at > latest[post]):
+                latest[post] = created_at
+        if latest:
+            Post._get_collection().bulk_write([
+                UpdateOne({'_id': post}, {'$max': {'last_commented_at': created_at}})
+                for post, created_at in latest.items()
+            ], ordered=False)
+        return len(written)
+
+
+def _export_rows(document_cls, batch_size):
+    return document_cls._get_collection().find({}, sort=[('_id', 1)], batch_size=batch_size)
+
+
+def _record(kind, row):
+    record = {'kind': kind, 'id': row.pop('_id')}
+    record.update((name, value) for name, value in row.items() if name not in DERIVED_FIELDS)
+    return record
+
+
+def export_records(kinds=tuple(KINDS), batch_size=1000):
+    """Yield records kind by kind, streaming each collection from a cursor"""
+    names = {}
+    for kind in ('category', 'tag'):
+        if kind in kinds or 'post' in kinds:
+            names[kind] = {}
+            for row in _export_rows(KINDS[kind], batch_size):
+                names[kind][row['_id']] = row['name']
+                if kind in kinds:
+                    yield _record(kind, row)
+
+    if 'post' in kinds:
+        for row in _export_rows(Post, batch_size):
+            row['category'] = names['category'].get(row.get('category'))
+            row['tags'] = [names['tag'][pk] for pk in row.get('tags') or [] if pk in names['tag']]
+            yield _record('post', row)
+
+    if 'comment' in kinds:
+        batch = []
+        for row in _export_rows(Comment, batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield from _comment_records(batch)
+                batch = []
+        yield from _comment_records(batch)
+
+
+def _comment_records(rows):
+    """Replace post ids with slugs using one $in lookup per batch"""
+    if not rows:
+        return
+    slugs = defaultdict(lambda: None)
+    post_ids = list({row['post'] for row in rows})
+    for post in Post._get_collection().find({'_id': {'$in': post_ids}}, {'slug': 1}):
+        slugs[post['_id']] = post['slug']
+    for row in rows:
+        row['post'] = slugs[row['post']] or row['post']
+        yield _record('comment', row)
@@ -0,0 +1,361 @@
+"""Page and fragment caching with tag-based invalidation.
+
+Every cache entry is stored under a key that embeds the current version of
+each tag it depends on (``posts``, ``taxonomy``, ``comments``, ``post:<id>``).
+Model writes call ``invalidate`` with the affected tags, which bumps their
+versions so dependent entries are never read again and simply expire.
+
+Fragments go through ``TieredCache``: a bounded per-worker LRU in front of
+the shared backend, with jittered TTLs, a stale window during which one
+worker refreshes the value in the background while others keep serving
+the old one, and a cross-worker lock so a cold key is computed only once.
+
+Whole pages are only cached for readers without a session or message
+cookie. They are rendered session-free (anonymous user, no messages) with a
+placeholder instead of the CSRF token; the placeholder is swapped for the
+reader's own token each time the page is served. Edge-cached pages skip
+that step and are marked ``Cache-Control: public`` instead.
+"""
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.utils.connection import ConnectionProxy
+from django.utils.http import parse_http_date_safe
+
+logger = logging.getLogger(__name__)
+
+CSRF_PLACEHOLDER = 'csrf-token-placeholder-8f2d6c1e'
+
+POSTS = 'posts'
+TAXONOMY = 'taxonomy'
+COMMENTS = 'comments'
+TRENDING = 'trending'
+
+
+def post_tag(post_id):
+    return f'post:{post_id}'
+
+
+def slug_tag(slug):
+    return f'slug:{slug}'
+
+
+def tag_versions(tags):
+    keys = {tag: f'tagver:{tag}' for tag in tags}
+    stored = cache.get_many(list(keys.values()))
+    versions = {}
+    for tag, key in keys.items():
+        version = stored.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            cache.add(key, version, None)
+            version = cache.get(key, version)
+        versions[tag] = version
+    return versions
+
+
+def make_key(name, tags, parts=()):
+    """Build a cache key for name/parts that changes whenever one of tags is invalidated"""
+    versions = tag_versions(sorted(set(tags)))
+    digest = hashlib.md5(
+        '|'.join([*map(str, parts), *(f'{tag}={versions[tag]}' for tag in sorted(versions))]).encode()
+    ).hexdigest()
+    return f'blog:{name}:{digest}'
+
+
+def invalidate(*tags):
+    """Drop every cached page and fragment depending on any of tags"""
+    cache.set_many({f'tagver:{tag}': uuid.uuid4().hex for tag in tags}, None)
+
+
+class LocalLRU:
+    """Small thread-safe LRU of cache envelopes, private to one worker"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TieredCache:
+    """Per-worker LRU over a shared cache with stale-while-revalidate and single-flight"""
+
+    def __init__(self, backend=None, max_entries=None, stale=None, jitter=None, lock_timeout=None):
+        self.backend = backend or cache
+        self.local = LocalLRU(max_entries or settings.LOCAL_CACHE_MAX_ENTRIES)
+        self.stale = settings.FRAGMENT_CACHE_STALE if stale is None else stale
+        self.jitter = settings.CACHE_TTL_JITTER if jitter is None else jitter
+        self.lock_timeout = lock_timeout or settings.CACHE_LOCK_TIMEOUT
+        self._key_locks = {}
+        self._key_locks_guard = threading.Lock()
+        self.hits = self.stale_hits = self.misses = 0
+
+    def get_or_set(self, key, builder, timeout):
+        """Return the value for key, computing it at most once across workers"""
+        now = time.time()
+        entry = self.local.get(key)
+        if entry is None:
+            entry = self.backend.get(key)
+            if entry is not None:
+                self.local.set(key, entry)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self._count('hits')
+                return value
+            if now < stale_until:
+                self._count('stale_hits')
+                self._revalidate(key, builder, timeout)
+                return value
+
+        self._count('misses')
+        with self._key_lock(key):
+            entry = self.backend.get(key)
+            if entry is not None and time.time() < entry[1]:
+                self.local.set(key, entry)
+                return entry[0]
+            if self._acquire(key):
+                try:
+                    return self._build(key, builder, timeout)
+                finally:
+                    self._release(key)
+            entry = self._wait_for(key)
+            if entry is not None:
+                self.local.set(key, entry)
+                return entry[0]
+            return self._build(key, builder, timeout)
+
+    def _build(self, key, builder, timeout):
+        value = builder()
+        ttl = timeout * (1 + random.uniform(-self.jitter, self.jitter))
+        now = time.time()
+        entry = (value, now + ttl, now + ttl + self.stale)
+        self.backend.set(key, entry, int(ttl + self.stale) + 1)
+        self.local.set(key, entry)
+        return value
+
+    def _revalidate(self, key, builder, timeout):
+        if not self._acquire(key):
+            return
+
+        def refresh():
+            try:
+                self._build(key, builder, timeout)
+            except Exception:
+                logger.exception('Background refresh of %s failed', key)
+            finally:
+                self._release(key)
+
+        threading.Thread(target=refresh, name='cache-refresh', daemon=True).start()
+
+    def _count(self, name):
+        # Request threads and refresh threads both count; reuse the LRU's lock
+        with self.local._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _acquire(self, key):
+        path = self._lock_path(key)
+        if path is None:
+            return self.backend.add(f'lock:{key}', 1, self.lock_timeout)
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) < self.lock_timeout:
+                        return False
+                    os.remove(path)  # left by a worker that died while building
+                except OSError:
+                    pass
+        return False
+
+    def _release(self, key):
+        path = self._lock_path(key)
+        if path is None:
+            self.backend.delete(f'lock:{key}')
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _lock_path(self, key):
+        """Lock file for key when the backend is the file cache, whose add() is not atomic"""
+        from django.core.cache.backends.filebased import FileBasedCache
+
+        backend = self.backend
+        if isinstance(backend, ConnectionProxy):
+            backend = backend._connections[backend._alias]
+        if not isinstance(backend, FileBasedCache):
+            return None
+        directory = os.path.join(backend._dir, 'locks')
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, hashlib.md5(key.encode()).hexdigest() + '.lock')
+
+    def _wait_for(self, key):
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = self.backend.get(key)
+            if entry is not None and time.time() < entry[1]:
+                return entry
+        return None
+
+    def _key_lock(self, key):
+        with self._key_locks_guard:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                if len(self._key_locks) > self.local.max_entries:
+                    self._key_locks = {k: v for k, v in self._key_locks.items() if v.locked()}
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+
+_tiered_cache = None
+
+
+def tiered_cache():
+    global _tiered_cache
+    if _tiered_cache is None:
+        _tiered_cache = TieredCache()
+    return _tiered_cache
+
+
+def cached_fragment(name, builder, tags, parts=(), timeout=None):
+    """Return a cached value for the named fragment, building it on a miss"""
+    key = make_key(name, tags, parts)
+    return tiered_cache().get_or_set(key, builder, timeout or settings.FRAGMENT_CACHE_TIMEOUT)
+
+
+def page_is_cacheable(request):
+    """Only anonymous GETs with no session or pending messages share cached pages"""
+    return (
+        request.method in ('GET', 'HEAD')
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and 'messages' not in request.COOKIES
+    )
+
+
+def render_page(request, template_name, context):
+    """Render a view, session-free when the page is going into the shared cache"""
+    if getattr(request, '_cache_page', False):
+        context = {
+            **context,
+            'user': AnonymousUser(),
+            'messages': (),
+            # Edge-cached pages carry no token at all; the page script fetches one per reader
+            'csrf_token': '' if getattr(request, '_edge_cache', False) else CSRF_PLACEHOLDER,
+        }
+    return render(request, template_name, context)
+
+
+def _personalize(request, content):
+    return content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+
+
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control')
+
+
+def _cached_response(request, view, args, kwargs, tags, timeout, personalize):
+    tags = [tag(request, *args, **kwargs) if callable(tag) else tag for tag in tags]
+    key = make_key('page', tags, (view.__module__, view.__name__, request.get_full_path()))
+    cached = cache.get(key)
+    if cached is not None:
+        content, headers = cached
+        response = HttpResponse(_personalize(request, content) if personalize else content)
+        for header, value in headers.items():
+            response[header] = value
+        response['X-Page-Cache'] = 'hit'
+        return get_conditional_response(
+            request,
+            etag=headers.get('ETag'),
+            last_modified=parse_http_date_safe(headers.get('Last-Modified') or ''),
+            response=response,
+        )
+
+    request._cache_page = True
+    response = view(request, *args, **kwargs)
+    if response.streaming:
+        return response
+    if response.status_code == 200:
+        headers = {header: response[header] for header in CACHED_HEADERS if response.has_header(header)}
+        cache.set(key, (response.content, headers), timeout or settings.PAGE_CACHE_TIMEOUT)
+        response['X-Page-Cache'] = 'miss'
+    if personalize:
+        response.content = _personalize(request, response.content)
+    return response
+
+
+def cache_page_by_tags(*tags, timeout=None):
+    """Cache a view's full response for anonymous readers until one of tags is invalidated.
+
+    Tags may be callables taking the view arguments, for per-object tags.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not page_is_cacheable(request):
+                return view(request, *args, **kwargs)
+            return _cached_response(request, view, args, kwargs, tags, timeout, personalize=True)
+        return wrapper
+    return decorator
+
+
+def edge_cached_page(*tags, timeout=None):
+    """Serve anonymous readers a session-free page that CDNs may cache publicly.
+
+    Only active with DETAIL_EDGE_CACHE; the page must load anything per-user
+    (CSRF token, forms, messages) from a separate private endpoint.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.DETAIL_EDGE_CACHE or not page_is_cacheable(request):
+                return view(request, *args, **kwargs)
+            request._edge_cache = True
+
+            def public_view(request, *args, **kwargs):
+                response = view(request, *args, **kwargs)
+                if response.status_code in (200, 304):
+                    response['Cache-Control'] = 'public, max-age=%d, s-maxage=%d' % (
+                        settings.DETAIL_BROWSER_MAX_AGE, settings.DETAIL_EDGE_MAX_AGE,
+                    )
+                return response
+
+            public_view.__module__, public_view.__name__ = view.__module__, view.__name__
+            return _cached_response(request, public_view, args, kwargs, tags, timeout, personalize=False)
+        return wrapper
+    return decorator
@@ -0,0 +1,125 @@
+"""Conditional GET (ETag / Last-Modified / 304) for public pages.
+
+Validators are computed before the view runs, from one indexed lookup of
+the newest ``updated_at`` (and ``last_commented_at`` for a post) plus the
+cache tag versions, which also change on deletes and taxonomy edits that
+timestamps alone would miss. A matching ``If-None-Match`` or
+``If-Modified-Since`` gets a 304 without running the view.
+"""
+import calendar
+import hashlib
+import os
+import posixpath
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils._os import safe_join
+from django.utils.http import http_date, quote_etag
+from django.views.static import serve
+
+from .caching import page_is_cacheable, tag_versions, post_tag, slug_tag, POSTS, TAXONOMY, TRENDING
+from .models import Post, Category, Tag
+
+
+def _timestamp(value):
+    return calendar.timegm(value.utctimetuple()) if value else None
+
+
+def _etag(request, *parts):
+    source = '|'.join(map(str, (settings.ETAG_VERSION, request.get_full_path(), *parts)))
+    return quote_etag(hashlib.md5(source.encode()).hexdigest())
+
+
+def conditional_page(validator, not_modified=None):
+    """Answer revalidations for anonymous readers from validator(request, **kwargs) -> (etag, last_modified)
+
+    not_modified(request, **kwargs) runs for every 304, for side effects the
+    skipped view would have had (such as counting a view).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not page_is_cacheable(request):
+                return view(request, *args, **kwargs)
+            validators = validator(request, *args, **kwargs)
+            if validators is None:
+                return view(request, *args, **kwargs)
+            etag, last_modified = validators
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            elif not_modified is not None:
+                not_modified(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                if last_modified:
+                    response['Last-Modified'] = http_date(last_modified)
+                if not response.has_header('Cache-Control'):
+                    patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def _latest_update(**filters):
+    latest = Post.objects(status='published', **filters).order_by('-updated_at') \
+        .only('updated_at').as_pymongo().first()
+    return latest['updated_at'] if latest else None
+
+
+def listing_validators(request, *args, **kwargs):
+    latest = _latest_update()
+    versions = tag_versions([POSTS, TAXONOMY])
+    return _etag(request, latest, versions[POSTS], versions[TAXONOMY]), _timestamp(latest)
+
+
+def index_validators(request, *args, **kwargs):
+    latest = _latest_update()
+    versions = tag_versions([POSTS, TAXONOMY, TRENDING])
+    return _etag(request, latest, *versions.values()), _timestamp(latest)
+
+
+def _taxonomy_validators(document_cls, field, request, slug):
+    document = document_cls.objects(slug=slug).only('id').as_pymongo().first()
+    if not document:
+        return None
+    latest = _latest_update(**{field: document['_id']})
+    versions = tag_versions([POSTS, TAXONOMY])
+    return _etag(request, latest, versions[POSTS], versions[TAXONOMY]), _timestamp(latest)
+
+
+def category_validators(request, slug):
+    return _taxonomy_validators(Category, 'category', request, slug)
+
+
+def tag_validators(request, slug):
+    return _taxonomy_validators(Tag, 'tags', request, slug)
+
+
+def detail_validators(request, slug):
+    post = Post.objects(slug=slug, status='published') \
+        .only('updated_at', 'last_commented_at').as_pymongo().first()
+    if not post:
+        return None
+    latest = max(filter(None, (post.get('updated_at'), post.get('last_commented_at'))))
+    # POSTS covers the related posts shown on the page; the post and slug tags are bumped
+    # by every comment save and delete, which timestamps alone miss for deletes
+    versions = tag_versions([POSTS, TAXONOMY, post_tag(post['_id']), slug_tag(slug)])
+    return _etag(request, latest, *versions.values()), _timestamp(latest)
+
+
+def serve_static(request, path, document_root=None, show_indexes=False):
+    """django.views.static.serve with an ETag from file size and mtime"""
+    try:
+        stat = os.stat(safe_join(document_root, posixpath.normpath(path).lstrip('/')))
+    except (OSError, SuspiciousFileOperation):
+        return serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = serve(request, path, document_root=document_root, show_indexes=show_indexes)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.STATIC_MAX_AGE)
+    return response
@@ -0,0 +1,356 @@
+"""Deterministic synthetic corpus for scale testing.
+
+``Corpus`` describes a dataset of categories, tags, posts and comments that
+is a pure function of its parameters and seed. Each batch of posts draws from
+its own generator (``[seed, batch]``), so batches can be built and written by
+any number of worker processes in any order and still produce the same
+documents. Ids are derived from the seed and the position, which makes a
+re-run skip what is already stored instead of duplicating it.
+
+The distributions are chosen to look like a real anime review site:
+
+* tag, studio and (mildly) category popularity follow Zipf laws, so a few
+  tags sit on most posts and studios have a long tail;
+* titles are built from Japanese words, with the kanji/kana original in
+  ``anime_title_jp`` and the romanised form in the title;
+* views follow a power law (Pareto, tail index VIEWS_SHAPE);
+* each post's comment count is Poisson with a mean proportional to its
+  views, so comments cluster on the hot posts.
+
+Documents are written raw with ``insert_many`` (no per-document
+validation or save hooks); published counts are applied once at the end.
+A category or tag whose name or slug is already used by a document that is
+not part of the corpus raises ``TaxonomyConflict`` before anything is
+written, since the generated posts would point at taxonomy never stored.
+"""
+import multiprocessing
+import struct
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson import ObjectId
+from django.utils.text import slugify
+
+WORDS = [  # (original, romaji)
+    ('魔法', 'Mahou'), ('少女', 'Shoujo'), ('学園', 'Gakuen'), ('物語', 'Monogatari'), ('剣', 'Tsurugi'),
+    ('星', 'Hoshi'), ('空', 'Sora'), ('夏', 'Natsu'), ('恋', 'Koi'), ('夢', 'Yume'), ('影', 'Kage'),
+    ('龍', 'Ryuu'), ('機動', 'Kidou'), ('戦記', 'Senki'), ('異世界', 'Isekai'), ('勇者', 'Yuusha'),
+    ('探偵', 'Tantei'), ('料理', 'Ryouri'), ('宇宙', 'Uchuu'), ('忍者', 'Ninja'), ('桜', 'Sakura'),
+    ('月', 'Tsuki'), ('鋼', 'Hagane'), ('歌', 'Uta'), ('猫', 'Neko'), ('冒険', 'Bouken'), ('怪盗', 'Kaitou'),
+    ('放課後', 'Houkago'), ('青春', 'Seishun'), ('終末', 'Shuumatsu'), ('天使', 'Tenshi'), ('鬼', 'Oni'),
+    ('スターライト', 'Starlight'), ('ブレイド', 'Blade'), ('クロニクル', 'Chronicle'), ('アイドル', 'Idol'),
+    ('ゼロ', 'Zero'), ('ファンタジア', 'Fantasia'), ('メモリー', 'Memory'), ('エデン', 'Eden'),
+]
+PARTICLES = [('', ' '), ('の', ' no '), ('と', ' to '), ('！', '! ')]
+REVIEW_KINDS = ['Review', 'First Impressions', 'Season {season} Review', 'Episode {episode} Recap', 'Final Verdict']
+
+CATEGORIES = [
+    'Action', 'Romance', 'Comedy', 'Drama', 'Fantasy', 'Sci-Fi', 'Slice of Life', 'Mecha',
+    'Sports', 'Horror', 'Mystery', 'Isekai', 'Music', 'Historical', 'Psychological', 'Adventure',
+]
+TAGS = [
+    'shounen', 'seinen', 'shoujo', 'josei', 'school', 'magic', 'idol', 'military', 'supernatural',
+    'time-travel', 'vampire', 'martial-arts', 'samurai', 'space', 'cyberpunk', 'post-apocalyptic',
+    'gourmet', 'romcom', 'tragedy', 'found-family', 'villainess', 'reincarnation', 'video-game',
+    'detective', 'ghosts', 'robots', 'demons', 'tournament', 'workplace', 'iyashikei', 'survival',
+    'heist', 'space-opera', 'kaiju', 'yokai', 'harem', 'band', 'ninja', 'dragons', 'witches',
+]
+STUDIOS = [
+    'Sunrise', 'Madhouse', 'Bones', 'Kyoto Animation', 'MAPPA', 'Production I.G', 'Wit Studio', 'Trigger',
+    'Shaft', 'A-1 Pictures', 'Ufotable', 'CloverWorks', 'Toei Animation', 'Pierrot', 'J.C.Staff',
+    'Doga Kobo', 'P.A. Works', 'Science SARU', 'David Production', 'Lerche', 'Silver Link',
+    'Kinema Citrus', 'Orange', 'Polygon Pictures', 'Studio Deen', 'TMS Entertainment', 'OLM', "Brain's Base",
+]
+ANIME_TYPES = (('tv', 0.62), ('movie', 0.12), ('ova', 0.08), ('special', 0.06), ('ona', 0.12))
+EPISODES = {'tv': (12, 13, 24, 25, 26), 'movie': (1,), 'ova': (2, 3, 4, 6), 'special': (1, 2), 'ona': (10, 12, 15)}
+COMMENTERS = ['otaku', 'sakura', 'mecha_fan', 'isekai_enjoyer', 'tsundere', 'nakama', 'senpai', 'kouhai', 'ramen']
+COMMENT_LINES = [
+    'The soundtrack carried this one.', 'Hard disagree on the rating.', 'Best episode of the season!',
+    'The pacing in the middle arc dragged.', 'Adding this to my watchlist.', 'The animation in the finale was unreal.',
+    'Manga readers know what is coming...', 'Underrated studio, great review.', 'Dropped it after episode 3.',
+]
+PARAGRAPHS = [
+    '<p>{title} sets out its premise quickly and spends the rest of its run earning it.</p>',
+    '<p>{studio} gives the action scenes room to breathe, and the character animation stays on model.</p>',
+    '<p>The cast of {jp} is the real draw: every side character gets at least one episode of their own.</p>',
+    '<p>Not every arc lands, but the last stretch ties the themes together better than expected.</p>',
+    '<p>Recommended for fans of {tag}; newcomers should give it three episodes.</p>',
+]
+
+VIEWS_SCALE = 20
+VIEWS_SHAPE = 1.2  # Pareto (Lomax) shape: mean VIEWS_SCALE * shape / (shape - 1)
+MAX_COMMENTS = 4000  # per post; also bounds the comment id space
+KIND_CODES = {'category': 1, 'tag': 2, 'post': 3, 'comment': 4}
+TAXONOMY_EPOCH = datetime(2020, 1, 1)
+
+
+class TaxonomyConflict(ValueError):
+    """Generated category or tag names collide with stored documents"""
+
+
+def object_id(kind, index, moment, seed=0):
+    """A deterministic ObjectId: creation time, kind, seed (16 bits) and a 40-bit position"""
+    return ObjectId(struct.pack('>IBH', int(moment.timestamp()) & 0xFFFFFFFF, KIND_CODES[kind], seed & 0xFFFF)
+                    + index.to_bytes(5, 'big'))
+
+
+def _zipf_cdf(size, exponent):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return np.cumsum(weights) / weights.sum()
+
+
+def _names(base, size, words, combine):
+    """size distinct names: base first, then combine(first, second, round) over pairs of words"""
+    names = list(dict.fromkeys(base))[:size]
+    seen = set(names)
+    index = 0
+    while len(names) < size:
+        round_, position = divmod(index, len(words) ** 2)
+        first, second = divmod(position, len(words))
+        name = combine(words[first], words[second], round_ + 1)
+        index += 1
+        if first != second and name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def _ranked(rng, size, head):
+    head = min(head, size)
+    return np.concatenate([rng.permutation(head), np.arange(head, size)])
+
+
+def _numbered(template):
+    return lambda first, second, round_: template.format(first, second) + (f' {round_}' if round_ > 1 else '')
+
+
+class Corpus:
+    """Parameters of a synthetic dataset; every document is derived from them"""
+
+    def __init__(self, posts, seed=0, categories=12, tags=500, studios=400, comments_per_post=3.0,
+                 days=730, end=None, published=0.92):
+        self.posts = posts
+        self.seed = seed
+        self.comments_per_post = comments_per_post
+        self.published = published
+        self.end = end or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.start = self.end - timedelta(days=days)
+        romaji = [word for _, word in WORDS]
+        self.category_names = _names(CATEGORIES, categories, CATEGORIES, _numbered('{} {}'))
+        self.tag_names = _names(TAGS, tags, TAGS, _numbered('{}-{}'))
+        self.studio_names = _names(STUDIOS, studios, romaji, lambda first, second, round_: (
+            _numbered('Studio {}{}')(first, second.lower(), round_)
+        ))
+        self.category_ids = [object_id('category', i, TAXONOMY_EPOCH) for i in range(len(self.category_names))]
+        self.tag_ids = [object_id('tag', i, TAXONOMY_EPOCH) for i in range(len(self.tag_names))]
+
+        # Popularity rank -> name index. The hand-written names form the head in a seed-dependent
+        # order; the generated combinations make up the tail
+        ranks = np.random.default_rng([seed, 0xC0DE])
+        self.category_order = _ranked(ranks, len(self.category_ids), len(CATEGORIES))
+        self.tag_order = _ranked(ranks, len(self.tag_ids), len(TAGS))
+        self.studio_order = _ranked(ranks, len(self.studio_names), len(STUDIOS))
+        self.category_cdf = _zipf_cdf(len(self.category_ids), 0.8)
+        self.tag_cdf = _zipf_cdf(len(self.tag_ids), 1.1)
+        self.studio_cdf = _zipf_cdf(len(self.studio_names), 1.2)
+
+    def taxonomy(self):
+        """(category documents, tag documents)"""
+        categories = [
+            {'_id': pk, 'name': name, 'slug': slugify(name), 'created_at': TAXONOMY_EPOCH, 'published_count': 0}
+            for pk, name in zip(self.category_ids, self.category_names)
+        ]
+        tags = [
+            {'_id': pk, 'name': name, 'slug': slugify(name), 'created_at': TAXONOMY_EPOCH, 'published_count': 0}
+            for pk, name in zip(self.tag_ids, self.tag_names)
+        ]
+        return categories, tags
+
+    def batches(self, batch_size):
+        return [(index, start, min(batch_size, self.posts - start))
+                for index, start in enumerate(range(0, self.posts, batch_size))]
+
+    def batch(self, index, start, count):
+        """(post documents, comment documents) of posts start .. start + count"""
+        rng = np.random.default_rng([self.seed, index])
+        span = (self.end - self.start).total_seconds()
+        # Post i is older than post i - 1, so the newest posts come first
+        ages = (np.arange(start, start + count) + rng.random(count)) / self.posts * span
+        views = np.minimum(((rng.pareto(VIEWS_SHAPE, count) + 1) * VIEWS_SCALE).astype(np.int64), 50_000_000)
+        categories = self.category_order[np.searchsorted(self.category_cdf, rng.random(count))]
+        studios = self.studio_order[np.searchsorted(self.studio_cdf, rng.random(count))]
+        tag_counts = np.minimum(1 + rng.poisson(2.0, count), 8)
+        tag_draws = self.tag_order[np.searchsorted(self.tag_cdf, rng.random((count, 12)))]
+        published = rng.random(count) < self.published
+        ratings = np.clip(rng.normal(7.2, 1.2, count), 1, 10).round(1)
+        types = rng.choice(len(ANIME_TYPES), count, p=[weight for _, weight in ANIME_TYPES])
+        words = rng.integers(0, len(WORDS), (count, 3))
+        lengths = rng.integers(1, 4, count)
+        particles = rng.integers(0, len(PARTICLES), count)
+        kinds = rng.integers(0, len(REVIEW_KINDS), count)
+        numbers = rng.integers(1, 13, (count, 2))
+        paragraphs = rng.integers(2, len(PARAGRAPHS) + 1, count)
+        # Most reviews cover the current season; one in five looks back at an older show
+        years_back = np.where(rng.random(count) < 0.2, rng.integers(1, 30, count), 0)
+        mean_views = VIEWS_SCALE * VIEWS_SHAPE / (VIEWS_SHAPE - 1)
+        comment_counts = np.where(published, np.minimum(
+            rng.poisson(self.comments_per_post * views / mean_views), MAX_COMMENTS,
+        ), 0)
+
+        posts, comments = [], []
+        for offset in range(count):
+            position = start + offset
+            # Millisecond precision, as stored by MongoDB
+            created_at = self.end - timedelta(milliseconds=int(ages[offset] * 1000))
+            picked = words[offset, :lengths[offset]]
+            jp_words = [WORDS[word][0] for word in picked]
+            romaji = [WORDS[word][1] for word in picked]
+            jp_particle, romaji_particle = PARTICLES[particles[offset]]
+            anime_jp = jp_particle.join(jp_words) if len(jp_words) > 1 else jp_words[0]
+            anime = romaji_particle.join(romaji).strip() if len(romaji) > 1 else romaji[0]
+            season, episode = numbers[offset]
+            title = f"{anime} {REVIEW_KINDS[kinds[offset]].format(season=season, episode=episode)}"
+            tags = list(dict.fromkeys(tag_draws[offset]))[:tag_counts[offset]]
+            studio = self.studio_names[studios[offset]]
+            anime_type = ANIME_TYPES[types[offset]][0]
+            values = {'title': title, 'studio': studio, 'jp': anime_jp, 'tag': self.tag_names[tags[0]]}
+            excerpt = f'{title}: our take on the {studio} adaptation of {anime_jp}.'[:300]
+            post_id = object_id('post', position, created_at, self.seed)
+
+            post_comments = []
+            # Comments arrive mostly in the first days after a review goes up
+            delays = np.minimum(rng.exponential(3 * 86400, int(comment_counts[offset])),
+                                (self.end - created_at).total_seconds())
+            for number, delay in enumerate(delays):
+                commented_at = created_at + timedelta(milliseconds=int(delay * 1000))
+                name = f'{COMMENTERS[(position + number) % len(COMMENTERS)]}{(position * 7 + number) % 1000}'
+                post_comments.append({
+                    '_id': object_id('comment', position * MAX_COMMENTS + number, commented_at, self.seed),
+                    'post': post_id,
+                    'name': name,
+                    'email': f'{name}@example.com',
+                    'content': COMMENT_LINES[(position + number * 5) % len(COMMENT_LINES)],
+                    'is_approved': True,
+                    'created_at': commented_at,
+                })
+            comments += post_comments
+
+            posts.append({
+                '_id': post_id,
+                'title': title,
+                'slug': f'{slugify(title) or "post"}-{self.seed}-{position}',
+                'content': '\n'.join(paragraph.format(**values) for paragraph in PARAGRAPHS[:paragraphs[offset]]),
+                'excerpt': excerpt,
+                'anime_title_jp': anime_jp,
+                'anime_type': anime_type,
+                'rating': float(ratings[offset]),
+                'episode_count': EPISODES[anime_type][position % len(EPISODES[anime_type])],
+                'release_year': max(1985, created_at.year - int(years_back[offset])),
+                'studio': studio,
+                'author_id': 1,
+                'author_username': 'corpus',
+                'category': self.category_ids[categories[offset]],
+                'tags': [self.tag_ids[tag] for tag in tags],
+                'status': 'published' if published[offset] else 'draft',
+                'meta_description': excerpt[:160],
+                'created_at': created_at,
+                'updated_at': created_at,
+                'views': int(views[offset]),
+                **({'last_commented_at': max(c['created_at'] for c in post_comments)} if post_comments else {}),
+            })
+        return posts, comments
+
+
+def _conflicts(collection, documents):
+    """Names of documents whose name or slug another stored document already has"""
+    rows = collection.find({
+        '_id': {'$nin': [document['_id'] for document in documents]},
+        '$or': [
+            {'name': {'$in': [document['name'] for document in documents]}},
+            {'slug': {'$in': [document['slug'] for document in documents]}},
+        ],
+    }, {'name': 1})
+    return sorted(row['name'] for row in rows)
+
+
+def _check_taxonomy(categories, tags):
+    from .models import Category, Tag
+
+    problems = [
+        f'{label} {", ".join(names[:10])}{" ..." if len(names) > 10 else ""}'
+        for label, names in (
+            ('categories', _conflicts(Category._get_collection(), categories)),
+            ('tags', _conflicts(Tag._get_collection(), tags)),
+        ) if names
+    ]
+    if problems:
+        raise TaxonomyConflict(
+            'the database already has ' + '; '.join(problems)
+            + ' (not from this corpus); generate the corpus into an empty database'
+        )
+
+
+def _write_batch(job):
+    """Build and insert one batch; returns (posts written, comments written, category deltas, tag deltas)"""
+    from .bulk import _insert
+    from .models import Comment, Post
+
+    corpus, index, start, count = job
+    posts, comments = corpus.batch(index, start, count)
+    written = _insert(Post._get_collection(), posts)[0]
+    comments_written = 0
+    # Comments are inserted in slices so a hot post's thousands of comments stay one batch each
+    for offset in range(0, len(comments), 10_000):
+        comments_written += len(_insert(Comment._get_collection(), comments[offset:offset + 10_000])[0])
+    categories, tags = Counter(), Counter()
+    for position in written:
+        post = posts[position]
+        if post['status'] == 'published':
+            categories[post['category']] += 1
+            tags.update(post['tags'])
+    return len(written), comments_written, categories, tags
+
+
+def generate(corpus, batch_size=10_000, workers=1, progress=None):
+    """Write the corpus to the connected database; returns a Counter of documents written"""
+    import django
+    from .bulk import _insert
+    from .caching import invalidate, POSTS, TAXONOMY, COMMENTS
+    from .models import Category, Tag, _apply_count_deltas
+
+    totals = Counter()
+    categories, tags = corpus.taxonomy()
+    _check_taxonomy(categories, tags)
+    for label, document_cls, documents in (('categories', Category, categories), ('tags', Tag, tags)):
+        written, conflicts = _insert(document_cls._get_collection(), documents)
+        if conflicts:  # taken since the check
+            raise TaxonomyConflict(f'{len(conflicts)} generated {label} collide with stored documents')
+        totals[label] = len(written)
+
+    jobs = [(corpus, *batch) for batch in corpus.batches(batch_size)]
+    category_deltas, tag_deltas = Counter(), Counter()
+    if workers > 1:
+        # Spawned workers open their own MongoClient instead of inheriting this one across a fork
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=django.setup)
+        results = pool.map(_write_batch, jobs)
+    else:
+        pool, results = None, map(_write_batch, jobs)
+    try:
+        for done, (posts, comments, batch_categories, batch_tags) in enumerate(results, start=1):
+            totals['posts'] += posts
+            totals['comments'] += comments
+            category_deltas.update(batch_categories)
+            tag_deltas.update(batch_tags)
+            if progress:
+                progress(done, len(jobs), totals)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    _apply_count_deltas(Category, category_deltas)
+    _apply_count_deltas(Tag, tag_deltas)
+    invalidate(POSTS, TAXONOMY, COMMENTS)
+    return totals
@@ -1,7 +1,8 @@
 from django import forms
+from bson import ObjectId
 from .models import Comment, Newsletter, Contact, Post, Category, Tag
-import cloudinary.uploader
-from django.core.files.storage import FileSystemStorage
+from . import identity
+from .uploads import upload_queue, image_placeholder
 
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
@@ -34,10 +35,10 @@ class PostForm(forms.Form):
     def __init__(self, *args, **kwargs):
         super(PostForm, self).__init__(*args, **kwargs)
         self.fields['category'].choices = [('', '---------')] + [
-            (str(category.id), category.name) for category in Category.objects().order_by('name')
+            (str(category.id), category.name) for category in identity.all_documents(Category)
         ]
         self.fields['tags'].choices = [
-            (str(tag.id), tag.name) for tag in Tag.objects().order_by('name')
+            (str(tag.id), tag.name) for tag in identity.all_documents(Tag)
         ]
         
         # Common styling for text inputs
@@ -161,10 +162,11 @@ class PostForm(forms.Form):
         category = None
         category_id = data.get('category')
         if category_id:
-            category = Category.objects(id=category_id).first()
+            category = identity.get(Category, ObjectId(category_id))
 
-        tag_ids = data.get('tags', [])
-        tags = list(Tag.objects(id__in=tag_ids)) if tag_ids else []
+        tag_ids = [ObjectId(tag_id) for tag_id in data.get('tags', [])]
+        tag_map = identity.get_many(Tag, tag_ids)
+        tags = [tag_map[tag_id] for tag_id in tag_ids if tag_id in tag_map]
 
         post = Post(
             title=data['title'],
@@ -185,26 +187,18 @@ class PostForm(forms.Form):
             status=status,
         )
 
-        featured_image = self.files.get('featured_image')
-        thumbnail = self.files.get('thumbnail')
-        if featured_image:
-            try:
-                upload_result = cloudinary.uploader.upload(featured_image, folder='blog_images')
-                post.featured_image = upload_result.get('secure_url', featured_image.name)
-            except Exception:
-                fs = FileSystemStorage()
-                filename = fs.save(f'uploads/{featured_image.name}', featured_image)
-                post.featured_image = fs.url(filename)
-        if thumbnail:
-            try:
-                upload_result = cloudinary.uploader.upload(thumbnail, folder='thumbnails')
-                post.thumbnail = upload_result.get('secure_url', thumbnail.name)
-            except Exception:
-                fs = FileSystemStorage()
-                filename = fs.save(f'uploads/{thumbnail.name}', thumbnail)
-                post.thumbnail = fs.url(filename)
+        # Images upload in the background; the post shows a placeholder until then
+        images = [
+            (field, self.files.get(field), folder)
+            for field, folder in (('featured_image', 'blog_images'), ('thumbnail', 'thumbnails'))
+            if self.files.get(field)
+        ]
+        for field, _, _ in images:
+            setattr(post, field, image_placeholder())
 
         post.save()
+        for field, image, folder in images:
+            upload_queue.submit(post.pk, field, image, folder)
         return post
 
 class CommentForm(forms.Form):
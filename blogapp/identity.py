@@ -0,0 +1,120 @@
+"""Request-scoped identity map for MongoEngine documents.
+
+``IdentityMapMiddleware`` opens a map per request; the helpers below
+return documents already loaded during the request by id instead of
+querying again, and fall back to plain queries outside a request.
+Hit/miss counters are logged per request and, in DEBUG, sent back in an
+``X-Identity-Map`` response header.
+"""
+import logging
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('identity_map', default=None)
+
+
+class IdentityMap:
+    def __init__(self):
+        self._documents = {}
+        self._complete = {}
+        self.hits = 0
+        self.misses = 0
+        self.queries_saved = 0
+
+    def register(self, documents):
+        for document in documents:
+            self._documents[(type(document), document.pk)] = document
+        return documents
+
+    def get_many(self, document_cls, ids):
+        ids = [pk for pk in dict.fromkeys(ids) if pk is not None]
+        found, missing = {}, []
+        for pk in ids:
+            document = self._documents.get((document_cls, pk))
+            if document is not None:
+                found[pk] = document
+            else:
+                missing.append(pk)
+        self.hits += len(found)
+        if missing and document_cls not in self._complete:
+            self.misses += len(missing)
+            for document in self.register(list(document_cls.objects(id__in=missing))):
+                found[document.pk] = document
+        elif ids:
+            self.queries_saved += 1
+        return found
+
+    def all(self, document_cls):
+        if document_cls in self._complete:
+            self.queries_saved += 1
+            self.hits += len(self._complete[document_cls])
+            return self._complete[document_cls]
+        documents = [
+            self._documents.get((document_cls, document.pk), document)
+            for document in document_cls.objects()
+        ]
+        self.register(documents)
+        self.misses += len(documents)
+        self._complete[document_cls] = documents
+        return documents
+
+
+def current():
+    """Get the identity map of the running request, if any"""
+    return _current.get()
+
+
+def register(documents):
+    """Remember already loaded documents for the rest of the request"""
+    identity_map = _current.get()
+    if identity_map is not None:
+        identity_map.register(documents)
+    return documents
+
+
+def get_many(document_cls, ids):
+    """Load documents by id as a {id: document} dict, reusing loaded ones"""
+    identity_map = _current.get()
+    if identity_map is None:
+        ids = [pk for pk in set(ids) if pk is not None]
+        return {doc.pk: doc for doc in document_cls.objects(id__in=ids)} if ids else {}
+    return identity_map.get_many(document_cls, ids)
+
+
+def get(document_cls, pk):
+    """Load one document by id, reusing a loaded one"""
+    return get_many(document_cls, [pk]).get(pk)
+
+
+def all_documents(document_cls):
+    """Load a whole (small) collection once per request, in default ordering"""
+    identity_map = _current.get()
+    if identity_map is None:
+        return list(document_cls.objects())
+    return identity_map.all(document_cls)
+
+
+class IdentityMapMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        identity_map = IdentityMap()
+        request.identity_map = identity_map
+        token = _current.set(identity_map)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        logger.debug(
+            'identity map %s: hits=%d misses=%d queries_saved=%d',
+            request.path, identity_map.hits, identity_map.misses, identity_map.queries_saved,
+        )
+        if settings.DEBUG:
+            response['X-Identity-Map'] = 'hits=%d; misses=%d; queries-saved=%d' % (
+                identity_map.hits, identity_map.misses, identity_map.queries_saved,
+            )
+        return response
@@ -0,0 +1,104 @@
+"""Responsive derivatives of post images.
+
+Each featured image is resized to the IMAGE_VARIANT_WIDTHS steps (never
+upscaled) and encoded as WebP and JPEG, plus a tiny blurred JPEG inlined as
+a data URI (LQIP) that cards show while the real image loads. The result is
+stored on ``Post.image_variants`` with ready-made ``srcset`` strings:
+
+    {'src': url, 'webp': 'url 320w, ...', 'jpeg': 'url 320w, ...',
+     'lqip': 'data:image/jpeg;base64,...', 'width': 640, 'height': 360}
+"""
+import base64
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageFilter, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATS = (('webp', 'WEBP'), ('jpeg', 'JPEG'))
+LQIP_WIDTH = 16
+VARIANT_FOLDER = 'blog_images/variants'
+
+
+def _widths():
+    return sorted(getattr(settings, 'IMAGE_VARIANT_WIDTHS', (320, 640, 960, 1280)))
+
+
+def _rgb(image):
+    """Flatten transparency onto white, since JPEG has no alpha channel"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(data, widths=None, quality=None):
+    """Encode the width steps of an image; returns (variants, lqip data URI, (width, height))
+
+    variants is a list of (format, width, bytes), smallest width first.
+    """
+    widths = widths or _widths()
+    quality = quality or getattr(settings, 'IMAGE_VARIANT_QUALITY', 80)
+    with Image.open(BytesIO(data)) as source:
+        image = _rgb(ImageOps.exif_transpose(source))
+    steps = sorted({width for width in widths if width < image.width} | {min(image.width, widths[-1])})
+
+    variants = []
+    for width in steps:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for extension, image_format in FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, image_format, quality=quality, optimize=True)
+            variants.append((extension, width, buffer.getvalue()))
+
+    tiny = image.copy()
+    tiny.thumbnail((LQIP_WIDTH, LQIP_WIDTH * 4))
+    buffer = BytesIO()
+    tiny.filter(ImageFilter.GaussianBlur(1)).save(buffer, 'JPEG', quality=40)
+    lqip = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    return variants, lqip, image.size
+
+
+def build_variants(data, name, uploader):
+    """Render and upload the derivatives of an image; returns the image_variants dict"""
+    variants, lqip, (width, height) = render_variants(data)
+    stem = os.path.splitext(os.path.basename(name))[0] or 'image'
+    srcsets = {extension: [] for extension, _ in FORMATS}
+    urls = {}
+    for extension, step, content in variants:
+        url = uploader.upload(ContentFile(content, name=f'{stem}-{step}w.{extension}'), VARIANT_FOLDER)
+        srcsets[extension].append(f'{url} {step}w')
+        urls[extension, step] = url
+
+    # The fallback src is the JPEG step closest to a typical card width
+    steps = sorted({step for _, step, _ in variants})
+    src_width = min(steps, key=lambda step: abs(step - 640))
+    result = {extension: ', '.join(entries) for extension, entries in srcsets.items()}
+    result.update({
+        'src': urls['jpeg', src_width],
+        'lqip': lqip,
+        'width': src_width,
+        'height': max(1, round(height * src_width / width)),
+    })
+    return result
+
+
+def load_image(url):
+    """Read the bytes behind a stored image URL (remote, MEDIA_URL or MEDIA_ROOT-relative)"""
+    if url.startswith(('http://', 'https://')):
+        import requests
+
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        return response.content
+    if url.startswith(settings.MEDIA_URL):
+        url = url[len(settings.MEDIA_URL):]
+    with open(os.path.join(settings.MEDIA_ROOT, url.lstrip('/')), 'rb') as handle:
+        return handle.read()
@@ -0,0 +1,161 @@
+"""Per-request MongoDB command instrumentation.
+
+``CommandTimer`` is a pymongo command listener registered with
+``mongoengine.connect`` in settings. Every finished command is added to the
+stats of the request that issued it (a ContextVar opened by
+``MongoTimingMiddleware``), and commands slower than MONGO_SLOW_COMMAND_MS
+are logged with their query shape: the command with every literal value
+replaced by ``?``, so similar queries group together and no data leaks
+into logs.
+
+The middleware sends the totals in a ``Server-Timing`` header (when
+SERVER_TIMING is on) and logs one structured line per request.
+"""
+import json
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('mongo_stats', default=None)
+
+# Command fields that describe the query; the rest is driver bookkeeping
+SHAPE_FIELDS = ('filter', 'sort', 'projection', 'pipeline', 'query', 'updates', 'deletes', 'key', 'limit')
+
+
+class CommandStats:
+    def __init__(self):
+        self.commands = 0
+        self.failures = 0
+        self.duration_ms = 0.0
+        self.collections = Counter()
+        self.collection_ms = Counter()
+        self.names = Counter()
+
+    def add(self, name, collection, duration_ms, failed=False):
+        self.commands += 1
+        self.failures += failed
+        self.duration_ms += duration_ms
+        self.names[name] += 1
+        if collection:
+            self.collections[collection] += 1
+            self.collection_ms[collection] += duration_ms
+
+
+def current():
+    """Stats of the running request, or None outside one"""
+    return _current.get()
+
+
+def shape(value):
+    """The structure of a command value with every literal replaced by '?'"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in map(shape, value):
+            if item not in shapes:  # $in lists and batches collapse to their distinct shapes
+                shapes.append(item)
+        return shapes
+    return '?'
+
+
+def query_shape(command_name, command):
+    result = {command_name: command.get(command_name)}
+    for key in SHAPE_FIELDS:
+        if key in command:
+            # Sort directions and limits are part of the shape: they change the plan
+            result[key] = command[key] if key in ('sort', 'limit') else shape(command[key])
+    return result
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Adds every command to the current request's CommandStats"""
+
+    def __init__(self):
+        self._started = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._started[event.request_id] = (
+            collection if isinstance(collection, str) else None,
+            event.command if self._slow_ms() is not None else None,
+        )
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed):
+        from .metrics import registry, MONGO_BUCKETS
+
+        collection, command = self._started.pop(event.request_id, (None, None))
+        duration_ms = event.duration_micros / 1000
+        registry.inc('blog_mongo_commands_total', command=event.command_name, outcome='failed' if failed else 'ok')
+        registry.observe('blog_mongo_command_duration_seconds', duration_ms / 1000, MONGO_BUCKETS,
+                         command=event.command_name)
+        stats = _current.get()
+        if stats is not None:
+            stats.add(event.command_name, collection, duration_ms, failed)
+        threshold = self._slow_ms()
+        if command is not None and threshold is not None and duration_ms >= threshold:
+            logger.warning('slow mongo command %.1fms %s', duration_ms, json.dumps(
+                query_shape(event.command_name, command), default=str, sort_keys=True,
+            ))
+
+    @staticmethod
+    def _slow_ms():
+        return getattr(settings, 'MONGO_SLOW_COMMAND_MS', None)
+
+
+def _token(name):
+    return ''.join(char if char.isalnum() or char in '-_' else '-' for char in name)
+
+
+class MongoTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = CommandStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+        request.mongo_stats = stats
+
+        match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'duration_ms': round(total_ms, 1),
+            'mongo_commands': stats.commands,
+            'mongo_ms': round(stats.duration_ms, 1),
+            'mongo_failures': stats.failures,
+            'collections': dict(stats.collections),
+        }, sort_keys=True))
+
+        if getattr(settings, 'SERVER_TIMING', False):
+            metrics = [
+                f'app;dur={total_ms:.1f}',
+                f'mongo;dur={stats.duration_ms:.1f};desc="{stats.commands} commands"',
+            ]
+            metrics += [
+                f'mongo-{_token(name)};dur={stats.collection_ms[name]:.1f};desc="{count} commands"'
+                for name, count in stats.collections.most_common()
+            ]
+            response['Server-Timing'] = ', '.join(metrics)
+        return response
@@ -0,0 +1,104 @@
+"""Projected read model for post listing pages.
+
+Listings only render a card per post, so they load a fixed set of card
+fields as raw pymongo dicts (never ``content``) and wrap each one in a
+small ``__slots__`` object exposing the attributes the templates use.
+``prefetch_taxonomy`` resolves the category and tag references of a whole
+page with one ``$in`` query per collection instead of one per card, going
+through the request identity map so already loaded documents are reused.
+"""
+from django.urls import reverse
+
+from . import identity
+from .models import Post, Category, Tag, _ref_id
+
+CARD_FIELDS = (
+    'title', 'slug', 'excerpt', 'featured_image', 'thumbnail', 'image_variants', 'rating',
+    'anime_type', 'anime_title_jp', 'studio', 'release_year', 'views',
+    'status', 'author_username', 'created_at', 'category', 'tags',
+)
+
+ANIME_TYPE_LABELS = dict(Post.ANIME_TYPES)
+
+
+class PostCard:
+    __slots__ = ('id',) + tuple(f for f in CARD_FIELDS if f not in ('category', 'tags')) + (
+        'category_id', 'tag_ids', '_category', '_tags',
+    )
+
+    def __init__(self, raw):
+        self.id = raw['_id']
+        for field in CARD_FIELDS[:-2]:
+            setattr(self, field, raw.get(field))
+        self.category_id = raw.get('category')
+        self.tag_ids = raw.get('tags') or []
+        self._category = None
+        self._tags = None
+
+    def __str__(self):
+        return self.title
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def category(self):
+        if self._category is None and self.category_id is not None:
+            self._category = identity.get(Category, self.category_id)
+        return self._category
+
+    @property
+    def tags(self):
+        if self._tags is None:
+            tags = identity.get_many(Tag, self.tag_ids)
+            self._tags = [tags[tag_id] for tag_id in self.tag_ids if tag_id in tags]
+        return self._tags
+
+    @property
+    def is_featured(self):
+        return self.rating and self.rating >= 8.0
+
+    def get_anime_type_display(self):
+        return ANIME_TYPE_LABELS.get(self.anime_type, self.anime_type)
+
+    def get_absolute_url(self):
+        return reverse('detail', kwargs={'slug': self.slug})
+
+
+def fetch_cards(queryset):
+    """Run a Post queryset with the card projection and return PostCards"""
+    return [PostCard(raw) for raw in queryset.only(*CARD_FIELDS).as_pymongo()]
+
+
+def _reference_ids(post):
+    """Return (category id, tag ids) for a PostCard or Post document"""
+    if isinstance(post, PostCard):
+        return post.category_id, post.tag_ids
+    return _ref_id(post._data.get('category')), [_ref_id(tag) for tag in post._data.get('tags') or []]
+
+
+def prefetch_taxonomy(posts, category=True, tags=True):
+    """Attach categories and tags to a page of posts with batched lookups"""
+    posts = list(posts)
+    references = [_reference_ids(post) for post in posts]
+    categories = {}
+    if category:
+        categories = identity.get_many(Category, [category_id for category_id, _ in references])
+    tag_map = {}
+    if tags:
+        tag_map = identity.get_many(Tag, [tag_id for _, tag_ids in references for tag_id in tag_ids])
+
+    for post, (category_id, tag_ids) in zip(posts, references):
+        resolved_tags = [tag_map[tag_id] for tag_id in tag_ids if tag_id in tag_map]
+        if isinstance(post, PostCard):
+            if category:
+                post._category = categories.get(category_id)
+            if tags:
+                post._tags = resolved_tags
+        else:
+            if category and category_id is not None:
+                post._data['category'] = categories.get(category_id)
+            if tags:
+                post._data['tags'] = resolved_tags
+    return posts
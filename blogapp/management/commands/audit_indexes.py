@@ -0,0 +1,119 @@
+from datetime import datetime
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from mongoengine import Document
+from mongoengine.base import _document_registry
+
+from blogapp.models import Post, Category, Tag, Comment, Newsletter, Contact, PostViewBucket, TrendingPost
+from blogapp.search import substring_search, text_search
+
+BAD_STAGES = {'COLLSCAN', 'SORT'}
+
+
+def _stages(plan):
+    """Yield every stage name in an explain() plan tree (classic and SBE formats)"""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+def _documents():
+    """Every concrete Document class loaded, so new collections are ensured without listing them here"""
+    return [
+        document_cls for _, document_cls in sorted(_document_registry.items())
+        if issubclass(document_cls, Document) and not document_cls._meta.get('abstract')
+    ]
+
+
+def _keyset(queryset):
+    """The query CursorPaginator issues for a page after the first"""
+    created_at, pk = datetime.utcnow(), ObjectId()
+    return queryset.filter(__raw__={'$or': [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, '_id': {'$lt': pk}},
+    ]}).order_by('-created_at', '-id')
+
+
+def query_catalog():
+    """(name, queryset, allowed bad stages) for every query shape the views issue"""
+    post = Post.objects.only('id', 'slug', 'related_ids').first()
+    category = Category.objects.first()
+    tag = Tag.objects.first()
+    published = Post.objects(status='published')
+    catalog = [
+        ('index: trending posts', TrendingPost.objects.order_by('rank').limit(3), ()),
+        ('index: featured fallback', published.filter(rating__gte=8.0).order_by('-views').limit(3), ()),
+        ('trending: view buckets in window', PostViewBucket.objects(bucket__gte=datetime.utcnow()), ()),
+        ('index/archive: recent posts', published.order_by('-created_at', '-id').limit(13), ()),
+        ('archive: next page', _keyset(published).limit(13), ()),
+        ('validators: latest update', published.order_by('-updated_at').limit(1), ()),
+        ('admin: latest posts', Post.objects.order_by('-created_at').limit(50), ()),
+        ('taxonomy: popular categories',
+         Category.objects(published_count__gt=0).order_by('-published_count', 'name'), ()),
+        ('taxonomy: popular tags', Tag.objects(published_count__gt=0).order_by('-published_count', 'name'), ()),
+        ('forms: all categories', Category.objects.order_by('name'), ()),
+        ('forms: all tags', Tag.objects.order_by('name'), ()),
+        ('search: substring fallback', substring_search(published, 'review').limit(9), ('COLLSCAN',)),
+        ('newsletter: lookup', Newsletter.objects(email='reader@example.com'), ()),
+        ('contact: latest', Contact.objects.order_by('-created_at').limit(10), ()),
+    ]
+    if post:
+        catalog += [
+            ('detail: post by slug', Post.objects(slug=post.slug, status='published'), ()),
+            ('detail: comments', Comment.objects(post=post.pk, is_approved=True).order_by('-created_at'), ()),
+            ('detail: related posts', Post.objects(id__in=post.related_ids, status='published'), ()),
+            ('related: posts listing a saved post', Post.objects(related_ids=post.pk), ()),
+        ]
+    if category:
+        in_category = published.filter(category=category)
+        catalog += [
+            ('category: first page', in_category.order_by('-created_at', '-id').limit(10), ()),
+            ('category: next page', _keyset(in_category).limit(10), ()),
+            ('category: validator', in_category.order_by('-updated_at').limit(1), ()),
+            ('detail: unscored related fallback', in_category.filter(id__ne=post.pk if post else None).limit(4), ()),
+            ('category: by slug', Category.objects(slug=category.slug), ()),
+        ]
+    if tag:
+        with_tag = published.filter(tags=tag)
+        catalog += [
+            ('tag: first page', with_tag.order_by('-created_at', '-id').limit(10), ()),
+            ('tag: next page', _keyset(with_tag).limit(10), ()),
+            ('tag: validator', with_tag.order_by('-updated_at').limit(1), ()),
+            ('tag: by slug', Tag.objects(slug=tag.slug), ()),
+        ]
+    # Relevance order is always an in-memory sort over the text matches
+    catalog.append(('search: text index', text_search(published, 'review').limit(9), ('SORT',)))
+    return catalog
+
+
+class Command(BaseCommand):
+    help = 'Explain every query shape the views issue and fail on collection scans or in-memory sorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ensure', action='store_true', help='Create missing indexes before auditing')
+
+    def handle(self, *args, **options):
+        if options['ensure']:
+            for document_cls in _documents():
+                document_cls.ensure_indexes()
+
+        failures = []
+        for name, queryset, allowed in query_catalog():
+            stages = list(_stages(queryset.explain().get('queryPlanner', {}).get('winningPlan', {})))
+            bad = sorted((BAD_STAGES & set(stages)) - set(allowed))
+            line = f'{name}: {" > ".join(stages)}'
+            if bad:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'FAIL {line}'))
+            else:
+                self.stdout.write(f'ok   {line}')
+
+        if failures:
+            raise CommandError(f'{len(failures)} queries are not covered by an index: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS('All view queries use indexes'))
@@ -0,0 +1,62 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blogapp.benchmark import MODES, VIEWS, run_benchmark
+
+
+def _sizes(value):
+    try:
+        return [int(size) for size in value.split(',') if size.strip()]
+    except ValueError:
+        raise CommandError(f'--sizes must be comma-separated integers, got {value!r}')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the public views against seeded throwaway databases and report latency, queries and memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000', help='Comma-separated corpus sizes (posts)')
+        parser.add_argument('--views', nargs='+', choices=VIEWS, default=list(VIEWS))
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES),
+                            help='cold clears the page and fragment caches before every request')
+        parser.add_argument('--requests', type=int, default=50, help='Measured requests per view and mode')
+        parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests before each run')
+        parser.add_argument('--memory-requests', type=int, default=5,
+                            help='Requests traced with tracemalloc for the peak memory column')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus and of the URL choices')
+        parser.add_argument('--backend', choices=('mongomock', 'mongod'), default='mongomock')
+        parser.add_argument('--host', default='mongodb://localhost:27017', help='mongod URI for --backend mongod')
+        parser.add_argument('--database', default='blog_benchmark',
+                            help='Throwaway database, dropped before and after the run')
+        parser.add_argument('--output', help="Write the JSON report to this file, or '-' for stdout")
+
+    def handle(self, *args, **options):
+        output = options['output']
+        log = self.stderr if output == '-' else self.stdout
+
+        try:
+            report = run_benchmark(
+                _sizes(options['sizes']),
+                views=options['views'],
+                modes=options['modes'],
+                requests=options['requests'],
+                warmup=options['warmup'],
+                memory_requests=options['memory_requests'],
+                seed=options['seed'],
+                backend=options['backend'],
+                database=options['database'],
+                host=options['host'],
+                progress=log.write,
+            )
+        except (ValueError, RuntimeError) as error:
+            raise CommandError(error)
+
+        if output == '-':
+            json.dump(report, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+        elif output:
+            with open(output, 'w', encoding='utf-8') as handle:
+                json.dump(report, handle, indent=2)
+            log.write(self.style.SUCCESS(f'Wrote {len(report["results"])} results to {output}'))
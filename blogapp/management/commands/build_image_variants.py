@@ -0,0 +1,61 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from blogapp.caching import invalidate, POSTS
+from blogapp.images import build_variants, load_image
+from blogapp.models import Post
+from blogapp.uploads import get_uploader, image_placeholder
+
+
+def _build(job):
+    """Fetch, resize and upload one post image; runs in a worker process"""
+    post_id, url = job
+    try:
+        return post_id, url, build_variants(load_image(url), url.rsplit('/', 1)[-1], get_uploader()), None
+    except Exception as error:
+        return post_id, url, None, f'{type(error).__name__}: {error}'
+
+
+class Command(BaseCommand):
+    help = 'Generate responsive WebP/JPEG variants and LQIP placeholders for existing post images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=50, help='Posts written per bulk update')
+        parser.add_argument('--force', action='store_true', help='Rebuild posts that already have variants')
+
+    def handle(self, *args, **options):
+        query = {'featured_image': {'$nin': [None, '', image_placeholder()]}}
+        if not options['force']:
+            query['image_variants'] = {'$in': [None, {}]}
+        cursor = Post._get_collection().find(query, {'featured_image': 1})
+        jobs = ((row['_id'], row['featured_image']) for row in cursor)
+
+        built = failed = 0
+        operations = []
+        # Workers only resize and upload; all database writes stay in this process
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            for post_id, url, variants, error in pool.map(_build, jobs, chunksize=4):
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{url}: {error}')
+                    continue
+                operations.append(UpdateOne(
+                    {'_id': post_id, 'featured_image': url}, {'$set': {'image_variants': variants}}
+                ))
+                if len(operations) >= options['batch_size']:
+                    built += self._write(operations)
+                    operations = []
+            built += self._write(operations)
+
+        if built:
+            invalidate(POSTS)
+        self.stdout.write(self.style.SUCCESS(f'Built variants for {built} posts ({failed} failed)'))
+
+    def _write(self, operations):
+        if not operations:
+            return 0
+        return Post._get_collection().bulk_write(operations, ordered=False).modified_count
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blogapp.trending import compute_trending
+
+
+class Command(BaseCommand):
+    help = 'Recompute the time-decayed trending ranking from hourly view buckets (run periodically)'
+
+    def handle(self, *args, **options):
+        ranked = compute_trending()
+        self.stdout.write(self.style.SUCCESS(f'Trending ranking updated with {ranked} posts'))
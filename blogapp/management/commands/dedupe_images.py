@@ -0,0 +1,112 @@
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from pymongo import UpdateMany
+
+from blogapp.caching import invalidate, POSTS
+from blogapp.images import load_image
+from blogapp.models import Post, ImageAsset
+from blogapp.uploads import image_placeholder, register_asset
+
+IMAGE_FIELDS = ('featured_image', 'thumbnail')
+
+
+def _hash(url):
+    try:
+        data = load_image(url)
+    except Exception as error:
+        return url, None, 0, f'{type(error).__name__}: {error}'
+    return url, hashlib.sha256(data).hexdigest(), len(data), None
+
+
+class Command(BaseCommand):
+    help = ('Hash existing post images and report duplicates; --apply points posts at one stored copy, '
+            '--delete also removes the duplicate files')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Images downloaded and hashed in parallel')
+        parser.add_argument('--apply', action='store_true',
+                            help='Point posts at the canonical copies (default: only report)')
+        parser.add_argument('--delete', action='store_true',
+                            help='With --apply, also delete the duplicate files under MEDIA_ROOT')
+
+    def handle(self, *args, **options):
+        if options['delete'] and not options['apply']:
+            raise CommandError('--delete needs --apply: files are only removed once no post points at them')
+        apply = options['apply']
+        skip = [None, '', image_placeholder()]
+        rows = Post._get_collection().find(
+            {'$or': [{field: {'$nin': skip}} for field in IMAGE_FIELDS]},
+            {'featured_image': 1, 'thumbnail': 1, 'image_variants': 1},
+        )
+        variants = {}  # url -> image_variants of a post showing it
+        for row in rows:
+            for field in IMAGE_FIELDS:
+                url = row.get(field)
+                if url not in skip:
+                    variants.setdefault(url, None)
+            if row.get('featured_image') not in skip and row.get('image_variants'):
+                variants[row['featured_image']] = row['image_variants']
+
+        groups = defaultdict(list)
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for url, sha256, size, error in pool.map(_hash, variants):
+                if error:
+                    self.stderr.write(f'{url}: {error}')
+                else:
+                    groups[sha256].append((url, size))
+
+        stored = {
+            row['_id']: row['url']
+            for row in ImageAsset._get_collection().find({'_id': {'$in': list(groups)}}, {'url': 1})
+        }
+        operations, local_files = [], []
+        duplicates = reclaimed = 0
+        for sha256, entries in groups.items():
+            size = entries[0][1]
+            canonical = stored.get(sha256) or entries[0][0]
+            canonical_variants = variants.get(canonical) or next(
+                (variants[url] for url, _ in entries if variants.get(url)), None
+            )
+            if apply:
+                register_asset(sha256, canonical, size, canonical_variants)
+            for url, _ in entries:
+                if url == canonical:
+                    continue
+                duplicates += 1
+                reclaimed += size
+                operations += [
+                    UpdateMany({'featured_image': url}, {'$set': {
+                        'featured_image': canonical, 'image_variants': canonical_variants or {},
+                    }}),
+                    UpdateMany({'thumbnail': url}, {'$set': {'thumbnail': canonical}}),
+                ]
+                if url.startswith(settings.MEDIA_URL):
+                    local_files.append(os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):]))
+
+        local_files = [path for path in local_files if os.path.exists(path)]
+        delete = options['delete']
+        for path in local_files:
+            self.stdout.write(f'{"removing" if delete else "would remove"} {path}')
+
+        if apply and operations:
+            Post._get_collection().bulk_write(operations, ordered=False)
+            invalidate(POSTS)
+            if delete:
+                for path in local_files:
+                    os.remove(path)
+
+        verb = 'reclaimed' if delete else 'can be reclaimed'
+        self.stdout.write(f'{len(variants)} image URLs, {len(groups)} distinct images, {duplicates} duplicates')
+        self.stdout.write(self.style.SUCCESS(f'{filesizeformat(reclaimed)} {verb}'))
+        if not apply:
+            self.stdout.write('Nothing was changed; rerun with --apply (and --delete to remove the files).')
+        elif local_files and not delete:
+            self.stdout.write('The duplicate files listed above were kept; no post points at them any more.')
+        if len(local_files) < duplicates:
+            self.stdout.write(f'{duplicates - len(local_files)} duplicates are remote copies that are no longer referenced')
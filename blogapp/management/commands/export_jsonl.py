@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from blogapp.bulk import KINDS, dumps, export_records
+
+
+class Command(BaseCommand):
+    help = 'Stream categories, tags, posts and comments to a JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, or '-' for stdout")
+        parser.add_argument('--kinds', nargs='+', choices=list(KINDS), default=list(KINDS),
+                            help='Record kinds to export (default: all)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Documents fetched per cursor batch')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        target = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8')
+        count = 0
+        try:
+            for record in export_records(options['kinds'], batch_size=options['batch_size']):
+                target.write(dumps(record))
+                count += 1
+        finally:
+            if target is not sys.stdout:
+                target.close()
+        self.stderr.write(self.style.SUCCESS(f'Exported {count} records to {path}'))
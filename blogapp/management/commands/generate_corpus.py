@@ -0,0 +1,65 @@
+import os
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blogapp.corpus import Corpus, TaxonomyConflict, generate
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise CommandError(f'--end must be a YYYY-MM-DD date, got {value!r}')
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic synthetic corpus of categories, tags, posts and comments for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('posts', type=int, help='Number of posts to generate')
+        parser.add_argument('--seed', type=int, default=0, help='Same seed and options, same documents')
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--tags', type=int, default=500)
+        parser.add_argument('--studios', type=int, default=400)
+        parser.add_argument('--comments-per-post', type=float, default=3.0,
+                            help='Average comments per published post, concentrated on the most viewed')
+        parser.add_argument('--days', type=int, default=730, help='Posts are spread over this many days')
+        parser.add_argument('--end', type=_date, help='Date of the newest post, YYYY-MM-DD (default: today, UTC)')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Posts per bulk insert batch')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes building and inserting batches (1: in this process)')
+
+    def handle(self, *args, **options):
+        if options['posts'] < 1 or options['batch_size'] < 1:
+            raise CommandError('posts and --batch-size must be positive')
+        corpus = Corpus(
+            options['posts'],
+            seed=options['seed'],
+            categories=options['categories'],
+            tags=options['tags'],
+            studios=options['studios'],
+            comments_per_post=options['comments_per_post'],
+            days=options['days'],
+            end=options['end'],
+        )
+        started = time.perf_counter()
+
+        def progress(done, total, totals):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'batch {done}/{total}: {totals["posts"]} posts, {totals["comments"]} comments '
+                f'({totals["posts"] / elapsed:.0f} posts/s)'
+            )
+
+        try:
+            totals = generate(corpus, batch_size=options['batch_size'], workers=options['workers'], progress=progress)
+        except TaxonomyConflict as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {totals["categories"]} categories, {totals["tags"]} tags, {totals["posts"]} posts and '
+            f'{totals["comments"]} comments in {time.perf_counter() - started:.1f}s '
+            f'(already stored documents are skipped)'
+        ))
+        self.stdout.write('Run rebuild_related_posts and compute_trending to fill the derived data.')
@@ -0,0 +1,57 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blogapp.bulk import Importer, RecordError
+
+
+class Command(BaseCommand):
+    help = 'Import categories, tags, posts and comments from a JSONL file in bulk chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSONL file, one record with a "kind" field per line')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Records per bulk write')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint)')
+        parser.add_argument('--resume', action='store_true', help='Continue after the last checkpointed chunk')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        offset, line = 0, 0
+        if options['resume'] and os.path.exists(checkpoint):
+            with open(checkpoint) as handle:
+                state = json.load(handle)
+            offset, line = state['offset'], state['line']
+            self.stdout.write(f'Resuming after line {line}')
+
+        importer = Importer(chunk_size=options['chunk_size'])
+        try:
+            with open(path, 'rb') as source:
+                source.seek(offset)
+                for raw in source:
+                    line += 1
+                    if raw.strip():
+                        try:
+                            record = json.loads(raw)
+                        except ValueError as error:
+                            raise RecordError(line, error)
+                        # A write means every line before this one is stored
+                        if importer.add(line, record):
+                            self._save_checkpoint(checkpoint, offset, line - 1)
+                    offset += len(raw)
+                importer.finish()
+        except RecordError as error:
+            raise CommandError(f'{error}; fix the record and rerun with --resume')
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        for kind, created in importer.created.items():
+            self.stdout.write(f'{kind}: {created} imported, {importer.skipped[kind]} already present')
+        self.stdout.write(self.style.SUCCESS(f'Imported {line} lines from {path}'))
+
+    def _save_checkpoint(self, checkpoint, offset, line):
+        temporary = f'{checkpoint}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({'offset': offset, 'line': line}, handle)
+        os.replace(temporary, checkpoint)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from blogapp.caching import invalidate, POSTS
+from blogapp.related import process_related_queue, rebuild_related
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed related posts of every published post, or only of queued ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--block-size', type=int, default=256, help='Posts scored per matrix product')
+        parser.add_argument('--pending', action='store_true',
+                            help='Only rescore posts saved or deleted since the last run')
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            updated = process_related_queue(block_size=options['block_size'])
+        else:
+            updated = rebuild_related(block_size=options['block_size'])
+        if updated:
+            invalidate(POSTS)
+        self.stdout.write(self.style.SUCCESS(f'Related posts rebuilt for {updated} posts'))
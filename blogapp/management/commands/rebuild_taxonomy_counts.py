@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from blogapp.models import rebuild_published_counts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the published_count counters on categories and tags from the posts collection'
+
+    def handle(self, *args, **options):
+        totals = rebuild_published_counts()
+        for name, used in totals.items():
+            self.stdout.write(f'{name}: {used} with published posts')
+        self.stdout.write(self.style.SUCCESS('Taxonomy counters rebuilt'))
@@ -0,0 +1,368 @@
+"""Prometheus-style metrics shared by every worker process.
+
+Each process keeps its own ``Registry`` of counters and histograms and
+writes a JSON snapshot of it, plus the current value of its gauges, to
+``METRICS_DIR/<pid>.json`` every METRICS_FLUSH_INTERVAL seconds (atomically,
+through a rename). ``/metrics`` flushes the serving process and sums the
+snapshots of the whole process group, so one scrape sees every gunicorn
+worker. When a worker exits (or a scrape finds one that died without
+saying so) its counters and histograms are folded into
+``METRICS_DIR/archive.json`` and its file removed, so the exported totals
+only ever grow and Prometheus never sees a reset; only its gauges go away.
+
+``/metrics`` answers only scrapes that send METRICS_TOKEN or come from an
+address in METRICS_ALLOWED_IPS; with neither configured it is closed.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows development servers run a single process
+    fcntl = None
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+HELP = {
+    'blog_requests_total': ('counter', 'Requests served, by URL name and status code'),
+    'blog_request_duration_seconds': ('histogram', 'Request latency by URL name'),
+    'blog_page_cache_requests_total': ('counter', 'Full-page cache lookups by result'),
+    'blog_fragment_cache_requests_total': ('counter', 'Fragment cache lookups by result'),
+    'blog_fragment_cache_hit_ratio': ('gauge', 'Share of fragment lookups served from cache (fresh or stale)'),
+    'blog_page_cache_hit_ratio': ('gauge', 'Share of cacheable page requests served from cache'),
+    'blog_mongo_commands_total': ('counter', 'MongoDB commands by command name and outcome'),
+    'blog_mongo_command_duration_seconds': ('histogram', 'MongoDB command latency by command name'),
+    'blog_view_counter_pending': ('gauge', 'Post views buffered and not yet written'),
+    'blog_view_counter_flush_lag_seconds': ('gauge', 'Age of the oldest buffered post view'),
+    'blog_upload_queue_depth': ('gauge', 'Image uploads queued or running'),
+}
+# How per-process gauge values combine into one
+GAUGE_MERGE = {'blog_view_counter_flush_lag_seconds': max}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._collectors = []
+        self._thread = None
+        self._pid = None
+        self._flush_lock = threading.Lock()
+        self._closed = False
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+        self._ensure_flusher()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self._ensure_flusher()
+
+    def collector(self, function):
+        """Register function() -> [(kind, name, labels, value)], read at every flush"""
+        self._collectors.append(function)
+        return function
+
+    def snapshot(self):
+        samples = []
+        for function in self._collectors:
+            try:
+                samples += function()
+            except Exception:
+                pass
+        with self._lock:
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, dict(labels), histogram] for (name, labels), histogram in self._histograms.items()],
+                'samples': samples,
+            }
+
+    def flush(self):
+        with self._flush_lock:
+            # Once archived, a rewritten file would be counted a second time
+            if self._closed:
+                return
+            os.makedirs(metrics_dir(), exist_ok=True)
+            _write_json(_path(os.getpid()), self.snapshot())
+
+    def _ensure_flusher(self):
+        # Forked workers start with the parent's values; each keeps its own file from then on
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                self._counters.clear()
+                self._histograms.clear()
+            else:
+                atexit.register(self.close)  # forked workers inherit it, and archive their own file
+            self._pid = pid
+            _archive(pid)  # left by an earlier process with this pid
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Fold this process's totals into the archive as it exits"""
+        if self._pid != os.getpid():
+            return
+        with self._flush_lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                os.makedirs(metrics_dir(), exist_ok=True)
+                _write_json(_path(self._pid), self.snapshot())  # counts since the last flush
+                _archive(self._pid)
+            except OSError:
+                pass
+
+    def _run(self):
+        while True:
+            time.sleep(getattr(settings, 'METRICS_FLUSH_INTERVAL', 5.0))
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'animeverse-metrics'))
+
+
+def _path(pid):
+    return os.path.join(metrics_dir(), f'{pid}.json')
+
+
+def _archive_path():
+    return os.path.join(metrics_dir(), 'archive.json')
+
+
+def _write_json(path, data):
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(handle, 'w') as stream:
+        json.dump(data, stream)
+    os.replace(temporary, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _directory_lock():
+    """Serialise archiving and collecting across the workers sharing METRICS_DIR"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(metrics_dir(), exist_ok=True)
+    with open(os.path.join(metrics_dir(), '.lock'), 'w') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _add_totals(counters, histograms, snapshot):
+    """Add a snapshot's counters and histograms (gauges excluded) to the running sums"""
+    for name, labels, value in snapshot.get('counters', ()):
+        counters[_key(name, labels)] += value
+    for name, labels, histogram in snapshot.get('histograms', ()):
+        merged = histograms.setdefault(_key(name, labels), {
+            'buckets': histogram['buckets'], 'counts': [0] * len(histogram['buckets']), 'sum': 0.0, 'count': 0,
+        })
+        merged['counts'] = [a + b for a, b in zip(merged['counts'], histogram['counts'])]
+        merged['sum'] += histogram['sum']
+        merged['count'] += histogram['count']
+    for kind, name, labels, value in snapshot.get('samples', ()):
+        if kind == 'counter':
+            counters[_key(name, labels)] += value
+
+
+def _archive(pid, locked=False):
+    """Move a worker file's counters and histograms into archive.json and remove the file"""
+    if not locked:
+        with _directory_lock():
+            return _archive(pid, locked=True)
+    snapshot = _read_json(_path(pid))
+    if snapshot is not None:
+        counters, histograms = defaultdict(float), {}
+        _add_totals(counters, histograms, _read_json(_archive_path()) or {})
+        _add_totals(counters, histograms, snapshot)
+        _write_json(_archive_path(), {
+            'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, dict(labels), histogram] for (name, labels), histogram in histograms.items()],
+        })
+    try:
+        os.remove(_path(pid))
+    except OSError:
+        pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """Sum the snapshots of every worker: (counters, histograms, gauges)"""
+    counters = defaultdict(float)
+    histograms = {}
+    gauges = defaultdict(list)
+    directory = metrics_dir()
+    if not os.path.isdir(directory):
+        return counters, histograms, {}
+    # Under the lock, so no worker moves into the archive between reading it and its file
+    with _directory_lock():
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json') or not filename[:-5].isdigit():
+                continue
+            pid = int(filename[:-5])
+            if not _alive(pid):
+                _archive(pid, locked=True)  # killed before its atexit ran
+                continue
+            snapshot = _read_json(os.path.join(directory, filename))
+            if snapshot is None:
+                continue
+            _add_totals(counters, histograms, snapshot)
+            for kind, name, labels, value in snapshot['samples']:
+                if kind != 'counter':
+                    gauges[_key(name, labels)].append(value)
+        _add_totals(counters, histograms, _read_json(_archive_path()) or {})
+    gauges = {key: GAUGE_MERGE.get(key[0], sum)(values) for key, values in gauges.items()}
+    _add_ratios(counters, gauges)
+    return counters, histograms, gauges
+
+
+def _add_ratios(counters, gauges):
+    for cache_name in ('fragment', 'page'):
+        totals = defaultdict(float)
+        for (name, labels), value in counters.items():
+            if name == f'blog_{cache_name}_cache_requests_total':
+                totals[dict(labels)['result']] += value
+        lookups = sum(totals.values())
+        if lookups:
+            hits = lookups - totals.get('miss', 0)
+            gauges[_key(f'blog_{cache_name}_cache_hit_ratio', {})] = hits / lookups
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render():
+    """The text exposition format of every worker's metrics"""
+    counters, histograms, gauges = collect()
+    families = defaultdict(list)
+    for (name, labels), value in sorted({**counters, **gauges}.items()):
+        families[name].append(f'{name}{_labels(labels)} {value:g}')
+    for (name, labels), histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            cumulative += count
+            families[name].append(f'{name}_bucket{_labels(labels, [("le", f"{bound:g}")])} {cumulative}')
+        families[name].append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {histogram["count"]}')
+        families[name].append(f'{name}_sum{_labels(labels)} {histogram["sum"]:g}')
+        families[name].append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+
+    lines = []
+    for name in sorted(families):
+        kind, description = HELP.get(name, ('untyped', name))
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}', *families[name]]
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@registry.collector
+def _process_samples():
+    from .caching import tiered_cache
+    from .uploads import upload_queue
+    from .viewcounter import view_counter
+
+    fragments = tiered_cache()
+    return [
+        ('counter', 'blog_fragment_cache_requests_total', {'result': 'hit'}, fragments.hits),
+        ('counter', 'blog_fragment_cache_requests_total', {'result': 'stale'}, fragments.stale_hits),
+        ('counter', 'blog_fragment_cache_requests_total', {'result': 'miss'}, fragments.misses),
+        ('gauge', 'blog_view_counter_pending', {}, view_counter.pending()),
+        ('gauge', 'blog_view_counter_flush_lag_seconds', {}, view_counter.lag()),
+        ('gauge', 'blog_upload_queue_depth', {}, upload_queue.depth()),
+    ]
+
+
+class MetricsMiddleware:
+    """Counts every request and records its latency under its URL name"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        registry.observe('blog_request_duration_seconds', time.perf_counter() - started, view=view)
+        registry.inc('blog_requests_total', view=view, status=response.status_code)
+        page_cache = response.get('X-Page-Cache')
+        if page_cache:
+            registry.inc('blog_page_cache_requests_total', result=page_cache)
+        return response
+
+
+def _authorized(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ())
+
+
+def metrics_view(request):
+    if not _authorized(request):
+        return HttpResponseForbidden()
+    registry._ensure_flusher()
+    registry.flush()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,8 +1,114 @@
 from mongoengine import Document, StringField, IntField, FloatField, \
-    DateTimeField, BooleanField, ListField, ReferenceField, EmailField
+    DateTimeField, BooleanField, ListField, ReferenceField, EmailField, DictField, \
+    ObjectIdField
+from mongoengine.errors import NotUniqueError
+from django.conf import settings
 from django.urls import reverse
 from django.utils.text import slugify
+import logging
+import re
 from datetime import datetime
+from collections import Counter
+from pymongo import UpdateOne, UpdateMany
+
+from .caching import invalidate, post_tag, slug_tag, POSTS, TAXONOMY, COMMENTS, TRENDING
+
+logger = logging.getLogger(__name__)
+
+
+def _published_counts(field, limit=None):
+    """Count published posts grouped by a reference field in one aggregation"""
+    pipeline = [{'$match': {'status': 'published', field: {'$ne': None}}}]
+    if field == 'tags':
+        pipeline.append({'$unwind': '$tags'})
+    pipeline += [
+        {'$group': {'_id': '$' + field, 'count': {'$sum': 1}}},
+        {'$sort': {'count': -1, '_id': 1}},
+    ]
+    if limit:
+        pipeline.append({'$limit': limit})
+    return [(row['_id'], row['count']) for row in Post._get_collection().aggregate(pipeline)]
+
+
+def _with_post_counts(document_cls, limit=None):
+    """Load documents that have published posts, most used first, with post_count set"""
+    documents = document_cls.objects(published_count__gt=0).order_by('-published_count', 'name')
+    if limit:
+        documents = documents[:limit]
+    result = []
+    for document in documents:
+        document.post_count = document.published_count
+        result.append(document)
+    return result
+
+
+SLUG_ATTEMPTS = 5
+
+
+def allocate_slugs(bases):
+    """Return a free slug for each base slug, with one prefix-anchored index query.
+
+    Free means not stored yet and not handed out earlier in the same call.
+    A free base is returned as is; a taken "one-piece-review" becomes
+    "one-piece-review-N" with N one past the highest suffix in use.
+    """
+    distinct = list(dict.fromkeys(bases))
+    if not distinct:
+        return []
+    taken, highest = set(), {}
+    query = {'$or': [{'slug': {'$regex': '^%s(-[0-9]+)?$' % re.escape(base)}} for base in distinct]}
+    for row in Post._get_collection().find(query, {'slug': 1, '_id': 0}):
+        slug = row['slug']
+        if slug in distinct:
+            taken.add(slug)
+        prefix, _, suffix = slug.rpartition('-')
+        if suffix.isdigit() and prefix in distinct:
+            highest[prefix] = max(highest.get(prefix, 0), int(suffix))
+    slugs = []
+    for base in bases:
+        # A stored "naruto-2" (title "Naruto 2") must not push "Naruto" off its bare slug
+        if base not in taken:
+            taken.add(base)
+            slugs.append(base)
+        else:
+            highest[base] = highest.get(base, 0) + 1
+            slugs.append(f'{base}-{highest[base]}')
+    return slugs
+
+
+def _ref_id(value):
+    """Return the id behind a reference value (document, DBRef or raw id)"""
+    if value is None:
+        return None
+    return getattr(value, 'pk', None) or getattr(value, 'id', None) or value
+
+
+def _apply_count_deltas(document_cls, deltas):
+    """Apply published_count changes with atomic $inc updates"""
+    operations = [
+        UpdateOne({'_id': pk}, {'$inc': {'published_count': delta}})
+        for pk, delta in deltas.items() if pk is not None and delta
+    ]
+    if operations:
+        document_cls._get_collection().bulk_write(operations, ordered=False)
+
+
+def rebuild_published_counts():
+    """Recompute every category and tag published_count from the posts collection"""
+    totals = {}
+    for document_cls, field in ((Category, 'category'), (Tag, 'tags')):
+        counts = _published_counts(field)
+        operations = [UpdateMany(
+            {'_id': {'$nin': [pk for pk, _ in counts]}},
+            {'$set': {'published_count': 0}},
+        )]
+        operations += [
+            UpdateOne({'_id': pk}, {'$set': {'published_count': count}})
+            for pk, count in counts
+        ]
+        document_cls._get_collection().bulk_write(operations, ordered=False)
+        totals[document_cls.__name__] = len(counts)
+    return totals
 
 
 class Category(Document):
@@ -11,10 +117,11 @@ class Category(Document):
     description = StringField()
     color = StringField(max_length=7, default='#6366f1')  # Hex color for category
     created_at = DateTimeField(default=datetime.utcnow)
+    published_count = IntField(default=0)  # Maintained by Post.save / Post.delete
     
     meta = {
         'collection': 'categories',
-        'indexes': ['slug', 'name'],
+        'indexes': ['slug', 'name', ('-published_count', 'name')],
         'ordering': ['name']
     }
     
@@ -24,24 +131,37 @@ class Category(Document):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        return super().save(*args, **kwargs)
+        result = super().save(*args, **kwargs)
+        invalidate(TAXONOMY, POSTS)
+        return result
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate(TAXONOMY, POSTS)
+        return result
     
     def get_absolute_url(self):
         return reverse('category_posts', kwargs={'slug': self.slug})
     
     def get_post_count(self):
         """Get number of published posts in this category"""
-        return Post.objects(category=self, status='published').count()
+        return self.published_count
+
+    @classmethod
+    def with_post_counts(cls, limit=None):
+        """Get categories with published posts, ordered by post count"""
+        return _with_post_counts(cls, limit=limit)
 
 
 class Tag(Document):
     name = StringField(max_length=50, required=True, unique=True)
     slug = StringField(unique=True, required=True)
     created_at = DateTimeField(default=datetime.utcnow)
+    published_count = IntField(default=0)  # Maintained by Post.save / Post.delete
     
     meta = {
         'collection': 'tags',
-        'indexes': ['slug', 'name'],
+        'indexes': ['slug', 'name', ('-published_count', 'name')],
         'ordering': ['name']
     }
     
@@ -51,14 +171,26 @@ class Tag(Document):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        return super().save(*args, **kwargs)
+        result = super().save(*args, **kwargs)
+        invalidate(TAXONOMY, POSTS)
+        return result
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate(TAXONOMY, POSTS)
+        return result
     
     def get_absolute_url(self):
         return reverse('tag_posts', kwargs={'slug': self.slug})
     
     def get_post_count(self):
         """Get number of published posts with this tag"""
-        return Post.objects(tags=self, status='published').count()
+        return self.published_count
+
+    @classmethod
+    def with_post_counts(cls, limit=None):
+        """Get tags with published posts, ordered by post count"""
+        return _with_post_counts(cls, limit=limit)
 
 
 class Post(Document):
@@ -91,6 +223,8 @@ class Post(Document):
     # Images (URLs/paths for Cloudinary)
     featured_image = StringField()
     thumbnail = StringField()
+    image_variants = DictField()  # Responsive derivatives of featured_image (see blogapp/images.py)
+    upload_errors = DictField()  # Image field -> reason, when a background upload gave up
     
     # Metadata
     author_id = IntField(required=True)  # Django User ID
@@ -105,11 +239,31 @@ class Post(Document):
     
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
+    last_commented_at = DateTimeField()  # Raised with $max by Comment.save
     views = IntField(default=0)
+    related_ids = ListField(ObjectIdField())  # Best first, see blogapp/related.py
+    related_scores = ListField(FloatField())
     
     meta = {
         'collection': 'posts',
-        'indexes': ['slug', 'status', 'author_id', 'created_at', '-created_at'],
+        'indexes': [
+            'slug', 'status', 'author_id', 'created_at', '-created_at',
+            # Compound indexes matched to view query shapes (checked by `manage.py audit_indexes`):
+            # equality fields first, then the sort, then range filters.
+            ('status', '-created_at', '-id'),                # recent posts, archive pages
+            ('status', 'category', '-created_at', '-id'),    # category pages, related posts
+            ('status', 'tags', '-created_at', '-id'),        # tag pages
+            ('status', '-views', 'rating'),                  # featured posts
+            ('status', '-updated_at'),                       # conditional GET validators
+            ('status', 'category', '-updated_at'),
+            ('status', 'tags', '-updated_at'),
+            'related_ids',                                   # posts listing a saved post as related
+            {
+                'fields': ['$title', '$studio', '$anime_title_jp', '$content'],
+                'default_language': 'english',
+                'weights': {'title': 10, 'studio': 5, 'anime_title_jp': 3, 'content': 1},
+            },
+        ],
         'ordering': ['-created_at']
     }
     
@@ -117,27 +271,84 @@ class Post(Document):
         return self.title
     
     def save(self, *args, **kwargs):
-        # Auto-generate slug if not provided
-        if not self.slug:
-            self.slug = slugify(self.title)
-            
-            # Ensure slug is unique
-            original_slug = self.slug
-            counter = 1
-            while Post.objects(slug=self.slug, id__ne=self.id).first():
-                self.slug = f"{original_slug}-{counter}"
-                counter += 1
-        
         self.updated_at = datetime.utcnow()
-        return super().save(*args, **kwargs)
+        previous = self._stored_taxonomy() if self.pk else (None, [])
+        
+        # Auto-generate slug if not provided. Two saves can still pick the same
+        # free slug; the unique index rejects the second one, which retries.
+        generate_slug = not self.slug
+        for attempt in range(SLUG_ATTEMPTS):
+            if generate_slug:
+                self.slug = allocate_slugs([slugify(self.title) or 'post'])[0]
+            try:
+                result = super().save(*args, **kwargs)
+                break
+            except NotUniqueError:
+                if not generate_slug or attempt == SLUG_ATTEMPTS - 1:
+                    raise
+        self._update_taxonomy_counts(previous, self._taxonomy())
+        self._queue_related()
+        dropped = self._drop_trending() if self.status != 'published' else False
+        invalidate(POSTS, TAXONOMY, post_tag(self.pk), slug_tag(self.slug), *([TRENDING] if dropped else []))
+        return result
+    
+    def delete(self, *args, **kwargs):
+        previous = self._stored_taxonomy()
+        result = super().delete(*args, **kwargs)
+        self._update_taxonomy_counts(previous, (None, []))
+        self._queue_related()
+        dropped = self._drop_trending()
+        invalidate(POSTS, TAXONOMY, post_tag(self.pk), slug_tag(self.slug), *([TRENDING] if dropped else []))
+        return result
+    
+    def _drop_trending(self):
+        """Remove the post from the trending ranking until the next compute_trending; True if it was ranked"""
+        return TrendingPost._get_collection().delete_many({'post': self.pk}).deleted_count > 0
+    
+    def _queue_related(self):
+        # Scoring needs the whole corpus, so it runs in rebuild_related_posts --pending, not here
+        if not getattr(settings, 'RELATED_UPDATE_ON_SAVE', True):
+            return
+        from .related import enqueue_related
+
+        try:
+            enqueue_related(self.pk)
+        except Exception:
+            # The nightly full rebuild_related_posts run catches anything missed here
+            logger.exception('Could not queue related posts update for %s', self.pk)
+    
+    def _taxonomy(self):
+        """Category id and tag ids this post adds to published counts"""
+        if self.status != 'published':
+            return None, []
+        tags = self._data.get('tags') or []
+        return _ref_id(self._data.get('category')), [_ref_id(tag) for tag in tags]
+    
+    def _stored_taxonomy(self):
+        """Same as _taxonomy, read from the persisted document"""
+        stored = Post._get_collection().find_one(
+            {'_id': self.pk}, {'status': 1, 'category': 1, 'tags': 1}
+        )
+        if not stored or stored.get('status') != 'published':
+            return None, []
+        return _ref_id(stored.get('category')), [_ref_id(tag) for tag in stored.get('tags') or []]
+    
+    @staticmethod
+    def _update_taxonomy_counts(previous, current):
+        category_deltas = Counter({current[0]: 1})
+        category_deltas.subtract({previous[0]: 1})
+        tag_deltas = Counter(set(current[1]))
+        tag_deltas.subtract(set(previous[1]))
+        _apply_count_deltas(Category, category_deltas)
+        _apply_count_deltas(Tag, tag_deltas)
     
     def get_absolute_url(self):
         return reverse('detail', kwargs={'slug': self.slug})
     
     def increment_views(self):
-        """Increment view count"""
-        self.views += 1
-        self.save()
+        """Increment view count with an atomic $inc, without rewriting the document"""
+        Post.objects(id=self.id).update_one(inc__views=1)
+        self._data['views'] = (self.views or 0) + 1
     
     @property
     def is_featured(self):
@@ -155,6 +366,63 @@ class Post(Document):
         return Comment.objects(post=self, is_approved=True).order_by('-created_at')
 
 
+class ImageAsset(Document):
+    """Where an uploaded image is stored, keyed by the SHA-256 of its content"""
+    sha256 = StringField(primary_key=True)
+    url = StringField(required=True)
+    size = IntField()
+    variants = DictField()  # Same shape as Post.image_variants
+    created_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'image_assets',
+        'indexes': ['url'],
+    }
+    
+    def __str__(self):
+        return self.url
+
+
+class PostViewBucket(Document):
+    """Views of one post in one hour, written by the view counter for trending scores"""
+    post = ObjectIdField(required=True)
+    bucket = DateTimeField(required=True)  # Start of the hour (UTC)
+    views = IntField(default=0)
+    
+    meta = {
+        'collection': 'post_view_buckets',
+        'indexes': [
+            {'fields': ['post', 'bucket'], 'unique': True},
+            # Buckets older than the longest trending window are dropped by MongoDB
+            {'fields': ['bucket'], 'expireAfterSeconds': 30 * 24 * 3600},
+        ],
+    }
+
+
+class RelatedUpdate(Document):
+    """A post whose related posts must be recomputed, see blogapp/related.py"""
+    post = ObjectIdField(primary_key=True)
+    queued_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'related_updates',
+        'indexes': ['queued_at'],
+    }
+
+
+class TrendingPost(Document):
+    """One row of the trending ranking, with the card fields needed to render it"""
+    rank = IntField(primary_key=True)
+    post = ObjectIdField(required=True)
+    score = FloatField()
+    card = DictField()
+    computed_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'trending_posts',
+    }
+
+
 class Comment(Document):
     post = ReferenceField(Post, required=True)
     name = StringField(max_length=255, required=True)
@@ -165,12 +433,29 @@ class Comment(Document):
     
     meta = {
         'collection': 'comments',
-        'indexes': ['post', 'created_at', '-created_at'],
+        'indexes': ['post', 'created_at', '-created_at', ('post', 'is_approved', '-created_at')],
         'ordering': ['-created_at']
     }
     
     def __str__(self):
         return f'{self.name} - {self.post.title[:50]}'
+    
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        post_id = _ref_id(self._data.get('post'))
+        post = Post._get_collection().find_one_and_update(
+            {'_id': post_id}, {'$max': {'last_commented_at': self.created_at}}, projection={'slug': 1}
+        )
+        invalidate(COMMENTS, post_tag(post_id), *([slug_tag(post['slug'])] if post else []))
+        return result
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        # last_commented_at only moves forward, so the slug tag is what retires cached pages
+        post_id = _ref_id(self._data.get('post'))
+        post = Post._get_collection().find_one({'_id': post_id}, {'slug': 1})
+        invalidate(COMMENTS, post_tag(post_id), *([slug_tag(post['slug'])] if post else []))
+        return result
 
 
 class Newsletter(Document):
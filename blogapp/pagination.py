@@ -0,0 +1,120 @@
+"""Keyset (cursor) pagination over ``(created_at, _id)``.
+
+Each page is one indexed range query of ``per_page + 1`` documents, so the
+cost of a page does not depend on how deep into the listing it is. Cursors
+are opaque tokens naming the first or last item of the current page.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+
+def encode_cursor(direction, created_at, pk):
+    raw = f'{direction}|{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return (direction, created_at, id) or None for a missing/invalid token"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, created_at, pk = base64.urlsafe_b64decode(padded).decode().split('|')
+        if direction not in ('next', 'prev'):
+            return None
+        return direction, datetime.fromisoformat(created_at), ObjectId(pk)
+    except (ValueError, binascii.Error, InvalidId, UnicodeDecodeError):
+        return None
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @property
+    def next_cursor(self):
+        if not self.has_next_page:
+            return None
+        last = self.object_list[-1]
+        return encode_cursor('next', last.created_at, last.id)
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous_page:
+            return None
+        first = self.object_list[0]
+        return encode_cursor('prev', first.created_at, first.id)
+
+
+class CursorPaginator:
+    """Paginate a Post queryset newest first, one page per query.
+
+    ``fetch`` turns the page queryset into the listed objects (default:
+    plain documents). Pass ``with_count=True`` to also run a count query
+    for templates that show a total.
+    """
+
+    def __init__(self, queryset, per_page, with_count=False, fetch=list):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.with_count = with_count
+        self.fetch = fetch
+
+    @property
+    def count(self):
+        if not self.with_count:
+            return None
+        if not hasattr(self, '_count'):
+            self._count = self.queryset.count()
+        return self._count
+
+    def get_page(self, token=None):
+        cursor = decode_cursor(token)
+        if cursor is None:
+            items = self._fetch(self.queryset.order_by('-created_at', '-id'))
+            return CursorPage(items[:self.per_page], self, len(items) > self.per_page, False)
+
+        direction, created_at, pk = cursor
+        if direction == 'next':
+            page = self.queryset.filter(__raw__={'$or': [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, '_id': {'$lt': pk}},
+            ]}).order_by('-created_at', '-id')
+            items = self._fetch(page)
+            return CursorPage(items[:self.per_page], self, len(items) > self.per_page, True)
+
+        page = self.queryset.filter(__raw__={'$or': [
+            {'created_at': {'$gt': created_at}},
+            {'created_at': created_at, '_id': {'$gt': pk}},
+        ]}).order_by('created_at', 'id')
+        items = self._fetch(page)
+        has_previous = len(items) > self.per_page
+        return CursorPage(list(reversed(items[:self.per_page])), self, True, has_previous)
+
+    def _fetch(self, queryset):
+        return list(self.fetch(queryset.limit(self.per_page + 1)))
@@ -0,0 +1,155 @@
+"""Opt-in cProfile sampling of live requests.
+
+``ProfilingMiddleware`` profiles a random PROFILE_SAMPLE_RATE share of
+requests (0 by default), plus every request that carries a token signed for
+an admin: the ``X-Profile-Token`` header, or the PROFILE_COOKIE cookie set
+from the admin "Profiles" page. Each profile is written as a ``.pstats``
+file to PROFILE_DIR, named after the time, the URL name and the duration,
+and only the newest PROFILE_MAX_FILES are kept.
+
+Only one request per process is profiled at a time (a cProfile profiler
+cannot run alongside another one); concurrent candidates are served
+unprofiled.
+
+Read a file with ``python -m pstats <file>`` or snakeviz.
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile-Token'
+SALT = 'blogapp.profiling'
+FILENAME = re.compile(r'^[\w.-]+\.pstats$')
+
+_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def profile_dir():
+    return _setting('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'animeverse-profiles'))
+
+
+def cookie_name():
+    return _setting('PROFILE_COOKIE', 'blog_profile')
+
+
+def token_max_age():
+    return _setting('PROFILE_TOKEN_MAX_AGE', 3600)
+
+
+def sample_rate():
+    return _setting('PROFILE_SAMPLE_RATE', 0.0)
+
+
+def make_token(user):
+    """A token that asks for the requests carrying it to be profiled"""
+    return signing.dumps({'user': user.pk}, salt=SALT)
+
+
+def token_valid(value):
+    if not value:
+        return False
+    try:
+        signing.loads(value, salt=SALT, max_age=token_max_age())
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def list_profiles():
+    """Stored profiles, newest first: [{'name', 'size', 'created'}]"""
+    directory = profile_dir()
+    profiles = []
+    for entry in os.scandir(directory) if os.path.isdir(directory) else ():
+        if FILENAME.match(entry.name):
+            stat = entry.stat()
+            profiles.append({
+                'name': entry.name,
+                'size': stat.st_size,
+                'created': datetime.fromtimestamp(stat.st_mtime),
+            })
+    profiles.sort(key=lambda profile: profile['created'], reverse=True)
+    return profiles
+
+
+def profile_path(name):
+    """Absolute path of a stored profile, or None for names that are not one"""
+    if not FILENAME.match(name or ''):
+        return None
+    path = os.path.join(profile_dir(), name)
+    return path if os.path.isfile(path) else None
+
+
+def _rotate(directory, keep):
+    for profile in list_profiles()[keep:]:
+        try:
+            os.remove(os.path.join(directory, profile['name']))
+        except OSError:
+            pass
+
+
+def _token(name):
+    return re.sub(r'[^\w-]+', '-', name or 'unmatched').strip('-')[:60] or 'unmatched'
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _wanted(self, request):
+        rate = sample_rate()
+        if rate and random.random() < rate:
+            return True
+        return token_valid(request.headers.get(HEADER) or request.COOKIES.get(cookie_name()))
+
+    def __call__(self, request):
+        if not self._wanted(request) or not _lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # another profiler is already active in this process
+                return self.get_response(request)
+            started = time.perf_counter()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration_ms = (time.perf_counter() - started) * 1000
+            self._save(request, profiler, duration_ms)
+            response['X-Profiled'] = '1'
+            return response
+        finally:
+            _lock.release()
+
+    def _save(self, request, profiler, duration_ms):
+        match = getattr(request, 'resolver_match', None)
+        name = '{}-{}-{}-{}ms-{}.pstats'.format(
+            datetime.now().strftime('%Y%m%dT%H%M%S'),
+            request.method.lower(),
+            _token(match.view_name if match else None),
+            int(duration_ms),
+            os.getpid(),
+        )
+        directory = profile_dir()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(directory, name))
+            _rotate(directory, _setting('PROFILE_MAX_FILES', 200))
+        except OSError:
+            logger.exception('could not write profile %s', name)
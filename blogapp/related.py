@@ -0,0 +1,216 @@
+"""Precomputed related posts.
+
+Every published post is scored against every other one on four signals:
+text similarity of title and excerpt, shared tags, same category and same
+studio. The top RELATED_POSTS_STORED ids and scores are stored on the post
+(``related_ids`` / ``related_scores``), so the detail page loads its related
+cards with one ``$in`` query.
+
+Text vectors are TF-IDF weights folded into RELATED_DIMENSIONS buckets with
+signed feature hashing and L2-normalised, which keeps the whole corpus in
+one dense float32 matrix and turns a block of similarities into a single
+matrix product. All four signals are symmetric, so a saved post can be
+scored once against the corpus and inserted into its neighbours' lists.
+
+Saving or deleting a post only queues its id (``related_updates``), along
+with the posts whose lists hold it: a post that drifts away from them is no
+longer among its own candidates, so only rescoring them drops its stale
+entry. ``manage.py rebuild_related_posts --pending``, run every few minutes,
+rescores the queued posts against one freshly loaded index.
+"""
+import math
+import re
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from pymongo import DeleteOne, UpdateOne
+
+FIELDS = {'title': 1, 'excerpt': 1, 'category': 1, 'tags': 1, 'studio': 1}
+TOKEN = re.compile(r'\w+')
+DEFAULT_WEIGHTS = {'text': 1.0, 'tags': 1.0, 'category': 0.3, 'studio': 0.5}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _terms(row):
+    # The title counts twice: it names the series, the excerpt mostly describes it
+    text = f"{row.get('title') or ''} {row.get('title') or ''} {row.get('excerpt') or ''}"
+    return Counter(token for token in TOKEN.findall(text.lower()) if len(token) > 1)
+
+
+def _bucket(term, dimensions):
+    code = zlib.crc32(term.encode('utf-8'))
+    return code % dimensions, 1.0 if code & 0x80000000 else -1.0
+
+
+class RelatedIndex:
+    """Vectors and taxonomy postings of the published corpus, in row order"""
+
+    def __init__(self, rows, dimensions=None):
+        self.dimensions = dimensions or _setting('RELATED_DIMENSIONS', 256)
+        self.ids = [row['_id'] for row in rows]
+        self.rows = {pk: index for index, pk in enumerate(self.ids)}
+        terms = [_terms(row) for row in rows]
+        document_frequency = Counter(term for counts in terms for term in counts)
+        self.documents = len(rows)
+        self.idf = {term: math.log((1 + self.documents) / (1 + df)) + 1 for term, df in document_frequency.items()}
+        self.vectors = np.zeros((len(rows), self.dimensions), dtype=np.float32)
+        self.keys = [()] * len(rows)  # ('category'|'studio'|'tag', value) per row
+        self.tag_counts = np.zeros(len(rows), dtype=np.float32)
+        self.postings = defaultdict(list)
+        for index, row in enumerate(rows):
+            self._fill(index, row, terms[index])
+        self.postings = {key: np.array(rows_, dtype=np.int64) for key, rows_ in self.postings.items()}
+
+    @classmethod
+    def load(cls):
+        from .models import Post
+
+        return cls(list(Post._get_collection().find({'status': 'published'}, FIELDS)))
+
+    def _vector(self, terms):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        top_idf = math.log(1 + self.documents) + 1
+        for term, count in terms.items():
+            bucket, sign = _bucket(term, self.dimensions)
+            vector[bucket] += sign * count * self.idf.get(term, top_idf)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _fill(self, index, row, terms):
+        self.vectors[index] = self._vector(terms)
+        studio = (row.get('studio') or '').strip().casefold()
+        tags = set(row.get('tags') or [])
+        keys = [('tag', tag) for tag in tags]
+        keys += [(kind, value) for kind, value in (('category', row.get('category')), ('studio', studio)) if value]
+        self.keys[index] = tuple(keys)
+        self.tag_counts[index] = len(tags)
+        for key in keys:
+            self.postings[key].append(index)
+
+    def scores(self, block):
+        """Scores of the block rows (a slice or index array) against every row"""
+        weights = {**DEFAULT_WEIGHTS, **_setting('RELATED_WEIGHTS', {})}
+        indexes = np.arange(len(self.ids))[block]
+        scores = self.vectors[indexes] @ self.vectors.T
+        np.clip(scores, 0, None, out=scores)
+        scores *= weights['text']
+
+        # Taxonomy signals only touch the rows sharing a key, found through the postings
+        for position, index in enumerate(indexes):
+            row = scores[position]
+            shared_tags = []
+            for kind, value in self.keys[index]:
+                members = self.postings[kind, value]
+                if kind == 'tag':
+                    shared_tags.append(members)
+                else:
+                    row[members] += weights[kind]
+            if shared_tags:
+                members, shared = np.unique(np.concatenate(shared_tags), return_counts=True)
+                # Cosine of the two tag sets
+                row[members] += weights['tags'] * shared / np.sqrt(self.tag_counts[index] * self.tag_counts[members])
+            row[index] = 0  # never related to itself
+        return indexes, scores
+
+    def top(self, scores, k, min_score=None):
+        """(ids, scores) of the k best scores above min_score in one row, best first"""
+        min_score = _setting('RELATED_MIN_SCORE', 0.2) if min_score is None else min_score
+        k = min(k, len(scores))
+        if not k:
+            return [], []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        best = best[scores[best] > min_score]
+        return [self.ids[i] for i in best], [round(float(scores[i]), 4) for i in best]
+
+
+def _write_top(index, collection, rows, k, block_size, merge=()):
+    """Store the top k of each row; rows in merge are also inserted into their neighbours' lists"""
+    updated = 0
+    # Rescored posts get a whole new list, which a merge built from their stored one would overwrite
+    rescored = {index.ids[row] for row in rows}
+    for start in range(0, len(rows), block_size):
+        indexes, scores = index.scores(rows[start:start + block_size])
+        operations = []
+        for position, row in enumerate(indexes):
+            post_id = index.ids[row]
+            ids, values = index.top(scores[position], k)
+            operations.append(UpdateOne({'_id': post_id}, {'$set': {'related_ids': ids, 'related_scores': values}}))
+            if post_id in merge:
+                operations += _neighbour_updates(collection, post_id, *index.top(scores[position], k * 4), k, rescored)
+        collection.bulk_write(operations, ordered=False)
+        updated += len(indexes)
+    return updated
+
+
+def _neighbour_updates(collection, post_id, candidates, candidate_scores, k, skip=()):
+    score_of = dict(zip(candidates, candidate_scores))
+    candidates = [pk for pk in candidates if pk not in skip]
+    operations = []
+    for neighbour in collection.find({'_id': {'$in': candidates}}, {'related_ids': 1, 'related_scores': 1}):
+        stored = list(zip(neighbour.get('related_ids') or [], neighbour.get('related_scores') or []))
+        pairs = [(pk, score) for pk, score in stored if pk != post_id] + [(post_id, score_of[neighbour['_id']])]
+        pairs = sorted(pairs, key=lambda pair: -pair[1])[:k]
+        if pairs != stored:
+            operations.append(UpdateOne({'_id': neighbour['_id']}, {'$set': {
+                'related_ids': [pk for pk, _ in pairs], 'related_scores': [score for _, score in pairs],
+            }}))
+    return operations
+
+
+def rebuild_related(block_size=256):
+    """Recompute related posts for every published post; returns the number updated"""
+    from .models import Post, RelatedUpdate
+
+    started = datetime.utcnow()
+    index = RelatedIndex.load()
+    updated = _write_top(index, Post._get_collection(), np.arange(len(index.ids)),
+                         _setting('RELATED_POSTS_STORED', 8), block_size)
+    # Everything queued before the load is covered by this rebuild
+    RelatedUpdate._get_collection().delete_many({'queued_at': {'$lte': started}})
+    return updated
+
+
+def enqueue_related(post_id):
+    """Mark a saved or deleted post, and the posts listing it, for the next process_related_queue run"""
+    from .models import Post, RelatedUpdate
+
+    queued_at = datetime.utcnow()
+    listing = [row['_id'] for row in Post._get_collection().find({'related_ids': post_id}, {'_id': 1})]
+    RelatedUpdate._get_collection().bulk_write([
+        UpdateOne({'_id': pk}, {'$set': {'queued_at': queued_at}}, upsert=True) for pk in [post_id, *listing]
+    ], ordered=False)
+
+
+def process_related_queue(block_size=256):
+    """Rescore the queued posts against a fresh index; returns the number of posts updated
+
+    Published posts get their own list and are merged into their neighbours'
+    lists. Posts deleted or unpublished since they were queued are dropped
+    from every list that still holds them, by rescoring those posts.
+    """
+    from .models import Post, RelatedUpdate
+
+    queue = RelatedUpdate._get_collection()
+    queued = {row['_id']: row['queued_at'] for row in queue.find({}, sort=[('queued_at', 1)])}
+    if not queued:
+        return 0
+    collection = Post._get_collection()
+    index = RelatedIndex.load()
+    changed = [pk for pk in queued if pk in index.rows]
+    removed = [pk for pk in queued if pk not in index.rows]
+    orphaned = [
+        row['_id'] for row in collection.find({'related_ids': {'$in': removed}, 'status': 'published'}, {'_id': 1})
+    ] if removed else []
+    rows = np.array(sorted({index.rows[pk] for pk in changed + orphaned if pk in index.rows}), dtype=np.int64)
+    updated = _write_top(index, collection, rows, _setting('RELATED_POSTS_STORED', 8), block_size,
+                         merge=set(changed)) if len(rows) else 0
+    # Posts saved again while this ran keep their newer queue entry
+    queue.bulk_write([DeleteOne({'_id': pk, 'queued_at': queued_at}) for pk, queued_at in queued.items()])
+    return updated
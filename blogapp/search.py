@@ -0,0 +1,73 @@
+"""Post search backed by the weighted text index on Post.
+
+Queries run as a phrase search against the text index and are sorted by
+relevance. Partial words and unsegmented Japanese titles are not tokens in
+the text index, so when it finds nothing the search falls back to a single
+case-insensitive ``$or`` query, matching the old substring behaviour.
+Both paths hand the paginator their count with the lazy queryset, so it
+loads only one page: the text path reuses the count it chose by, and
+Django's Paginator would otherwise len() the queryset, loading every match
+(QuerySet.count takes an argument, so the paginator does not call it).
+"""
+import logging
+
+from django.conf import settings
+from mongoengine.queryset.visitor import Q
+from pymongo.errors import OperationFailure
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELDS = ('title', 'studio', 'anime_title_jp', 'content')
+
+
+class SearchResults:
+    """A result queryset whose total is already known, for the paginator"""
+
+    def __init__(self, queryset, total):
+        self.queryset = queryset
+        self.total = total
+
+    def count(self):
+        return self.total
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # skip/limit stay lazy; slicing a QuerySet opens a cursor the card fetch would not use
+            start = index.start or 0
+            return self.queryset.skip(start).limit(index.stop - start)
+        return self.queryset[index]
+
+
+def text_search(posts, query):
+    """Relevance-ordered phrase search over the text index"""
+    phrase = '"%s"' % query.replace('"', ' ').strip()
+    return posts.search_text(phrase).order_by('$text_score', '-created_at')
+
+
+def search_posts(query):
+    """Get published posts matching query, best matches first"""
+    published = Post.objects(status='published')
+    if getattr(settings, 'SEARCH_BACKEND', 'text') == 'text':
+        results = text_search(published, query)
+        try:
+            total = results.count()
+        except OperationFailure:
+            logger.warning('Text search failed, falling back to substring search', exc_info=True)
+        else:
+            if total:
+                return SearchResults(results, total)
+    results = substring_search(published, query)
+    return SearchResults(results, results.count())
+
+
+def substring_search(posts, query):
+    """Case-insensitive substring match over the searchable fields in one query"""
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__icontains': query})
+    return posts.filter(condition).order_by('-created_at')
@@ -1,3 +1,1175 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import subprocess
+import tempfile
+import unittest
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+import mongoengine
+import mongomock
+from bson import ObjectId
+from PIL import Image
+from pymongo import monitoring
+from pymongo.errors import OperationFailure
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from . import identity, instrumentation, metrics, profiling
+from .benchmark import _count_mongomock_commands
+from .bulk import Importer, RecordError, dumps, export_records
+from .corpus import Corpus, generate
+from .caching import TieredCache, cache_page_by_tags, invalidate, make_key, post_tag, POSTS, TAXONOMY
+from .models import (
+    Category, Comment, ImageAsset, Post, PostViewBucket, RelatedUpdate, Tag, TrendingPost, allocate_slugs,
+    rebuild_published_counts,
+)
+from .images import build_variants, render_variants
+from .listings import CARD_FIELDS, PostCard, fetch_cards, prefetch_taxonomy
+from .pagination import CursorPaginator
+from .related import process_related_queue, rebuild_related
+from .search import search_posts, substring_search, text_search
+from .trending import compute_trending, hour_bucket, trending_cards
+from .uploads import UploadQueue, image_placeholder
+from .viewcounter import ViewCounter
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'blogapp-tests'}}
+
+
+def quiet_request_log(test):
+    """Keep the per-request log lines out of the test output"""
+    request_log = logging.getLogger('blogapp.instrumentation')
+    test.addCleanup(request_log.setLevel, request_log.level)
+    request_log.setLevel(logging.WARNING)
+
+
+@override_settings(CACHES=TEST_CACHES, RELATED_UPDATE_ON_SAVE=False)
+class MongoTestCase(SimpleTestCase):
+    """Runs every test against a fresh in-memory mongomock database"""
+
+    def setUp(self):
+        super().setUp()
+        mongoengine.disconnect()
+        mongoengine.connect('blog_test', host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+        self.addCleanup(mongoengine.disconnect)
+        cache.clear()
+        quiet_request_log(self)
+
+    def make_post(self, title, **fields):
+        fields.setdefault('content', f'<p>{title}</p>')
+        return Post(title=title, author_id=1, author_username='tester', **fields).save()
+
+
+class SlugAllocationTests(MongoTestCase):
+    def test_free_base_is_not_numbered_by_similar_titles(self):
+        self.assertEqual(self.make_post('Naruto 2').slug, 'naruto-2')
+        self.assertEqual(self.make_post('Naruto').slug, 'naruto')
+        self.assertEqual(self.make_post('Mob Psycho 100').slug, 'mob-psycho-100')
+        self.assertEqual(self.make_post('Mob Psycho').slug, 'mob-psycho')
+
+    def test_taken_base_gets_next_suffix(self):
+        self.make_post('Naruto 2')
+        self.make_post('Naruto')
+        self.assertEqual(self.make_post('Naruto').slug, 'naruto-3')
+
+    def test_duplicates_in_one_call_get_distinct_slugs(self):
+        self.make_post('Bleach')
+        self.assertEqual(allocate_slugs(['bleach', 'bleach', 'one-piece']), ['bleach-1', 'bleach-2', 'one-piece'])
+
+
+@override_settings(RELATED_UPDATE_ON_SAVE=True, RELATED_MIN_SCORE=0.0)
+class RelatedQueueTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category(name='Mecha').save()
+        self.posts = [
+            self.make_post(f'Gundam Wing part {number}', excerpt='giant robot war', category=self.category)
+            for number in range(4)
+        ]
+        rebuild_related()
+
+    def test_save_only_queues_the_post(self):
+        self.assertEqual(RelatedUpdate.objects.count(), 0)
+        post = self.make_post('Gundam Seed', excerpt='giant robot war', category=self.category)
+        self.assertEqual([row.pk for row in RelatedUpdate.objects], [post.pk])
+        self.assertEqual(Post.objects.get(pk=post.pk).related_ids, [])
+
+        process_related_queue()
+        self.assertEqual(RelatedUpdate.objects.count(), 0)
+        self.assertEqual(len(Post.objects.get(pk=post.pk).related_ids), 4)
+        self.assertIn(post.pk, Post.objects.get(pk=self.posts[0].pk).related_ids)
+
+    def test_deleted_post_leaves_its_neighbours_lists(self):
+        removed = self.posts[1]
+        self.assertIn(removed.pk, Post.objects.get(pk=self.posts[0].pk).related_ids)
+        removed.delete()
+        process_related_queue()
+        for post in self.posts[:1] + self.posts[2:]:
+            related = Post.objects.get(pk=post.pk).related_ids
+            self.assertNotIn(removed.pk, related)
+            self.assertEqual(len(related), 2)
+
+    def test_edited_post_leaves_lists_it_no_longer_belongs_to(self):
+        drifted = self.posts[1]
+        drifted.title, drifted.excerpt, drifted.category = 'Shokugeki', 'cooking duels', None
+        drifted.save()
+        # Its neighbours are queued too: it is no longer among their candidates to be merged into
+        self.assertEqual({row.pk for row in RelatedUpdate.objects}, {post.pk for post in self.posts})
+        process_related_queue()
+        self.assertEqual(Post.objects.get(pk=drifted.pk).related_ids, [])
+        for post in self.posts[:1] + self.posts[2:]:
+            self.assertNotIn(drifted.pk, Post.objects.get(pk=post.pk).related_ids)
+
+
+class DetailRevalidationTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        from .viewcounter import view_counter
+
+        self.view_counter = view_counter
+        self.view_counter.flush()
+        self.post = self.make_post('Frieren', status='published')
+
+    def test_not_modified_response_still_counts_the_view(self):
+        first = self.client.get(f'/{self.post.slug}/')
+        self.assertEqual(first.status_code, 200)
+        again = self.client.get(f'/{self.post.slug}/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.view_counter.flush()
+        self.assertEqual(Post.objects.get(pk=self.post.pk).views, 2)
+
+    def test_etag_changes_when_related_posts_are_rebuilt(self):
+        from .caching import invalidate, POSTS
+
+        etag = self.client.get(f'/{self.post.slug}/')['ETag']
+        invalidate(POSTS)  # as rebuild_related_posts does
+        self.assertNotEqual(self.client.get(f'/{self.post.slug}/')['ETag'], etag)
+
+
+class ConditionalListingTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category(name='Slice of Life').save()
+        self.make_post('Barakamon', category=self.category, status='published')
+
+    def test_matching_etag_gets_a_304_without_running_the_view(self):
+        first = self.client.get('/archive/')
+        self.assertEqual(first.status_code, 200)
+        # Skip the page cache, which would answer without any query at all
+        uncached = mock.patch('blogapp.caching._cached_response',
+                              lambda request, view, args, kwargs, *rest, **options: view(request, *args, **kwargs))
+        with uncached, _count_mongomock_commands(), mock.patch('blogapp.views.fetch_cards') as fetch:
+            again = self.client.get('/archive/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual((again.status_code, again.content), (304, b''))
+        self.assertEqual(again['ETag'], first['ETag'])
+        fetch.assert_not_called()
+        self.assertEqual(dict(again.wsgi_request.mongo_stats.names), {'find': 1})  # the newest updated_at
+
+    def test_new_post_changes_the_validators(self):
+        first = self.client.get(f'/category/{self.category.slug}/')
+        self.make_post('Non Non Biyori', category=self.category, status='published')
+        again = self.client.get(f'/category/{self.category.slug}/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertNotEqual(again['ETag'], first['ETag'])
+        self.assertContains(again, 'Non Non Biyori')
+
+    def test_if_modified_since_gets_a_304(self):
+        first = self.client.get(f'/category/{self.category.slug}/')
+        again = self.client.get(f'/category/{self.category.slug}/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(self.client.get('/category/missing/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 404)
+
+    def test_static_files_revalidate_by_etag(self):
+        first = self.client.get('/static/style.css')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('max-age', first['Cache-Control'])
+        self.assertEqual(self.client.get('/static/style.css', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+
+@override_settings(DETAIL_EDGE_CACHE=True)
+class CommentInvalidationTests(MongoTestCase):
+    def test_deleted_comment_leaves_the_cached_page(self):
+        post = self.make_post('Mushishi')
+        comment = Comment(post=post, name='ginko', email='ginko@example.com', content='Quietly perfect.').save()
+        first = self.client.get(f'/{post.slug}/')
+        self.assertContains(first, 'Quietly perfect.')
+        self.assertEqual(self.client.get(f'/{post.slug}/')['X-Page-Cache'], 'hit')
+
+        comment.delete()
+        again = self.client.get(f'/{post.slug}/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, 200)
+        self.assertNotContains(again, 'Quietly perfect.')
+
+
+class BulkImportTests(MongoTestCase):
+    def run_import(self, *records):
+        importer = Importer(chunk_size=10)
+        for line, record in enumerate(records, 1):
+            if record['kind'] == 'post':
+                record = {'author_id': 1, 'author_username': 'tester', 'content': 'x', **record}
+            importer.add(line, dict(record))
+        importer.finish()
+        return importer
+
+    def test_slug_taken_by_another_post_is_reported(self):
+        self.make_post('Naruto')
+        with self.assertRaises(RecordError) as raised:
+            self.run_import({'kind': 'post', 'title': 'Naruto remake', 'slug': 'naruto'})
+        self.assertEqual(raised.exception.line, 1)
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_slug_taken_after_allocation_is_allocated_again(self):
+        self.make_post('Naruto')
+        stale = mock.Mock(side_effect=[['naruto'], ['naruto-1']])  # as if another writer raced us
+        with mock.patch('blogapp.bulk.allocate_slugs', stale):
+            importer = self.run_import({'kind': 'post', 'title': 'Naruto', 'status': 'published'})
+        self.assertEqual(importer.created['post'], 1)
+        self.assertEqual(importer.skipped['post'], 0)
+        self.assertEqual(sorted(Post.objects.scalar('slug')), ['naruto', 'naruto-1'])
+
+    def test_resume_after_a_failed_chunk_does_not_duplicate_posts(self):
+        self.make_post('Taken')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'posts.jsonl')
+        post = {'kind': 'post', 'author_id': 1, 'author_username': 'tester', 'content': 'x'}
+
+        def write(last_slug):
+            with open(path, 'w') as handle:
+                handle.write(dumps({'kind': 'category', 'name': 'Shonen'}))
+                handle.write(dumps({**post, 'title': 'Bleach'}))
+                handle.write(dumps({**post, 'title': 'Bleach TYBW', 'slug': last_slug}))
+
+        write('taken')
+        with self.assertRaises(CommandError):
+            call_command('import_jsonl', path, stdout=io.StringIO())
+        write('bleach-tybw')
+        call_command('import_jsonl', path, '--resume', stdout=io.StringIO())
+        self.assertEqual(sorted(Post.objects.scalar('slug')), ['bleach', 'bleach-tybw', 'taken'])
+
+    def test_taxonomy_stored_under_another_id_is_reused_by_name(self):
+        category = Category(name='Shonen').save()
+        self.run_import(
+            {'kind': 'category', 'id': str(ObjectId()), 'name': 'Shonen'},
+            {'kind': 'post', 'title': 'Bleach', 'category': 'Shonen', 'status': 'published'},
+        )
+        self.assertEqual(Post.objects.get(slug='bleach').category.pk, category.pk)
+        self.assertEqual(Category.objects.get(pk=category.pk).published_count, 1)
+
+
+class TrendingTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = datetime.utcnow()  # mongomock applies the buckets' TTL index against the clock
+        self.posts = [self.make_post(title, status='published') for title in ('Dandadan', 'Kaiju No. 8')]
+        for views, post in zip((10, 5), self.posts):
+            PostViewBucket(post=post.pk, bucket=hour_bucket(self.now), views=views).save()
+        compute_trending(self.now)
+
+    def titles(self):
+        return [card.title for card in trending_cards(10)]
+
+    def test_unpublished_and_deleted_posts_leave_the_ranking(self):
+        self.assertEqual(self.titles(), ['Dandadan', 'Kaiju No. 8'])
+        self.posts[0].status = 'draft'
+        self.posts[0].save()
+        self.assertEqual(self.titles(), ['Kaiju No. 8'])
+        self.posts[1].delete()
+        self.assertEqual(TrendingPost.objects.count(), 0)
+
+    def test_post_removed_between_scoring_and_cards_is_skipped(self):
+        posts = Post._get_collection()
+        find = posts.find
+
+        def delete_after_scoring(*args, **kwargs):
+            rows = list(find(*args, **kwargs))
+            patched.stop()
+            posts.delete_one({'_id': self.posts[0].pk})  # deleted by another process meanwhile
+            return rows
+
+        patched = mock.patch.object(posts, 'find', side_effect=delete_after_scoring)
+        patched.start()
+        self.addCleanup(patched.stop)
+        self.assertEqual(compute_trending(self.now), 1)
+        self.assertEqual(self.titles(), ['Kaiju No. 8'])
+
+
+class DedupeImagesTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, MEDIA_URL='/media/')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.paths = []
+        for name in ('first.png', 'second.png'):
+            self.paths.append(os.path.join(media.name, name))
+            with open(self.paths[-1], 'wb') as handle:
+                handle.write(b'same image')
+            self.make_post(name, featured_image=f'/media/{name}')
+
+    def dedupe(self, *args):
+        call_command('dedupe_images', *args, stdout=io.StringIO())
+        return sorted(Post.objects.scalar('featured_image'))
+
+    def test_default_run_only_reports(self):
+        self.assertEqual(self.dedupe(), ['/media/first.png', '/media/second.png'])
+        self.assertTrue(all(os.path.exists(path) for path in self.paths))
+
+    def test_apply_keeps_the_files(self):
+        with self.assertRaises(CommandError):
+            self.dedupe('--delete')
+        self.assertEqual(self.dedupe('--apply'), ['/media/first.png', '/media/first.png'])
+        self.assertTrue(all(os.path.exists(path) for path in self.paths))
+
+    def test_delete_removes_the_duplicate_file(self):
+        self.assertEqual(self.dedupe('--apply', '--delete'), ['/media/first.png', '/media/first.png'])
+        self.assertEqual([os.path.exists(path) for path in self.paths], [True, False])
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(METRICS_DIR=self.directory, METRICS_TOKEN='', METRICS_ALLOWED_IPS=[])
+        settings.enable()
+        self.addCleanup(settings.disable)
+        quiet_request_log(self)
+
+    def write_snapshot(self, pid, requests, pending=0):
+        snapshot = {
+            'counters': [['blog_requests_total', {}, requests]],
+            'histograms': [['blog_request_duration_seconds', {}, {
+                'buckets': [0.1, 1.0], 'counts': [requests, 0], 'sum': requests * 0.05, 'count': requests,
+            }]],
+            'samples': [['gauge', 'blog_view_counter_pending', {}, pending]],
+        }
+        with open(os.path.join(self.directory, f'{pid}.json'), 'w') as stream:
+            json.dump(snapshot, stream)
+
+    def requests(self):
+        counters, histograms, gauges = metrics.collect()
+        return (counters[('blog_requests_total', ())], histograms[('blog_request_duration_seconds', ())]['count'],
+                gauges.get(('blog_view_counter_pending', ())))
+
+    def test_exited_workers_keep_their_totals_but_not_their_gauges(self):
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        self.write_snapshot(os.getpid(), 3, pending=1)
+        self.write_snapshot(exited.pid, 5, pending=7)
+        self.assertEqual(self.requests(), (8, 8, 1))
+        self.assertEqual(sorted(os.listdir(self.directory)), ['.lock', f'{os.getpid()}.json', 'archive.json'])
+        self.assertEqual(self.requests(), (8, 8, 1))  # archived once, not on every scrape
+
+    def test_closed_registry_archives_its_totals(self):
+        registry = metrics.Registry()
+        registry._pid = os.getpid()
+        registry.inc('blog_requests_total', 2)
+        registry.close()
+        registry.flush()  # a late flusher tick must not count them twice
+        self.assertNotIn(f'{os.getpid()}.json', os.listdir(self.directory))
+        self.assertEqual(metrics.collect()[0][('blog_requests_total', ())], 2)
+
+    def test_endpoint_is_closed_unless_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class CommandTimerTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.registry._pid = os.getpid()  # no flusher thread
+        patcher = mock.patch.object(metrics, 'registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.timer = instrumentation.CommandTimer()
+        self.request_ids = count(1)
+
+    def run_command(self, command, milliseconds, failure=None):
+        """Send the listener the events pymongo publishes around one command"""
+        name, request_id = next(iter(command)), next(self.request_ids)
+        self.timer.started(monitoring.CommandStartedEvent(command, 'blog_test', request_id, ('localhost', 27017), request_id))
+        duration = timedelta(milliseconds=milliseconds)
+        if failure is None:
+            self.timer.succeeded(monitoring.CommandSucceededEvent(
+                duration, {'ok': 1}, name, request_id, ('localhost', 27017), request_id))
+        else:
+            self.timer.failed(monitoring.CommandFailedEvent(
+                duration, failure, name, request_id, ('localhost', 27017), request_id))
+
+    @override_settings(MONGO_SLOW_COMMAND_MS=2)
+    def test_commands_are_counted_timed_and_added_to_the_request(self):
+        stats = instrumentation.CommandStats()
+        token = instrumentation._current.set(stats)
+        self.addCleanup(instrumentation._current.reset, token)
+        with self.assertLogs('blogapp.instrumentation', 'WARNING') as logs:
+            self.run_command({'find': 'posts', 'filter': {'slug': 'frieren'}}, 3)
+            self.run_command({'find': 'posts', 'filter': {'slug': 'frieren'}}, 1, failure={'ok': 0, 'errmsg': 'timeout'})
+
+        counters = {(name, labels['outcome']): value for name, labels, value in self.registry.snapshot()['counters']}
+        self.assertEqual(counters, {('blog_mongo_commands_total', 'ok'): 1, ('blog_mongo_commands_total', 'failed'): 1})
+        [[name, labels, histogram]] = self.registry.snapshot()['histograms']
+        self.assertEqual((name, labels), ('blog_mongo_command_duration_seconds', {'command': 'find'}))
+        self.assertEqual(histogram['count'], 2)
+        self.assertAlmostEqual(histogram['sum'], 0.004)
+        self.assertEqual(histogram['counts'][:3], [0, 1, 0])  # 1ms lands in <=1ms, 3ms in <=5ms
+
+        self.assertEqual((stats.commands, stats.failures, dict(stats.collections)), (2, 1, {'posts': 2}))
+        self.assertAlmostEqual(stats.duration_ms, 4.0)
+        # Only the 3ms command crossed the threshold, logged without its literal values
+        [line] = logs.output
+        self.assertIn('"filter": {"slug": "?"}', line)
+        self.assertNotIn('frieren', line)
+
+    def test_commands_outside_a_request_are_still_counted(self):
+        self.run_command({'aggregate': 'posts', 'pipeline': []}, 2)
+        self.assertEqual(self.registry.snapshot()['counters'],
+                         [['blog_mongo_commands_total', {'command': 'aggregate', 'outcome': 'ok'}, 1]])
+        self.assertEqual(self.timer._started, {})
+
+
+class AuditIndexesTests(SimpleTestCase):
+    def test_ensure_covers_every_collection(self):
+        from .management.commands.audit_indexes import _documents
+
+        collections = {document_cls._get_collection_name() for document_cls in _documents()}
+        self.assertLessEqual(
+            {'posts', 'post_view_buckets', 'trending_posts', 'image_assets', 'related_updates'}, collections,
+        )
+
+
+class PublishedCountTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.anime, self.manga = Category(name='Anime').save(), Category(name='Manga').save()
+        self.action = Tag(name='Action').save()
+
+    def counts(self):
+        return [document.reload().published_count for document in (self.anime, self.manga, self.action)]
+
+    def test_counts_follow_status_category_and_delete(self):
+        post = self.make_post('Vinland Saga', category=self.anime, tags=[self.action], status='draft')
+        self.assertEqual(self.counts(), [0, 0, 0])
+        post.status = 'published'
+        post.save()
+        self.assertEqual(self.counts(), [1, 0, 1])
+        post.category = self.manga
+        post.save()
+        self.assertEqual(self.counts(), [0, 1, 1])
+        post.status = 'draft'
+        post.save()
+        self.assertEqual(self.counts(), [0, 0, 0])
+        post.status = 'published'
+        post.save()
+        post.delete()
+        self.assertEqual(self.counts(), [0, 0, 0])
+
+
+class TaxonomyCountsTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.categories = [Category(name=name).save() for name in ('Anime', 'Manga', 'Novels')]
+        self.tags = [Tag(name=name).save() for name in ('Action', 'Drama')]
+
+    def publish(self, count, category, tags=(), status='published'):
+        for number in range(count):
+            self.make_post(f'{category.name} {status} {number}', category=category, tags=list(tags), status=status)
+
+    def test_most_used_first_without_drafts_or_empty_entries(self):
+        self.publish(1, self.categories[0], self.tags)
+        self.publish(2, self.categories[1], self.tags[:1])
+        self.publish(3, self.categories[0], status='draft')
+        self.assertEqual([(category.name, category.post_count) for category in Category.with_post_counts()],
+                         [('Manga', 2), ('Anime', 1)])
+        self.assertEqual([tag.name for tag in Tag.with_post_counts(limit=1)], ['Action'])
+        self.assertEqual(self.tags[1].reload().get_post_count(), 1)
+
+    def test_rebuild_matches_the_stored_counters(self):
+        self.publish(2, self.categories[0], self.tags)
+        expected = {doc.name: doc.published_count for doc in list(Category.objects) + list(Tag.objects)}
+        Category.objects.update(set__published_count=9)
+        Tag.objects.update(set__published_count=9)
+        rebuild_published_counts()
+        self.assertEqual({doc.name: doc.published_count for doc in list(Category.objects) + list(Tag.objects)},
+                         expected)
+        self.assertEqual(expected, {'Anime': 2, 'Manga': 0, 'Novels': 0, 'Action': 2, 'Drama': 2})
+
+    def archive_commands(self):
+        cache.clear()
+        with _count_mongomock_commands():
+            response = self.client.get('/archive/')
+        self.assertEqual(response.status_code, 200)
+        return response.wsgi_request.mongo_stats.collections
+
+    def test_archive_reads_each_taxonomy_collection_once(self):
+        self.publish(1, self.categories[0], self.tags)
+        before = self.archive_commands()
+        for number in range(5):
+            self.publish(1, Category(name=f'Extra {number}').save(), [Tag(name=f'Extra {number}').save()])
+        after = self.archive_commands()
+        self.assertEqual((before['categories'], before['tags']), (1, 1))
+        self.assertEqual(after, before)
+
+
+class PostCardTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category(name='Seinen').save()
+        self.post = self.make_post('Monster', content='<p>' + 'x' * 5000 + '</p>', excerpt='A surgeon hunts',
+                                   anime_type='tv', rating=9.1, category=self.category, status='published')
+
+    def test_cards_carry_only_the_projected_fields(self):
+        [card] = fetch_cards(Post.objects(status='published'))
+        self.assertIsInstance(card, PostCard)
+        self.assertEqual((card.pk, card.title, card.excerpt, card.category_id), (self.post.pk, 'Monster', 'A surgeon hunts', self.category.pk))
+        self.assertEqual((card.get_absolute_url(), card.get_anime_type_display(), card.is_featured),
+                         ('/monster/', 'TV Series', True))
+        for field in ('content', 'meta_description', 'related_ids'):
+            self.assertFalse(hasattr(card, field), field)
+        with self.assertRaises(AttributeError):
+            card.content = 'slots keep cards small'
+
+    def test_listing_query_never_loads_the_content(self):
+        with mock.patch('mongomock.collection.Collection.find', autospec=True,
+                        side_effect=mongomock.collection.Collection.find) as find:
+            fetch_cards(Post.objects(status='published'))
+        projection = find.call_args.args[2] if len(find.call_args.args) > 2 else find.call_args.kwargs['projection']
+        self.assertNotIn('content', projection)
+        self.assertEqual(set(projection) - {'_id'}, set(CARD_FIELDS))
+
+    def test_index_renders_cards(self):
+        response = self.client.get('/')
+        self.assertContains(response, 'Monster')
+        self.assertEqual([type(post) for post in response.context['recent_posts']], [PostCard])
+        self.assertNotContains(response, 'x' * 100)
+
+
+class PrefetchTaxonomyTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        for number in range(12):
+            self.make_post(f'Post {number}', category=Category(name=f'Category {number}').save(),
+                           tags=[Tag(name=f'Tag {number}').save(), Tag(name=f'Other {number}').save()])
+
+    def commands(self, function):
+        stats = instrumentation.CommandStats()
+        token = instrumentation._current.set(stats)
+        try:
+            with _count_mongomock_commands():
+                function()
+        finally:
+            instrumentation._current.reset(token)
+        return dict(stats.collections)
+
+    def render(self, posts):
+        return [(post.category.name, [tag.name for tag in post.tags]) for post in posts]
+
+    def test_a_page_of_cards_costs_one_query_per_collection(self):
+        cards = fetch_cards(Post.objects.order_by('title'))
+        self.assertEqual(self.commands(lambda: prefetch_taxonomy(cards)), {'categories': 1, 'tags': 1})
+        self.assertEqual(self.commands(lambda: self.render(cards)), {})
+        self.assertEqual(self.render(cards)[0], ('Category 0', ['Tag 0', 'Other 0']))
+
+    def test_documents_are_resolved_in_place(self):
+        posts = list(Post.objects.order_by('title'))
+        self.assertEqual(self.commands(lambda: prefetch_taxonomy(posts)), {'categories': 1, 'tags': 1})
+        self.assertEqual(self.commands(lambda: self.render(posts)), {})
+
+    def test_skipped_collections_are_not_queried(self):
+        cards = fetch_cards(Post.objects)
+        self.assertEqual(self.commands(lambda: prefetch_taxonomy(cards, tags=False)), {'categories': 1})
+
+
+class IdentityMapTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.categories = [Category(name=name).save() for name in ('Isekai', 'Mecha')]
+
+    def request(self, view):
+        """Run view behind the identity map; returns the request (with mongo_stats) and response"""
+        middleware = instrumentation.MongoTimingMiddleware(identity.IdentityMapMiddleware(view))
+        request = RequestFactory().get('/')
+        with _count_mongomock_commands():
+            response = middleware(request)
+        return request, response
+
+    @override_settings(DEBUG=True)
+    def test_the_same_document_is_returned_within_a_request(self):
+        pk = self.categories[0].pk
+
+        def view(request):
+            first, second = identity.get(Category, pk), identity.get(Category, pk)
+            self.assertIs(first, second)
+            self.assertIs(identity.get_many(Category, [pk, self.categories[1].pk])[pk], first)
+            return HttpResponse()
+
+        request, response = self.request(view)
+        self.assertEqual(response['X-Identity-Map'], 'hits=2; misses=2; queries-saved=1')
+        self.assertEqual(request.mongo_stats.collections['categories'], 2)
+
+    def test_registered_and_complete_collections_are_not_queried_again(self):
+        def view(request):
+            loaded = identity.register([Category.objects.get(pk=self.categories[0].pk)])[0]
+            self.assertIs(identity.get(Category, loaded.pk), loaded)
+            everything = identity.all_documents(Category)
+            self.assertIs(everything[0], loaded)
+            self.assertIs(identity.all_documents(Category), everything)
+            self.assertEqual(identity.get_many(Category, [ObjectId()]), {})  # known to be missing
+            return HttpResponse()
+
+        request, _ = self.request(view)
+        self.assertEqual(request.mongo_stats.collections['categories'], 2)  # the get and the full load
+
+    def test_each_request_gets_a_fresh_map(self):
+        seen = []
+
+        def view(request):
+            seen.append(identity.get(Category, self.categories[0].pk))
+            return HttpResponse()
+
+        self.request(view)
+        self.request(view)
+        self.assertIsNot(seen[0], seen[1])
+        self.assertIsNone(identity.current())
+
+
+class CursorPaginationTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        start = datetime(2024, 1, 1)
+        # Two posts share a timestamp, so the id has to break the tie
+        moments = [start, start + timedelta(hours=1), start + timedelta(hours=1), start + timedelta(hours=2),
+                   start + timedelta(hours=3)]
+        for number, moment in enumerate(moments):
+            post = self.make_post(f'Post {number}')
+            Post.objects(pk=post.pk).update(set__created_at=moment)
+        self.newest_first = [post.title for post in Post.objects.order_by('-created_at', '-id')]
+        self.paginator = CursorPaginator(Post.objects(status='published'), per_page=2, with_count=True)
+
+    def test_next_cursors_walk_every_post_once(self):
+        page, titles = self.paginator.get_page(), []
+        while True:
+            titles += [post.title for post in page]
+            if not page.has_next():
+                break
+            page = self.paginator.get_page(page.next_cursor)
+        self.assertEqual(titles, self.newest_first)
+        self.assertTrue(page.has_previous())
+        self.assertEqual(self.paginator.count, 5)
+
+    def test_previous_cursor_returns_the_same_page(self):
+        first = self.paginator.get_page()
+        second = self.paginator.get_page(first.next_cursor)
+        back = self.paginator.get_page(second.previous_cursor)
+        self.assertEqual([post.title for post in back], [post.title for post in first])
+        self.assertFalse(back.has_previous())
+
+    def test_invalid_cursor_falls_back_to_the_first_page(self):
+        page = self.paginator.get_page('not-a-cursor')
+        self.assertEqual([post.title for post in page], self.newest_first[:2])
+        self.assertFalse(page.has_previous())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TagInvalidationTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.renders = 0
+
+    def test_key_changes_only_with_its_tags(self):
+        key = make_key('sidebar', [POSTS, post_tag(1)], parts=('a',))
+        self.assertEqual(make_key('sidebar', [post_tag(1), POSTS], parts=('a',)), key)
+        self.assertNotEqual(make_key('sidebar', [POSTS, post_tag(1)], parts=('b',)), key)
+        invalidate(TAXONOMY, post_tag(2))
+        self.assertEqual(make_key('sidebar', [POSTS, post_tag(1)], parts=('a',)), key)
+        invalidate(post_tag(1))
+        self.assertNotEqual(make_key('sidebar', [POSTS, post_tag(1)], parts=('a',)), key)
+
+    def test_cached_page_is_served_until_invalidated(self):
+        @cache_page_by_tags(POSTS, lambda request, pk: post_tag(pk))
+        def page(request, pk):
+            self.renders += 1
+            return HttpResponse(f'render {self.renders}')
+
+        factory = RequestFactory()
+        self.assertEqual(page(factory.get('/p/1/'), 1)['X-Page-Cache'], 'miss')
+        hit = page(factory.get('/p/1/'), 1)
+        self.assertEqual((hit['X-Page-Cache'], hit.content), ('hit', b'render 1'))
+        invalidate(post_tag(2))
+        self.assertEqual(page(factory.get('/p/1/'), 1).content, b'render 1')
+        invalidate(post_tag(1))
+        self.assertEqual(page(factory.get('/p/1/'), 1).content, b'render 2')
+
+        # Readers with a session always get their own render
+        reader = factory.get('/p/1/')
+        reader.COOKIES['sessionid'] = 'abc'
+        self.assertEqual(page(reader, 1).content, b'render 3')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.tiered = TieredCache(backend=cache, max_entries=2, stale=60, jitter=0, lock_timeout=1)
+        self.builds = count()
+
+    def build(self):
+        return next(self.builds)
+
+    def test_value_is_built_once_and_shared(self):
+        self.assertEqual(self.tiered.get_or_set('a', self.build, 60), 0)
+        self.assertEqual(self.tiered.get_or_set('a', self.build, 60), 0)
+        self.assertEqual((self.tiered.hits, self.tiered.misses), (1, 1))
+        # Another worker finds it in the shared backend
+        other = TieredCache(backend=cache, max_entries=2, stale=60, jitter=0, lock_timeout=1)
+        self.assertEqual(other.get_or_set('a', self.build, 60), 0)
+        self.assertEqual(next(self.builds), 1)
+
+    def test_local_lru_keeps_the_most_recent_entries(self):
+        for key in 'abc':
+            self.tiered.get_or_set(key, self.build, 60)
+        self.assertIsNone(self.tiered.local.get('a'))
+        self.assertIsNotNone(self.tiered.local.get('c'))
+        self.assertEqual(self.tiered.get_or_set('a', self.build, 60), 0)  # still in the backend
+
+    def test_stale_value_is_served_while_refreshing(self):
+        self.assertEqual(self.tiered.get_or_set('a', self.build, 0), 0)  # stale at once
+        self.assertEqual(self.tiered.get_or_set('a', self.build, 0), 0)
+        for thread in threading.enumerate():
+            if thread.name == 'cache-refresh':
+                thread.join()
+        self.assertEqual(self.tiered.stale_hits, 1)
+        self.assertEqual(self.tiered.get_or_set('a', self.build, 60), 1)
+
+
+class BulkRoundTripTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        category, tag = Category(name='Seinen').save(), Tag(name='Drama').save()
+        post = self.make_post('Monster', category=category, tags=[tag])
+        self.make_post('Pluto', tags=[tag], status='draft')
+        Comment(post=post, name='tenma', email='tenma@example.com', content='A masterpiece.').save()
+        self.lines = [json.loads(dumps(record)) for record in export_records()]
+
+    def snapshot(self):
+        return {
+            'posts': sorted(Post.objects.scalar('slug', 'status', 'last_commented_at')),
+            'counts': sorted(Category.objects.scalar('name', 'published_count'))
+            + sorted(Tag.objects.scalar('name', 'published_count')),
+            'comments': list(Comment.objects.scalar('content')),
+        }
+
+    def run_import(self):
+        importer = Importer(chunk_size=2)
+        for line, record in enumerate(self.lines, 1):
+            importer.add(line, dict(record))
+        importer.finish()
+        return importer
+
+    def test_export_imports_into_an_empty_database(self):
+        expected = self.snapshot()
+        for document_cls in (Category, Tag, Post, Comment):
+            document_cls.drop_collection()
+        importer = self.run_import()
+        self.assertEqual(dict(importer.created), {'category': 1, 'tag': 1, 'post': 2, 'comment': 1})
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_reimport_skips_stored_records(self):
+        expected = self.snapshot()
+        importer = self.run_import()
+        self.assertEqual(sum(importer.created.values()), 0)
+        self.assertEqual(sum(importer.skipped.values()), len(self.lines))
+        self.assertEqual(self.snapshot(), expected)
+
+
+class ViewCounterTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.make_post('Oshi no Ko')
+        self.counter = ViewCounter(mode='buffered', flush_interval=3600)
+
+    def stored(self):
+        bucket = PostViewBucket.objects(post=self.post.pk).first()
+        return Post.objects.get(pk=self.post.pk).views, bucket.views if bucket else 0
+
+    def test_forked_worker_keeps_its_first_hit(self):
+        self.counter.record('parent-post', 5)
+        self.counter._pid = -1  # as seen from a worker forked after that hit
+        self.counter.record(self.post.pk)
+        self.assertEqual(dict(self.counter._pending), {self.post.pk: 1})
+
+    def test_failed_bucket_write_is_retried_without_recounting_views(self):
+        self.counter.record(self.post.pk, 2)
+        with mock.patch.object(self.counter, '_write_bucket_counts', side_effect=OSError('down')), \
+                self.assertLogs('blogapp.viewcounter', 'ERROR'):
+            self.assertEqual(self.counter.flush(), 2)
+        self.assertEqual(self.stored(), (2, 0))
+        self.counter.flush()
+        self.assertEqual(self.stored(), (2, 2))
+
+
+class FileCacheLockTests(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache.backends.filebased import FileBasedCache
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.tiered = TieredCache(backend=FileBasedCache(directory.name, {}), max_entries=2, lock_timeout=5)
+
+    def test_lock_is_taken_once_until_released(self):
+        self.assertTrue(self.tiered._acquire('k'))
+        self.assertFalse(self.tiered._acquire('k'))
+        self.tiered._release('k')
+        self.assertTrue(self.tiered._acquire('k'))
+
+    def test_lock_of_a_dead_builder_expires(self):
+        self.assertTrue(self.tiered._acquire('k'))
+        expired = time.time() - 10
+        os.utime(self.tiered._lock_path('k'), (expired, expired))
+        self.assertTrue(self.tiered._acquire('k'))
+
+
+class ViewBeaconTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.post = self.make_post('Blue Lock')
+        from .viewcounter import view_counter
+
+        self.view_counter = view_counter
+        self.view_counter.flush()
+
+    def beacon(self, address='10.0.0.1'):
+        return self.client.post(f'/{self.post.slug}/view/', REMOTE_ADDR=address).status_code
+
+    def views(self):
+        self.view_counter.flush()
+        return Post.objects.get(pk=self.post.pk).views
+
+    def test_beacon_is_not_routed_without_edge_caching(self):
+        self.assertEqual(self.beacon(), 404)
+        self.assertEqual(self.views(), 0)
+
+    @override_settings(DETAIL_EDGE_CACHE=True)
+    def test_repeated_beacons_count_once_per_address(self):
+        self.assertEqual([self.beacon(), self.beacon(), self.beacon('10.0.0.2')], [204, 204, 204])
+        self.assertEqual(self.views(), 2)
+
+
+class SearchTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_post('One Piece Film Red', content='<p>Uta sings.</p>')
+        self.make_post('Chainsaw Man', content='<p>Better than One Piece? (No.)</p>')
+        self.make_post('C++ Senpai [draft]', status='draft')
+
+    def titles(self, results):
+        return [post.title for post in results[0:9]]
+
+    def test_text_query_is_a_relevance_sorted_phrase(self):
+        results = text_search(Post.objects, 'one "piece"')
+        self.assertEqual(results._query['$text']['$search'], '"one  piece"')
+        self.assertEqual(results._ordering[0], ('_text_score', {'$meta': 'textScore'}))
+
+    def commands(self):
+        with _count_mongomock_commands():
+            response = self.client.get('/search/', {'q': 'one piece'})
+        self.assertContains(response, 'One Piece Film Red')
+        return dict(response.wsgi_request.mongo_stats.names)
+
+    def test_search_counts_once_and_loads_one_page(self):
+        # One count (mongoengine opens a cursor for it, a round trip only on mongomock) and one page
+        expected = {'find': 2, 'aggregate': 1}
+        # mongomock has no $text; a substring match stands in for the index
+        with mock.patch('blogapp.search.text_search', side_effect=substring_search):
+            self.assertEqual(self.commands(), expected)
+        with override_settings(SEARCH_BACKEND='substring'):
+            self.assertEqual(self.commands(), expected)
+
+    def test_no_text_match_falls_back_to_substrings(self):
+        with mock.patch('blogapp.search.text_search', return_value=Post.objects(title='nothing')):
+            self.assertEqual(self.titles(search_posts('saw')), ['Chainsaw Man'])
+
+    def test_text_index_failure_falls_back_to_substrings(self):
+        failing = mock.Mock()
+        failing.count.side_effect = OperationFailure('text index required for $text query')
+        with mock.patch('blogapp.search.text_search', return_value=failing), \
+                self.assertLogs('blogapp.search', 'WARNING'):
+            self.assertEqual(self.titles(search_posts('uta')), ['One Piece Film Red'])
+
+    def test_empty_query_runs_no_search(self):
+        with mock.patch('blogapp.views.search_posts') as search:
+            response = self.client.get('/search/', {'q': ''})
+        self.assertEqual(response.status_code, 200)
+        search.assert_not_called()
+
+    @override_settings(SEARCH_BACKEND='substring')
+    def test_special_characters_are_matched_literally(self):
+        self.make_post('C++ Senpai [live]')
+        self.assertEqual(self.titles(search_posts('c++ senpai [')), ['C++ Senpai [live]'])
+        self.assertEqual(self.titles(search_posts('.*')), [])
+        self.assertEqual(self.titles(search_posts('? (no.)')), ['Chainsaw Man'])
+
+
+@unittest.skipUnless(os.environ.get('MONGODB_TEST_URI'), 'ranking needs a real mongod (set MONGODB_TEST_URI)')
+class TextRankingTests(SimpleTestCase):
+    def setUp(self):
+        mongoengine.disconnect()
+        mongoengine.connect('blog_search_test', host=os.environ['MONGODB_TEST_URI'])
+        self.addCleanup(mongoengine.disconnect)
+        self.addCleanup(Post.drop_collection)
+        Post.drop_collection()
+        Post.ensure_indexes()
+
+    def test_title_matches_rank_above_content_matches(self):
+        for title, content in (('Chainsaw Man', '<p>Better than One Piece.</p>'), ('One Piece', '<p>Pirates.</p>')):
+            Post(title=title, content=content, author_id=1, author_username='tester').save()
+        self.assertEqual([post.title for post in search_posts('one piece')[0:9]], ['One Piece', 'Chainsaw Man'])
+
+
+class UploadQueueTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.uploader = mock.Mock()
+        self.fallback = mock.Mock()
+        self.posts = [self.make_post(title, thumbnail=image_placeholder()) for title in ('Mushishi', 'Aria')]
+
+    def submit(self, queue, post):
+        return queue.submit(post.pk, 'thumbnail', ContentFile(b'same image', name='cover.png'), 'thumbnails')
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_identical_images_are_uploaded_once(self):
+        self.uploader.upload.return_value = '/media/cover.png'
+        queue = UploadQueue(mode='sync', uploader=self.uploader, fallback=self.fallback)
+        for post in self.posts:
+            self.assertEqual(self.submit(queue, post), '/media/cover.png')
+        self.uploader.upload.assert_called_once()
+        self.assertEqual(ImageAsset.objects.count(), 1)
+        self.assertEqual(list(Post.objects.scalar('thumbnail')), ['/media/cover.png'] * 2)
+
+    def test_failed_upload_is_retried_then_recorded(self):
+        self.uploader.upload.side_effect = self.fallback.upload.side_effect = OSError('storage down')
+        queue = UploadQueue(mode='async', uploader=self.uploader, fallback=self.fallback, attempts=2, retry_delay=0.01)
+        self.addCleanup(queue.drain)
+        with self.assertLogs('blogapp.uploads', 'WARNING'):
+            self.submit(queue, self.posts[0])
+            self.wait_for(lambda: queue.depth() == 0)
+        self.assertEqual((self.uploader.upload.call_count, self.fallback.upload.call_count), (2, 2))
+        post = Post.objects.get(pk=self.posts[0].pk)
+        self.assertEqual(post.thumbnail, image_placeholder())
+        self.assertEqual(post.upload_errors, {'thumbnail': 'upload failed after 2 attempt(s)'})
+
+        # A later successful upload clears the recorded failure
+        self.uploader.upload.side_effect = None
+        self.uploader.upload.return_value = '/media/cover.png'
+        self.submit(queue, self.posts[0]).result()
+        post.reload()
+        self.assertEqual((post.thumbnail, post.upload_errors), ('/media/cover.png', {}))
+
+    def test_drain_records_uploads_still_waiting_to_retry(self):
+        self.uploader.upload.side_effect = self.fallback.upload.side_effect = OSError('storage down')
+        queue = UploadQueue(mode='async', uploader=self.uploader, fallback=self.fallback, attempts=3, retry_delay=60)
+        with self.assertLogs('blogapp.uploads', 'WARNING'):
+            self.submit(queue, self.posts[0])
+            self.wait_for(lambda: queue._retries)
+            queue.drain()
+        self.assertEqual(queue.depth(), 0)
+        self.assertIn('thumbnail', Post.objects.get(pk=self.posts[0].pk).upload_errors)
+
+
+@override_settings(IMAGE_VARIANT_WIDTHS=[320, 640, 1280], IMAGE_VARIANT_QUALITY=70)
+class ImageVariantTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        buffer = io.BytesIO()
+        Image.new('RGBA', (1000, 500), (200, 40, 40, 128)).save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+        self.uploader = mock.Mock()
+        self.uploader.upload.side_effect = lambda image, folder: f'/media/{folder}/{image.name}'
+
+    def test_steps_are_never_upscaled(self):
+        variants, lqip, size = render_variants(self.png)
+        self.assertEqual(size, (1000, 500))
+        self.assertEqual([(extension, width) for extension, width, _ in variants],
+                         [('webp', 320), ('jpeg', 320), ('webp', 640), ('jpeg', 640), ('webp', 1000), ('jpeg', 1000)])
+        with Image.open(io.BytesIO(variants[0][2])) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (320, 160)))
+        self.assertTrue(lqip.startswith('data:image/jpeg;base64,'))
+
+    def test_srcsets_point_at_the_uploaded_steps(self):
+        variants = build_variants(self.png, 'uploads/cover.png', self.uploader)
+        self.assertEqual(variants['webp'], '/media/blog_images/variants/cover-320w.webp 320w, '
+                                           '/media/blog_images/variants/cover-640w.webp 640w, '
+                                           '/media/blog_images/variants/cover-1000w.webp 1000w')
+        self.assertEqual((variants['src'], variants['width'], variants['height']),
+                         ('/media/blog_images/variants/cover-640w.jpeg', 640, 320))
+        self.assertEqual(self.uploader.upload.call_count, 6)
+
+    def test_uploaded_featured_image_gets_variants_on_its_card(self):
+        post = self.make_post('Violet Evergarden', featured_image=image_placeholder(), status='published')
+        queue = UploadQueue(mode='sync', uploader=self.uploader)
+        queue.submit(post.pk, 'featured_image', ContentFile(self.png, name='violet.png'), 'blog_images')
+        post.reload()
+        self.assertEqual(post.featured_image, '/media/blog_images/violet.png')
+        self.assertEqual(ImageAsset.objects.get().variants, post.image_variants)
+
+        response = self.client.get('/archive/')
+        self.assertContains(response, f'<source type="image/webp" srcset="{post.image_variants["webp"]}"')
+        self.assertContains(response, 'src="/media/blog_images/variants/violet-640w.jpeg"')
+
+
+class ProfilingTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(PROFILE_DIR=self.directory, PROFILE_SAMPLE_RATE=0.0, PROFILE_MAX_FILES=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.token = profiling.make_token(SimpleNamespace(pk=1))
+
+    def profiles(self):
+        return [profile['name'] for profile in profiling.list_profiles()]
+
+    def test_requests_are_not_profiled_by_default(self):
+        response = self.client.get('/about/', HTTP_X_PROFILE_TOKEN='forged')
+        self.assertNotIn('X-Profiled', response)
+        self.assertEqual(self.profiles(), [])
+
+    def test_signed_token_profiles_the_request(self):
+        response = self.client.get('/about/', HTTP_X_PROFILE_TOKEN=self.token)
+        self.assertEqual(response['X-Profiled'], '1')
+        [name] = self.profiles()
+        self.assertRegex(name, r'^\d{8}T\d{6}-get-about-\d+ms-\d+\.pstats$')
+        stats = pstats.Stats(profiling.profile_path(name))
+        self.assertTrue(any(function[2] == 'about' for function in stats.stats))
+
+    def test_cookie_and_sample_rate_also_profile(self):
+        self.client.cookies[profiling.cookie_name()] = self.token
+        self.assertEqual(self.client.get('/about/')['X-Profiled'], '1')
+        del self.client.cookies[profiling.cookie_name()]
+        with override_settings(PROFILE_SAMPLE_RATE=1.0):
+            self.assertEqual(self.client.get('/about/')['X-Profiled'], '1')
+
+    @override_settings(PROFILE_TOKEN_MAX_AGE=-1)
+    def test_expired_token_is_ignored(self):
+        self.assertNotIn('X-Profiled', self.client.get('/about/', HTTP_X_PROFILE_TOKEN=self.token))
+
+    def test_only_the_newest_files_are_kept(self):
+        for number in range(3):
+            path = os.path.join(self.directory, f'old-{number}.pstats')
+            open(path, 'w').close()
+            os.utime(path, (number, number))
+        self.client.get('/about/', HTTP_X_PROFILE_TOKEN=self.token)
+        names = self.profiles()
+        self.assertEqual(len(names), 2)
+        self.assertEqual(names[1], 'old-2.pstats')
+
+    def test_profile_paths_stay_in_the_directory(self):
+        self.assertIsNone(profiling.profile_path('../settings.pstats'))
+        self.assertIsNone(profiling.profile_path('missing.pstats'))
+
+
+class BenchmarkTests(SimpleTestCase):
+    def setUp(self):
+        quiet_request_log(self)
+        self.addCleanup(mongoengine.disconnect)
+        # run_benchmark sets up its own test environment, as it does outside the test runner
+        teardown_test_environment()
+        self.addCleanup(setup_test_environment, debug=False)
+
+    def benchmark(self, *args):
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        call_command('benchmark_views', '--sizes', '30', '--requests', '3', '--warmup', '1', '--memory-requests', '1',
+                     '--database', 'blog_benchmark_test', '--output', output.name, *args, stdout=io.StringIO())
+        with open(output.name) as stream:
+            return json.load(stream)
+
+    def test_report_has_a_row_per_view_and_mode(self):
+        report = self.benchmark('--views', 'index', 'detail')
+        self.assertEqual(report['meta']['backend'], 'mongomock')
+        rows = {(row['posts'], row['view'], row['mode']): row for row in report['results']}
+        self.assertEqual(sorted(rows), [(30, 'detail', 'cold'), (30, 'detail', 'warm'),
+                                        (30, 'index', 'cold'), (30, 'index', 'warm')])
+        for row in rows.values():
+            self.assertLessEqual(row['latency_ms']['p50'], row['latency_ms']['p99'])
+            self.assertGreater(row['peak_memory_kb'], 0)
+        # A cold index page goes to Mongo; a warm one is served from the page cache
+        self.assertGreater(rows[30, 'index', 'cold']['mongo_commands']['mean'], 0)
+        self.assertLess(rows[30, 'index', 'warm']['mongo_commands']['mean'],
+                        rows[30, 'index', 'cold']['mongo_commands']['mean'])
+
+    def test_same_seed_requests_the_same_urls(self):
+        from .benchmark import _targets, benchmark_database, seed_corpus
+
+        with override_settings(CACHES=TEST_CACHES), benchmark_database('mongomock', 'blog_benchmark_test'):
+            seed_corpus(30, seed=4)
+            urls = [_targets('tag_posts', random.Random(4), 5) for _ in range(2)]
+        self.assertEqual(urls[0], urls[1])
+        self.assertTrue(all(url.startswith('/tag/') for url in urls[0]))
+
+    def test_bad_arguments_are_rejected(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_views', '--sizes', 'ten', stdout=io.StringIO())
+        with self.assertRaises(CommandError), override_settings(MONGODB_DB_NAME='blog_benchmark_test'):
+            self.benchmark()
+
+
+class CorpusTests(MongoTestCase):
+    def corpus(self, posts=40, seed=3):
+        return Corpus(posts, seed=seed, categories=14, tags=45, end=datetime(2025, 1, 1))
+
+    def test_documents_depend_only_on_the_parameters(self):
+        self.assertEqual(self.corpus().batch(1, 20, 20), self.corpus().batch(1, 20, 20))
+        self.assertNotEqual(self.corpus(seed=4).batch(1, 20, 20)[0], self.corpus().batch(1, 20, 20)[0])
+        categories, tags = self.corpus().taxonomy()
+        self.assertEqual(len({category['slug'] for category in categories}), 14)
+        self.assertEqual(len({tag['slug'] for tag in tags}), 45)
+
+    def test_rerun_skips_stored_documents_and_keeps_counts(self):
+        totals = generate(self.corpus(), batch_size=15)
+        self.assertEqual((totals['posts'], totals['categories'], totals['tags']), (40, 14, 45))
+        self.assertEqual(Comment.objects.count(), totals['comments'])
+        self.assertFalse(Comment.objects(post__in=Post.objects(status='draft').scalar('id')).count())
+        counts = sorted(Category.objects.scalar('published_count'))
+        self.assertEqual(sum(counts), Post.objects(status='published').count())
+
+        again = generate(self.corpus(), batch_size=15)
+        self.assertEqual((again['posts'], again['comments'], again['categories']), (0, 0, 0))
+        self.assertEqual(Post.objects.count(), 40)
+        rebuild_published_counts()
+        self.assertEqual(sorted(Category.objects.scalar('published_count')), counts)
+
+    def test_names_taken_by_other_documents_abort_before_writing(self):
+        Category(name='Action').save()
+        Tag(name='Shounen').save()  # same slug as the generated "shounen"
+        with self.assertRaisesMessage(CommandError, 'categories Action; tags Shounen'):
+            call_command('generate_corpus', '10', '--workers', '1', '--categories', '14', '--tags', '45',
+                         '--end', '2025-01-01', stdout=io.StringIO())
+        self.assertEqual((Post.objects.count(), Category.objects.count(), Tag.objects.count()), (0, 1, 1))
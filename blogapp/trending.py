@@ -0,0 +1,90 @@
+"""Time-decayed trending ranking.
+
+The view counter adds every flushed batch of hits to hourly per-post
+buckets (``post_view_buckets``). ``compute_trending`` runs as a periodic
+batch job (``manage.py compute_trending``, e.g. every 10 minutes from
+cron) and scores each post over the last TRENDING_WINDOW_HOURS as
+
+    sum(bucket views * 0.5 ** (bucket age / TRENDING_HALF_LIFE_HOURS))
+        * (1 + TRENDING_RATING_BOOST * rating / 10)
+
+The top TRENDING_SIZE posts are written to ``trending_posts`` keyed by rank
+together with their card fields, so the index page renders the block from
+one ``_id``-ordered query.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from pymongo import DeleteMany, ReplaceOne
+
+from .caching import invalidate, TRENDING
+from .listings import CARD_FIELDS, PostCard
+from .models import Post, PostViewBucket, TrendingPost
+
+LOOKUP_BATCH = 1000
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def hour_bucket(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def decayed_views(now=None):
+    """{post id: views in the window, each hour weighted by its exponential decay}"""
+    now = now or datetime.utcnow()
+    window = timedelta(hours=_setting('TRENDING_WINDOW_HOURS', 72))
+    half_life_ms = _setting('TRENDING_HALF_LIFE_HOURS', 12) * 3600 * 1000
+    pipeline = [
+        {'$match': {'bucket': {'$gte': now - window}}},
+        {'$group': {'_id': '$post', 'score': {'$sum': {'$multiply': ['$views', {'$pow': [
+            0.5, {'$divide': [{'$subtract': [now, '$bucket']}, half_life_ms]},
+        ]}]}}}},
+    ]
+    return {row['_id']: row['score'] for row in PostViewBucket._get_collection().aggregate(pipeline)}
+
+
+def compute_trending(now=None):
+    """Recompute the trending collection; returns the number of ranked posts"""
+    now = now or datetime.utcnow()
+    views = decayed_views(now)
+    boost = _setting('TRENDING_RATING_BOOST', 0.5)
+    size = _setting('TRENDING_SIZE', 50)
+
+    posts = Post._get_collection()
+    scores = []
+    candidates = list(views)
+    for start in range(0, len(candidates), LOOKUP_BATCH):
+        batch = candidates[start:start + LOOKUP_BATCH]
+        for row in posts.find({'_id': {'$in': batch}, 'status': 'published'}, {'rating': 1}):
+            rating = row.get('rating') or 0
+            scores.append((views[row['_id']] * (1 + boost * rating / 10), row['_id']))
+    scores.sort(key=lambda item: (-item[0], str(item[1])))
+    scores = scores[:size]
+
+    cards = {
+        row['_id']: row
+        for row in posts.find({'_id': {'$in': [pk for _, pk in scores]}, 'status': 'published'},
+                          dict.fromkeys(CARD_FIELDS, 1))
+    }
+    # A post deleted or unpublished since it was scored has no card and loses its rank
+    scores = [(score, pk) for score, pk in scores if pk in cards]
+    # Replace rows in place so readers never see an empty ranking
+    operations = [
+        ReplaceOne({'_id': rank}, {
+            'post': pk, 'score': round(score, 4), 'card': cards[pk], 'computed_at': now,
+        }, upsert=True)
+        for rank, (score, pk) in enumerate(scores, start=1)
+    ]
+    operations.append(DeleteMany({'_id': {'$gt': len(scores)}}))
+    TrendingPost._get_collection().bulk_write(operations, ordered=True)
+    invalidate(TRENDING)
+    return len(scores)
+
+
+def trending_cards(limit):
+    """PostCards of the top trending posts, read in rank order"""
+    rows = TrendingPost._get_collection().find({}, sort=[('_id', 1)], limit=limit)
+    return [PostCard(row['card']) for row in rows]
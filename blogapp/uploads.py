@@ -0,0 +1,258 @@
+"""Background image uploads for posts.
+
+PostForm.save stores a placeholder URL and queues each image here; a small
+per-process thread pool uploads them concurrently and patches the post with
+a targeted ``$set`` once the real URL is known. Images are addressed by the
+SHA-256 of their content, so one that is already stored is reused without
+uploading it again. A job that fails on both the uploader and the local
+fallback is retried with exponential backoff (``IMAGE_UPLOAD_ATTEMPTS``,
+``IMAGE_UPLOAD_RETRY_DELAY``); when it gives up, or the process exits with
+the retry still pending, the reason is stored in ``Post.upload_errors``.
+Set ``IMAGE_UPLOAD_MODE = 'sync'`` to upload inside the
+request, and ``IMAGE_UPLOADER`` to swap the storage backend
+(``blogapp.uploads.LocalUploader`` needs no credentials).
+"""
+import atexit
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.module_loading import import_string
+
+from .caching import invalidate, post_tag, slug_tag, POSTS
+
+logger = logging.getLogger(__name__)
+
+
+class LocalUploader:
+    """Stores images with FileSystemStorage under MEDIA_ROOT"""
+
+    def __init__(self, location=None, base_url=None):
+        self.storage = FileSystemStorage(location=location, base_url=base_url)
+
+    def upload(self, image, folder):
+        filename = self.storage.save(f'uploads/{image.name}', image)
+        return self.storage.url(filename)
+
+
+class CloudinaryUploader:
+    """Uploads images to Cloudinary and returns the secure URL"""
+
+    def upload(self, image, folder):
+        import cloudinary.uploader
+
+        result = cloudinary.uploader.upload(image, folder=folder)
+        return result.get('secure_url', image.name)
+
+
+def get_uploader():
+    return import_string(getattr(settings, 'IMAGE_UPLOADER', 'blogapp.uploads.CloudinaryUploader'))()
+
+
+class UploadQueue:
+    # Fields whose uploads also get responsive derivatives, and where they are stored
+    VARIANT_FIELDS = {'featured_image': 'image_variants'}
+
+    def __init__(self, mode=None, workers=None, uploader=None, fallback=None, attempts=None, retry_delay=None):
+        self.mode = mode or getattr(settings, 'IMAGE_UPLOAD_MODE', 'async')
+        self.workers = workers or getattr(settings, 'IMAGE_UPLOAD_WORKERS', 4)
+        self.uploader = uploader
+        self.fallback = fallback or LocalUploader()
+        self.attempts = attempts or getattr(settings, 'IMAGE_UPLOAD_ATTEMPTS', 3)
+        self.retry_delay = retry_delay if retry_delay is not None else getattr(settings, 'IMAGE_UPLOAD_RETRY_DELAY', 30.0)
+        self._executor = None
+        self._pid = None
+        self._depth = 0
+        self._retries = {}  # Pending backoff timer -> job
+        self._lock = threading.Lock()
+
+    def submit(self, post_id, field, image, folder):
+        """Upload an image and $set it on the post; returns a future in async mode"""
+        # The request's upload (possibly a temporary file) is gone once the
+        # response is sent, so the job gets its own in-memory copy, hashed
+        # as it is read for content-addressed reuse.
+        digest, buffer = hashlib.sha256(), BytesIO()
+        for chunk in image.chunks():
+            digest.update(chunk)
+            buffer.write(chunk)
+        copy = ContentFile(buffer.getvalue(), name=os.path.basename(image.name))
+        job = (post_id, field, copy, folder, digest.hexdigest())
+        if self.mode == 'sync':
+            return self._run(*job)
+        executor = self._get_executor()
+        with self._lock:
+            self._depth += 1
+        try:
+            return executor.submit(self._run, *job)
+        except Exception:
+            with self._lock:
+                self._depth -= 1
+            raise
+
+    def depth(self):
+        """Number of uploads queued, in progress or waiting to retry in this process"""
+        with self._lock:
+            return self._depth
+
+    def drain(self):
+        """Wait for queued uploads to finish; retries still backing off are recorded as failed"""
+        executor, self._executor = self._executor, None
+        if executor is None or self._pid != os.getpid():
+            return
+        executor.shutdown(wait=True)
+        with self._lock:
+            retries, self._retries = self._retries, {}
+        for timer, job in retries.items():
+            timer.cancel()
+            self._record_failure(job[0], job[1], 'the process exited before the upload could be retried')
+        with self._lock:
+            self._depth -= len(retries)
+
+    def _run(self, post_id, field, image, folder, sha256, attempt=1):
+        from .models import ImageAsset
+
+        retrying = False
+        try:
+            assets = ImageAsset._get_collection()
+            asset = assets.find_one({'_id': sha256})
+            if asset:
+                url, variants = asset['url'], asset.get('variants')
+            else:
+                url, variants = self._upload(image, folder), None
+                if url:
+                    register_asset(sha256, url, image.size)
+            if not url:
+                job = (post_id, field, image, folder, sha256)
+                retrying = self._retry(job, attempt)
+                if not retrying:
+                    self._record_failure(post_id, field, f'upload failed after {attempt} attempt(s)')
+                return None
+            variant_field = self.VARIANT_FIELDS.get(field)
+            updates = {field: url}
+            if variant_field and variants:
+                updates[variant_field] = variants
+            self._patch(post_id, field, image_placeholder(), updates, unset=[f'upload_errors.{field}'])
+            if variant_field and not variants:
+                variants = self._build_variants(url, image)
+                if variants:
+                    assets.update_one({'_id': sha256}, {'$set': {'variants': variants}})
+                    self._patch(post_id, field, url, {variant_field: variants})
+            return url
+        finally:
+            # A job waiting to retry stays counted until its last attempt
+            if self.mode != 'sync' and not retrying:
+                with self._lock:
+                    self._depth -= 1
+
+    def _retry(self, job, attempt):
+        """Schedule the job again after an exponential backoff; False when it should give up"""
+        if self.mode == 'sync' or attempt >= self.attempts:
+            return False
+        delay = self.retry_delay * 2 ** (attempt - 1)
+        logger.warning('Retrying upload of %s in %.0fs (attempt %d of %d)', job[2].name, delay, attempt + 1, self.attempts)
+        timer = threading.Timer(delay, lambda: self._resubmit(timer, job, attempt + 1))
+        timer.daemon = True
+        with self._lock:
+            self._retries[timer] = job
+        timer.start()
+        return True
+
+    def _resubmit(self, timer, job, attempt):
+        with self._lock:
+            if self._retries.pop(timer, None) is None:
+                return  # drain() already recorded it
+            executor = self._executor
+        try:
+            executor.submit(self._run, *job, attempt=attempt)
+        except Exception:
+            # The pool was shut down while the job was backing off
+            with self._lock:
+                self._depth -= 1
+            self._record_failure(job[0], job[1], 'the upload queue shut down before the upload could be retried')
+
+    def _record_failure(self, post_id, field, reason):
+        """Store why the upload gave up on the post, which keeps its placeholder"""
+        from .models import Post
+
+        logger.error('Giving up on the %s upload for post %s: %s', field, post_id, reason)
+        try:
+            Post._get_collection().update_one(
+                {'_id': post_id, field: image_placeholder()},
+                {'$set': {f'upload_errors.{field}': reason}},
+            )
+        except Exception:
+            logger.exception('Could not record the failed %s upload for post %s', field, post_id)
+
+    def _upload(self, image, folder):
+        try:
+            return (self.uploader or get_uploader()).upload(image, folder)
+        except Exception:
+            logger.warning('Image upload to %s failed, storing locally', folder, exc_info=True)
+        try:
+            image.seek(0)
+            return self.fallback.upload(image, folder)
+        except Exception:
+            logger.exception('Could not store image %s; the post keeps its placeholder', image.name)
+            return None
+
+    def _patch(self, post_id, field, expected, updates, unset=()):
+        """$set updates on the post while field still holds the expected value"""
+        from .models import Post
+
+        update = {'$set': updates}
+        if unset:
+            update['$unset'] = dict.fromkeys(unset, '')
+        # Never overwrite an image set by a later edit
+        post = Post._get_collection().find_one_and_update(
+            {'_id': post_id, field: expected}, update, projection={'slug': 1}
+        )
+        if post:
+            invalidate(POSTS, post_tag(post_id), slug_tag(post['slug']))
+
+    def _build_variants(self, url, image):
+        from .images import build_variants
+
+        try:
+            image.seek(0)
+            return build_variants(image.read(), image.name, self.uploader or get_uploader())
+        except Exception:
+            logger.exception('Could not build responsive variants for %s', url)
+            return None
+
+    def _get_executor(self):
+        # Forked workers cannot use the parent's threads
+        pid = os.getpid()
+        if self._pid != pid or self._executor is None:
+            with self._lock:
+                if self._pid != pid or self._executor is None:
+                    if self._pid != pid:
+                        self._depth = 0
+                        self._retries = {}
+                    self._pid = pid
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-upload')
+        return self._executor
+
+
+def register_asset(sha256, url, size, variants=None):
+    """Record where the image with this content hash is stored; the first URL wins"""
+    from .models import ImageAsset
+
+    document = {'url': url, 'size': size, 'created_at': datetime.utcnow()}
+    if variants:
+        document['variants'] = variants
+    ImageAsset._get_collection().update_one({'_id': sha256}, {'$setOnInsert': document}, upsert=True)
+
+
+def image_placeholder():
+    return getattr(settings, 'IMAGE_PLACEHOLDER', settings.STATIC_URL + 'images/placeholder.svg')
+
+
+upload_queue = UploadQueue()
+atexit.register(upload_queue.drain)
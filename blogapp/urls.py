@@ -5,6 +5,7 @@ from blogapp import views
 
 from django.urls import path
 from . import views
+from .metrics import metrics_view
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -19,6 +20,9 @@ urlpatterns = [
     path('category/<slug:slug>/', views.category_posts, name='category_posts'),
     path('tag/<slug:slug>/', views.tag_posts, name='tag_posts'),
     path('create_post/', views.create_post, name='create_post'),
+    path('metrics', metrics_view, name='metrics'),
+    path('<slug:slug>/view/', views.record_view, name='record_view'),
+    path('<slug:slug>/comment-form/', views.comment_form, name='comment_form'),
     path('<slug:slug>/', views.detail, name='detail'),
    
 
@@ -0,0 +1,136 @@
+"""Write-behind view counting for posts.
+
+Hits are buffered per process and flushed on a timer as one batched
+``$inc`` bulk write, so reading a post never rewrites the document. Each
+write also adds the hits to the post's hourly bucket for trending scores.
+Set ``VIEW_COUNTER_MODE = 'sync'`` to issue one atomic ``$inc`` per hit.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    def __init__(self, mode=None, flush_interval=None):
+        self.mode = mode or getattr(settings, 'VIEW_COUNTER_MODE', 'buffered')
+        self.flush_interval = flush_interval or getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 5.0)
+        self._pending = Counter()  # post id -> views not yet added to Post.views
+        self._pending_buckets = Counter()  # (post id, hour) -> views not yet added to the buckets
+        self._oldest = None  # When the oldest buffered hit was recorded
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def record(self, post_id, count=1):
+        """Count a view of the given post id"""
+        if self.mode == 'sync':
+            self._write_bucket_counts(self._write_views({post_id: count}))
+            return
+        # Before buffering: a new worker's first hit must not be dropped with the parent's buffer
+        self._ensure_flusher()
+        with self._lock:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending[post_id] += count
+
+    def pending(self):
+        """Number of buffered hits not yet written"""
+        with self._lock:
+            return sum(self._pending.values())
+
+    def lag(self):
+        """Seconds the oldest buffered hit has been waiting to be written"""
+        with self._lock:
+            return time.monotonic() - self._oldest if self._pending else 0.0
+
+    def flush(self):
+        """Write buffered hits now; failed writes are put back in their buffer.
+
+        Post totals and trending buckets are buffered apart, so a failed
+        bucket write is retried without adding the hits to Post.views twice.
+        """
+        with self._lock:
+            self._forget_parent()
+            pending, self._pending = self._pending, Counter()
+            oldest, self._oldest = self._oldest, None
+            buckets, self._pending_buckets = self._pending_buckets, Counter()
+        written = 0
+        if pending:
+            try:
+                buckets.update(self._write_views(pending))
+                written = sum(pending.values())
+            except Exception:
+                logger.exception('Failed to flush %d post views', sum(pending.values()))
+                with self._lock:
+                    self._pending.update(pending)
+                    self._oldest = min(filter(None, (oldest, self._oldest)), default=None)
+        if buckets:
+            try:
+                self._write_bucket_counts(buckets)
+            except Exception:
+                logger.exception('Failed to flush %d trending bucket views', sum(buckets.values()))
+                with self._lock:
+                    self._pending_buckets.update(buckets)
+        return written
+
+    def _write_views(self, counts):
+        """$inc Post.views; returns the {(post id, hour): views} the buckets still need"""
+        from .models import Post
+        from .trending import hour_bucket
+
+        Post._get_collection().bulk_write([
+            UpdateOne({'_id': post_id}, {'$inc': {'views': count}})
+            for post_id, count in counts.items()
+        ], ordered=False)
+        bucket = hour_bucket(datetime.utcnow())
+        return Counter({(post_id, bucket): count for post_id, count in counts.items()})
+
+    def _write_bucket_counts(self, buckets):
+        from .models import PostViewBucket
+
+        PostViewBucket._get_collection().bulk_write([
+            UpdateOne({'post': post_id, 'bucket': bucket}, {'$inc': {'views': count}}, upsert=True)
+            for (post_id, bucket), count in buckets.items()
+        ], ordered=False)
+
+    def _forget_parent(self):
+        # Called with the lock held. A forked worker inherits its parent's buffers,
+        # which the parent flushes itself.
+        pid = os.getpid()
+        if self._pid is not None and self._pid != pid:
+            self._pending = Counter()
+            self._pending_buckets = Counter()
+            self._oldest = None
+            self._thread = None
+            self._pid = pid
+
+    def _ensure_flusher(self):
+        # Workers forked after the first hit (e.g. gunicorn --preload) need their own thread
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None:
+            return
+        with self._lock:
+            self._forget_parent()
+            if self._pid == pid and self._thread is not None:
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+view_counter = ViewCounter()
+atexit.register(view_counter.flush)
@@ -1,38 +1,69 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import render, redirect
 from django.core.paginator import Paginator
 from django.contrib import messages
-from django.http import Http404
+from django.http import Http404, HttpResponse, JsonResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout
 from .models import Post, Category, Tag, Comment, Newsletter, Contact
+from . import identity
+from .caching import (
+    cache_page_by_tags, cached_fragment, edge_cached_page, render_page, post_tag, slug_tag, POSTS, TAXONOMY, TRENDING,
+)
+from .conditional import (
+    conditional_page, index_validators, listing_validators, detail_validators, category_validators, tag_validators,
+)
 from .forms import CommentForm, NewsletterForm, ContactForm, PostForm, SignUpForm
+from .listings import fetch_cards, prefetch_taxonomy
+from .pagination import CursorPaginator
+from .search import search_posts
+from .trending import trending_cards
+from .viewcounter import view_counter
 
 
-def index(request):
-    # Get featured posts (high rating or most viewed)
-    featured_posts = Post.objects(
+def _featured_posts():
+    # Trending posts (see blogapp/trending.py); until the first ranking is
+    # computed, fall back to highly rated posts with the most views
+    featured_posts = trending_cards(3) or fetch_cards(Post.objects(
         status='published',
         rating__gte=8.0
-    ).order_by('-views')[:3]
+    ).order_by('-views')[:3])
+    return prefetch_taxonomy(featured_posts, tags=False)
+
+
+def _recent_posts():
+    recent_posts = fetch_cards(Post.objects(status='published').order_by('-created_at')[:9])
+    return prefetch_taxonomy(recent_posts, tags=False)
+
+
+@cache_page_by_tags(POSTS, TAXONOMY, TRENDING)
+@conditional_page(index_validators)
+def index(request):
+    # Get popular categories with post counts
+    popular_categories = identity.register(cached_fragment(
+        'popular_categories', lambda: Category.with_post_counts(limit=6), [TAXONOMY]
+    ))
     
-    # Get recent posts
-    recent_posts = Post.objects(status='published').order_by('-created_at')[:9]
+    # Get featured posts (trending now)
+    featured_posts = cached_fragment('featured_posts', _featured_posts, [POSTS, TAXONOMY, TRENDING])
     
-    # Get popular categories with post counts
-    popular_categories = []
-    for category in Category.objects():
-        post_count = Post.objects(category=category, status='published').count()
-        if post_count > 0:
-            category.post_count = post_count
-            popular_categories.append(category)
-    popular_categories = popular_categories[:6]
+    # Get recent posts
+    recent_posts = cached_fragment('recent_posts', _recent_posts, [POSTS, TAXONOMY])
     
     context = {
         'featured_posts': featured_posts,
         'recent_posts': recent_posts,
         'popular_categories': popular_categories,
     }
-    return render(request, 'index.html', context)
+    return render_page(request, 'index.html', context)
 
 
 @login_required
@@ -69,33 +100,71 @@ def about(request):
     return render(request, "about.html")
 
 
-def detail(request, slug):
-    try:
-        post = Post.objects(slug=slug, status='published').first()
-        if not post:
-            raise Post.DoesNotExist
-    except Post.DoesNotExist:
-        raise Http404("Post not found")
-    
-    # Increment view count, but do not fail page rendering if persistence errors occur.
+def _published_post(slug):
+    post = Post.objects(slug=slug, status='published').first()
+    if post:
+        # Resolve category and tags up front (one $in query each)
+        prefetch_taxonomy([post])
+    return post
+
+
+def _related_posts(post, limit=4):
+    if post.related_ids:
+        cards = {card.id: card for card in fetch_cards(Post.objects(id__in=post.related_ids, status='published'))}
+        return [cards[pk] for pk in post.related_ids if pk in cards][:limit]
+    # Not scored yet (e.g. bulk-imported): fall back to the same category
+    if post.category:
+        return fetch_cards(Post.objects(status='published', category=post.category).filter(id__ne=post.id)[:limit])
+    return []
+
+
+def _cached_post(slug):
+    # The post comes from the two-tier cache, so a hot review is loaded from
+    # Mongo once even when every worker misses at the same time.
+    return cached_fragment(
+        'detail_post', lambda: _published_post(slug), [TAXONOMY, slug_tag(slug)], parts=(slug,)
+    )
+
+
+def _count_view(request, slug, post=None):
+    """Count a GET of a post, without failing the page if persistence errors occur"""
+    # Edge-cached pages count views from the page script instead
+    if request.method != 'GET' or getattr(request, '_edge_cache', False):
+        return
     try:
-        post.increment_views()
+        post = post or _cached_post(slug)
+        if post:
+            view_counter.record(post.id)
     except Exception:
         pass
+
+
+@edge_cached_page(TAXONOMY, lambda request, slug: slug_tag(slug))
+@conditional_page(detail_validators, not_modified=_count_view)
+def detail(request, slug):
+    post = _cached_post(slug)
+    if not post:
+        raise Http404("Post not found")
+    
+    # Edge-cached pages load the comment form from the page script instead.
+    edge_cache = getattr(request, '_edge_cache', False)
     
-    # Fetch related posts safely; broken/removed category references should not crash page.
-    related_posts = []
+    # Readers revalidating with a 304 are counted by conditional_page
+    _count_view(request, slug, post)
+    
+    # Related posts are precomputed on the post (see blogapp/related.py); failures
+    # such as broken references should not crash the page.
     try:
-        if post.category:
-            related_posts = Post.objects(
-                status='published',
-                category=post.category
-            ).filter(id__ne=post.id)[:4]
+        related_posts = cached_fragment(
+            'related_posts', lambda: _related_posts(post), [POSTS, TAXONOMY], parts=(post.id,)
+        )
     except Exception:
         related_posts = []
     
     try:
-        comments = post.get_comments()
+        comments = cached_fragment(
+            'comments', lambda: list(post.get_comments()), [post_tag(post.id)], parts=(post.id,)
+        )
     except Exception:
         comments = []
     
@@ -106,41 +175,72 @@ def detail(request, slug):
             messages.success(request, 'Your comment has been submitted!')
             return redirect('detail', slug=slug)
     else:
-        form = CommentForm()
+        form = None if edge_cache else CommentForm()
     
     context = {
         'post': post,
         'form': form,
         'comments': comments,
         'related_posts': related_posts,
+        'edge_cache': edge_cache,
     }
-    return render(request, 'detail.html', context)
+    return render_page(request, 'detail.html', context)
+
+
+@csrf_exempt
+@require_POST
+def record_view(request, slug):
+    """View-count beacon sent by edge-cached detail pages"""
+    # Only edge-cached pages send it; otherwise detail counts its own GETs
+    if not settings.DETAIL_EDGE_CACHE:
+        raise Http404("Post not found")
+    post = _cached_post(slug)
+    if not post:
+        raise Http404("Post not found")
+    # One count per address and post per window, so a loop of POSTs cannot inflate views or trending
+    reader = hashlib.md5(f"{request.META.get('REMOTE_ADDR', '')}|{slug}".encode()).hexdigest()
+    if cache.add(f'viewbeacon:{reader}', 1, settings.VIEW_BEACON_WINDOW):
+        view_counter.record(post.id)
+    return HttpResponse(status=204)
+
+
+def comment_form(request, slug):
+    """Per-reader parts of an edge-cached detail page: CSRF token, comment form, messages"""
+    response = JsonResponse({
+        'csrf_token': get_token(request),
+        'form': render_to_string('partials/comment_form.html', {'form': CommentForm()}, request),
+        'messages': render_to_string('partials/messages.html', {}, request),
+    })
+    patch_cache_control(response, private=True, no_store=True)
+    return response
 
 
+@cache_page_by_tags(POSTS, TAXONOMY)
+@conditional_page(category_validators)
 def category_posts(request, slug):
     try:
         category = Category.objects(slug=slug).first()
         if not category:
             raise Category.DoesNotExist
+        identity.register([category])
     except Category.DoesNotExist:
         raise Http404("Category not found")
     
     posts = Post.objects(
         status='published',
         category=category
-    ).order_by('-created_at')
+    )
     
-    # Pagination
-    paginator = Paginator(list(posts), 9)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination: one indexed range query per page
+    paginator = CursorPaginator(posts, 9, fetch=fetch_cards)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'category': category,
         'posts': page_obj,
         'page_obj': page_obj,
     }
-    return render(request, 'category.html', context)
+    return render_page(request, 'category.html', context)
 
 
 def search(request):
@@ -148,38 +248,14 @@ def search(request):
     posts = []
     
     if query:
-        # MongoEngine supports case-insensitive search
-        posts = Post.objects(
-            status='published'
-        ).filter(
-            title__icontains=query
-        ) | Post.objects(
-            status='published'
-        ).filter(
-            content__icontains=query
-        ) | Post.objects(
-            status='published'
-        ).filter(
-            anime_title_jp__icontains=query
-        ) | Post.objects(
-            status='published'
-        ).filter(
-            studio__icontains=query
-        )
-        
-        # Remove duplicates and sort
-        unique_ids = set()
-        unique_posts = []
-        for post in posts.order_by('-created_at'):
-            if str(post.id) not in unique_ids:
-                unique_ids.add(str(post.id))
-                unique_posts.append(post)
-        posts = unique_posts
+        # Relevance-ranked text search; the queryset is paginated server-side
+        posts = search_posts(query)
     
     # Pagination
     paginator = Paginator(posts, 9)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
+    page_obj.object_list = fetch_cards(page_obj.object_list) if query else []
     
     context = {
         'query': query,
@@ -221,30 +297,24 @@ def contact(request):
     return render(request, 'contact.html', context)
 
 
+@cache_page_by_tags(POSTS, TAXONOMY)
+@conditional_page(listing_validators)
 def archive(request):
     # Get all published posts
-    posts = Post.objects(status='published').order_by('-created_at')
+    posts = Post.objects(status='published')
     
-    # Get all categories and tags with post counts
-    categories = []
-    for category in Category.objects():
-        post_count = Post.objects(category=category, status='published').count()
-        if post_count > 0:
-            category.post_count = post_count
-            categories.append(category)
+    # Get all categories and tags with post counts (sidebar fragment)
+    categories, tags = cached_fragment('archive_taxonomy', lambda: (
+        Category.with_post_counts(),
+        Tag.with_post_counts(limit=20),
+    ), [TAXONOMY])
+    identity.register(categories)
+    identity.register(tags)
     
-    tags = []
-    for tag in Tag.objects().order_by('name'):
-        post_count = Post.objects(tags=tag, status='published').count()
-        if post_count > 0:
-            tag.post_count = post_count
-            tags.append(tag)
-    tags = tags[:20]
-    
-    # Pagination
-    paginator = Paginator(list(posts), 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination, plus a total for the archive stats
+    paginator = CursorPaginator(posts, 12, with_count=True, fetch=fetch_cards)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    prefetch_taxonomy(page_obj)
     
     context = {
         'posts': page_obj,
@@ -252,33 +322,35 @@ def archive(request):
         'categories': categories,
         'tags': tags,
     }
-    return render(request, 'archive.html', context)
+    return render_page(request, 'archive.html', context)
 
 
+@cache_page_by_tags(POSTS, TAXONOMY)
+@conditional_page(tag_validators)
 def tag_posts(request, slug):
     try:
         tag = Tag.objects(slug=slug).first()
         if not tag:
             raise Tag.DoesNotExist
+        identity.register([tag])
     except Tag.DoesNotExist:
         raise Http404("Tag not found")
     
     posts = Post.objects(
         status='published',
         tags=tag
-    ).order_by('-created_at')
+    )
     
-    # Pagination
-    paginator = Paginator(list(posts), 9)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Keyset pagination: one indexed range query per page
+    paginator = CursorPaginator(posts, 9, fetch=fetch_cards)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     context = {
         'tag': tag,
         'posts': page_obj,
         'page_obj': page_obj,
     }
-    return render(request, 'tag.html', context)
+    return render_page(request, 'tag.html', context)
 
 
 # Sign up